@@ -1,17 +1,34 @@
-from flask import Flask
+from flask import Flask, request, g
 from flask_cors import CORS
-from apscheduler.schedulers.background import BackgroundScheduler
+import io
 import atexit
+import mimetypes
 import os
 import logging # Import Python's logging module
+from PIL import Image
 
 # Import configurations and blueprints
 import config # from backend/config.py
 from routes.image_routes import image_bp
+from routes.batch_routes import batch_bp
+from routes.upload_routes import upload_bp
+from routes.cluster_routes import cluster_bp
+try:
+    from routes.live_routes import live_bp, sock # Needs flask-sock
+except ImportError:
+    live_bp, sock = None, None
 from utils.cleanup import cleanup_temp_files_job
+from utils import file_helpers, affinity, cancellation
+from services import residency, image_service, encoder
 
+_scheduler = None
 
-def create_app():
+
+def create_app(worker_setup=True):
+    """
+    worker_setup=False leaves restoring sessions and starting background jobs to setup_worker(),
+    for servers that create the app in one process and serve it from another (gunicorn.conf.py).
+    """
     app = Flask(__name__)
 
     # Configure logging
@@ -28,49 +45,48 @@ def create_app():
 
     # Initialize CORS
     # For production, specify origins: CORS(app, origins=["https://yourfrontend.com"])
-    CORS(app, resources={r"/api/*": {"origins": "*"}}) # Allow all for dev on /api prefix
+    # Resumable upload clients read the offset headers
+    CORS(app, resources={r"/api/*": {"origins": "*", "expose_headers": ["Upload-Offset", "Upload-Length", "Location"]}}) # Allow all for dev on /api prefix
 
-    # Create temp_images directory if it doesn't exist
-    if not os.path.exists(config.TEMP_FOLDER):
-        try:
-            os.makedirs(config.TEMP_FOLDER)
-            app.logger.info(f"Created temp_images directory at {config.TEMP_FOLDER}")
-        except OSError as e:
-            app.logger.error(f"Error creating temp_images directory {config.TEMP_FOLDER}: {e}")
-            # Potentially raise an error or exit if this is critical
+    # Create temp_images (and the working/version storage roots) if they don't exist
+    try:
+        for directory in file_helpers.ensure_storage_dirs():
+            app.logger.info(f"Storage directory ready at {directory}")
+    except OSError as e:
+        app.logger.error(f"Error creating storage directories under {config.TEMP_FOLDER}: {e}")
+        # Potentially raise an error or exit if this is critical
+
+    # Every request counts as activity, so background work (speculation) waits for uploads,
+    # undo/redo and downloads too, not just the cancellable operations.
+    # A live WebSocket stays open for the whole editing session and would hold it off for good.
+    @app.before_request
+    def _mark_request_running():
+        if request.headers.get('Upgrade', '').lower() != 'websocket':
+            cancellation.request_started()
+            g.request_running = True
+
+    @app.teardown_request
+    def _mark_request_finished(error=None):
+        if g.pop('request_running', False):
+            cancellation.request_finished()
 
     # Register Blueprints
     app.register_blueprint(image_bp)
     app.logger.info("Image blueprint registered.")
-
-    # Initialize and start APScheduler for background tasks
-    scheduler = BackgroundScheduler(daemon=True) # daemon=True allows app to exit even if scheduler thread is running
-    
-    # Check if scheduler is already running to prevent multiple instances during reloads
-    # This check might not be fully effective with some Flask dev server reloaders.
-    # A more robust way is to ensure scheduler is initialized once globally.
-    if not hasattr(app, 'scheduler_running') or not app.scheduler_running:
-        scheduler.add_job(
-            func=cleanup_temp_files_job,
-            trigger="interval",
-            hours=config.SESSION_TIMEOUT_HOURS,
-            id="cleanup_job", # Give the job an ID
-            replace_existing=True # Important for reloads
-        )
-        try:
-            scheduler.start()
-            app.scheduler_running = True # Mark that scheduler has been started
-            app.logger.info(f"APScheduler started. Cleanup job scheduled every {config.SESSION_TIMEOUT_HOURS} hour(s).")
-        except Exception as e:
-            app.logger.error(f"Failed to start APScheduler: {e}")
-            app.scheduler_running = False
-
-        # Ensure scheduler shuts down gracefully when the app exits
-        atexit.register(lambda: scheduler.shutdown() if app.scheduler_running and scheduler.running else None)
-    
+    app.register_blueprint(batch_bp)
+    app.logger.info("Batch blueprint registered.")
+    app.register_blueprint(upload_bp)
+    app.logger.info("Resumable upload blueprint registered.")
+    app.register_blueprint(cluster_bp)
+    if sock:
+        sock.init_app(app)
+        app.register_blueprint(live_bp)
+        app.logger.info("Live adjustment WebSocket registered.")
     else:
-        app.logger.info("APScheduler already running or marked as such.")
+        app.logger.warning("flask-sock not installed; live adjustment WebSocket disabled.")
 
+    if worker_setup:
+        setup_worker(app)
 
     @app.route('/')
     def health_check():
@@ -79,13 +95,79 @@ def create_app():
 
     return app
 
+
+def setup_worker(app):
+    """Per serving process: restores journaled sessions and starts the background jobs (once)."""
+    global _scheduler
+    # Bring back the sessions (and their undo/redo history) that were live before a restart.
+    # Behind the cluster router each process loads only the sessions it owns, on first use.
+    if not affinity.get_node_id():
+        try:
+            restored, dropped = image_service.restore_sessions()
+            if restored or dropped:
+                app.logger.info(f"Session journal: restored {restored} sessions, dropped {dropped} without a working file.")
+        except Exception as e:
+            app.logger.error(f"Could not restore sessions from the session journal: {e}", exc_info=True)
+
+    if _scheduler is not None:
+        app.logger.info("APScheduler already running in this process.")
+        return
+    # Imported here: a preloading master process never runs the jobs
+    from apscheduler.schedulers.background import BackgroundScheduler
+    scheduler = BackgroundScheduler(daemon=True) # daemon=True allows app to exit even if scheduler thread is running
+    # Processes sharing TEMP_FOLDER (cluster nodes) each run the cleanup for the sessions they
+    # own (see utils/cleanup.py)
+    scheduler.add_job(
+        func=cleanup_temp_files_job,
+        trigger="interval",
+        hours=config.SESSION_TIMEOUT_HOURS,
+        id="cleanup_job", # Give the job an ID
+        replace_existing=True # Important for reloads
+    )
+    scheduler.add_job(
+        func=residency.demote_idle_sessions,
+        trigger="interval",
+        seconds=config.RESIDENCY_SWEEP_SECONDS,
+        id="residency_job",
+        replace_existing=True
+    )
+    try:
+        scheduler.start()
+        _scheduler = scheduler
+        app.logger.info(f"APScheduler started. Cleanup job scheduled every {config.SESSION_TIMEOUT_HOURS} hour(s).")
+    except Exception as e:
+        app.logger.error(f"Failed to start APScheduler: {e}")
+        return
+
+    # Ensure scheduler shuts down gracefully when the app exits
+    atexit.register(lambda: scheduler.shutdown() if scheduler.running else None)
+
+
+def warm_up(app):
+    """
+    Does what would otherwise slow down the first requests: Pillow plugin registration, codec
+    initialization for every output format, the MIME type table (read from disk on first use by
+    downloads), Flask's URL map. Starts no threads, so it is safe before gunicorn forks the worker.
+    """
+    Image.init()
+    mimetypes.init()
+    sample = Image.new('RGB', (16, 16))
+    for target_format in dict.fromkeys(encoder.normalize_format(f) for f in encoder.SUPPORTED_OUTPUT_FORMATS):
+        data, _ = encoder.encode_image(sample, target_format)
+        with Image.open(io.BytesIO(data)) as decoded:
+            decoded.load()
+    with app.test_client() as client:
+        client.get('/')
+
 # This part is for running with `python app.py` directly (Flask's dev server)
 # For production, you'd use a WSGI server like Gunicorn.
 if __name__ == '__main__':
-    flask_app = create_app()
+    debug = os.environ.get('FLASK_DEBUG', 'True').lower() == 'true'
+    # The debug reloader runs this script twice; only the child it restarts serves requests
+    flask_app = create_app(worker_setup=not debug or os.environ.get('WERKZEUG_RUN_MAIN') == 'true')
     # Use environment variables for host/port/debug for more flexibility
     flask_app.run(
-        debug=os.environ.get('FLASK_DEBUG', 'True').lower() == 'true',
+        debug=debug,
         host=os.environ.get('FLASK_HOST', '0.0.0.0'),
         port=int(os.environ.get('FLASK_PORT', 5001))
     )
\ No newline at end of file
@@ -0,0 +1,340 @@
+"""
+ASGI serving mode: uvicorn asgi:app --host 0.0.0.0 --port 5001
+
+Serves the same /api routes as the WSGI app, but only the route code holds a thread. On the
+event loop: receiving request bodies (slow uploads are spooled before a thread is taken),
+sending responses (downloads are read and sent in pieces without a thread; generated
+responses such as exports take one only while producing each piece), watching for client
+disconnects and the idle time of live adjustment WebSockets. The routes, and the image_service
+operations they run, go to a thread pool of ASGI_THREADS, and from there to the compute worker
+processes when COMPUTE_PROCESSES is set.
+
+One process per node, as with gunicorn (gunicorn.conf.py): sessions live in its memory.
+"""
+import asyncio
+import contextvars
+import json
+import re
+import sys
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import config # Imports from backend/config.py
+from app import create_app, setup_worker, warm_up
+
+try:
+    from routes import live_routes # Needs flask-sock, like the WSGI channel
+except ImportError:
+    live_routes = None
+
+flask_app = create_app(worker_setup=False)
+_executor = ThreadPoolExecutor(max_workers=config.ASGI_THREADS, thread_name_prefix='asgi')
+
+# Flask applies the exact limits per route; this only stops bodies no route would accept
+MAX_BODY_BYTES = max(config.MAX_CONTENT_LENGTH, config.BATCH_MAX_CONTENT_LENGTH)
+LIVE_PATH = re.compile(r'^/api/live/([^/]+)/([^/]+)$')
+
+
+class _FileWrapper:
+    """wsgi.file_wrapper: lets file responses (send_file) be recognized and streamed on the loop."""
+    def __init__(self, filelike, block_size=8192):
+        self.filelike = filelike
+        self.block_size = block_size
+
+    def __iter__(self):
+        while True:
+            data = self.filelike.read(self.block_size)
+            if not data:
+                return
+            yield data
+
+    def close(self):
+        if hasattr(self.filelike, 'close'):
+            self.filelike.close()
+
+
+async def app(scope, receive, send):
+    if scope['type'] == 'http':
+        await _handle_http(scope, receive, send)
+    elif scope['type'] == 'websocket':
+        await _handle_websocket(scope, receive, send)
+    elif scope['type'] == 'lifespan':
+        await _handle_lifespan(receive, send)
+
+
+async def _handle_lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            try:
+                warm_up(flask_app)
+                setup_worker(flask_app)
+            except Exception as e:
+                await send({'type': 'lifespan.startup.failed', 'message': str(e)})
+                return
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            _executor.shutdown(wait=False)
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+def _offload(ctx, func, *args):
+    """
+    Runs func on the executor within ctx. Each request or channel keeps one context for all its
+    calls, as a thread would: a streamed response's generator holds Flask's request context in it.
+    """
+    return asyncio.get_running_loop().run_in_executor(_executor, ctx.run, func, *args)
+
+
+async def _send_json_response(send, status, payload):
+    body = json.dumps(payload).encode()
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode())]})
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def _receive_body(receive, declared_length):
+    """
+    Reads the request body into a spooled file. Returns (body, complete); a body cut short by a
+    disconnect is still returned, so routes that keep partial input (resumable uploads) can.
+    Returns (None, False) for a body over MAX_BODY_BYTES.
+    """
+    body = tempfile.SpooledTemporaryFile(max_size=config.ASGI_BODY_SPOOL_BYTES, dir=config.TEMP_FOLDER)
+    received = 0
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            body.seek(0)
+            return body, False
+        chunk = message.get('body', b'')
+        received += len(chunk)
+        if received > MAX_BODY_BYTES or (declared_length is not None and received > declared_length):
+            body.close()
+            return None, False
+        if chunk:
+            body.write(chunk)
+        if not message.get('more_body', False):
+            body.seek(0)
+            return body, True
+
+
+def _build_environ(scope, body, content_length, disconnected):
+    # Strings as WSGI wants them: the raw bytes, decoded as latin-1
+    path = scope['path']
+    root_path = scope.get('root_path', '')
+    if root_path and path.startswith(root_path):
+        path = path[len(root_path):]
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': root_path.encode('utf-8').decode('latin-1'),
+        'PATH_INFO': path.encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': str(server[0]),
+        'SERVER_PORT': str(server[1]) if server[1] is not None else '80',
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': client[0],
+        'REMOTE_PORT': str(client[1]),
+        'CONTENT_LENGTH': str(content_length),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': body,
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+        'wsgi.file_wrapper': _FileWrapper,
+        'haguma.disconnect_probe': disconnected.is_set,
+    }
+    for name, value in scope['headers']:
+        key = name.decode('latin-1').upper().replace('-', '_')
+        if key in ('CONTENT_LENGTH', 'CONTENT_TYPE'):
+            if key == 'CONTENT_TYPE':
+                environ[key] = value.decode('latin-1')
+            continue
+        key = 'HTTP_' + key
+        value = value.decode('latin-1')
+        environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+
+def _call_app(environ):
+    # The whole WSGI call on the executor; start_response always runs before Flask returns
+    started = {}
+    def start_response(status, headers, exc_info=None):
+        started['status'] = int(status.split(' ', 1)[0])
+        started['headers'] = [(name.encode('latin-1'), value.encode('latin-1')) for name, value in headers]
+        return lambda data: None # write() is unused by Flask
+    result = flask_app(environ, start_response)
+    return started, result
+
+
+async def _watch_disconnect(receive, disconnected):
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            disconnected.set()
+            return
+
+
+async def _handle_http(scope, receive, send):
+    headers = dict(scope['headers'])
+    declared_length = headers.get(b'content-length')
+    try:
+        declared_length = int(declared_length) if declared_length is not None else None
+    except ValueError:
+        await _send_json_response(send, 400, {"error": "Invalid Content-Length."})
+        return
+    if declared_length is not None and declared_length > MAX_BODY_BYTES:
+        await _send_json_response(send, 413, {"error": "Request body too large."})
+        return
+
+    body, complete = await _receive_body(receive, declared_length)
+    if body is None:
+        await _send_json_response(send, 413, {"error": "Request body too large."})
+        return
+
+    disconnected = threading.Event()
+    if complete:
+        watcher = asyncio.ensure_future(_watch_disconnect(receive, disconnected))
+        content_length = body.seek(0, 2)
+    else:
+        # A body cut short keeps its declared length, so the route sees the client disconnect
+        watcher = None
+        disconnected.set()
+        content_length = declared_length if declared_length is not None else body.seek(0, 2)
+    body.seek(0)
+
+    environ = _build_environ(scope, body, content_length, disconnected)
+    ctx = contextvars.copy_context()
+    result = None
+    try:
+        started, result = await _offload(ctx, _call_app, environ)
+        if disconnected.is_set():
+            return
+        await send({'type': 'http.response.start', 'status': started['status'], 'headers': started['headers']})
+        if isinstance(result, _FileWrapper):
+            # Local files: read on the loop, a piece at a time, while the client keeps up
+            chunk_size = max(result.block_size, config.ASGI_FILE_CHUNK_BYTES)
+            while not disconnected.is_set():
+                chunk = result.filelike.read(chunk_size)
+                if not chunk:
+                    break
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+        else:
+            # Generated bodies (exports, batch progress) may work per piece; that work stays off the loop
+            iterator = iter(result)
+            sentinel = object()
+            while not disconnected.is_set():
+                chunk = await _offload(ctx, next, iterator, sentinel)
+                if chunk is sentinel:
+                    break
+                if chunk:
+                    await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+        if not disconnected.is_set():
+            await send({'type': 'http.response.body', 'body': b''})
+    finally:
+        if watcher is not None:
+            watcher.cancel()
+        if result is not None and hasattr(result, 'close'):
+            await _offload(ctx, result.close)
+        body.close()
+
+
+class _Inbox:
+    """Messages received on a WebSocket, for the live channel's non-blocking drain."""
+    def __init__(self):
+        self.queue = asyncio.Queue()
+        self.closed = False
+
+    async def get(self):
+        if self.closed:
+            return None
+        raw = await self.queue.get()
+        if raw is None:
+            self.closed = True
+        return raw
+
+    def poll(self):
+        if self.closed or self.queue.empty():
+            return None
+        raw = self.queue.get_nowait()
+        if raw is None:
+            self.closed = True
+        return raw
+
+
+async def _read_websocket(receive, inbox):
+    while True:
+        message = await receive()
+        if message['type'] == 'websocket.disconnect':
+            break
+        if message['type'] == 'websocket.receive':
+            raw = message.get('text')
+            await inbox.queue.put(raw if raw is not None else message.get('bytes'))
+    await inbox.queue.put(None)
+
+
+async def _send_ws(send, payload):
+    if isinstance(payload, bytes):
+        await send({'type': 'websocket.send', 'bytes': payload})
+    else:
+        await send({'type': 'websocket.send', 'text': json.dumps(payload)})
+
+
+def _in_app_context(func, *args):
+    with flask_app.app_context():
+        return func(*args)
+
+
+async def _handle_websocket(scope, receive, send):
+    match = LIVE_PATH.match(scope['path'])
+    message = await receive()
+    if message['type'] != 'websocket.connect':
+        return
+    if match is None or live_routes is None:
+        await send({'type': 'websocket.close', 'code': 1008})
+        return
+    await send({'type': 'websocket.accept'})
+    image_session_id, original_extension = match.groups()
+
+    # The same steps as live_routes.live_adjust_route; between messages the channel holds no thread
+    inbox = _Inbox()
+    ctx = contextvars.copy_context()
+    reader = asyncio.ensure_future(_read_websocket(receive, inbox))
+    live = None
+    try:
+        try:
+            live = await _offload(ctx, _in_app_context, live_routes.open_live_session, image_session_id, original_extension)
+        except FileNotFoundError:
+            await _send_ws(send, live_routes.session_not_found_payload())
+            return
+        await _send_ws(send, live_routes.ready_payload(live))
+
+        while True:
+            raw = await inbox.get()
+            if raw is None:
+                return
+            try:
+                message = live_routes.next_message(raw, inbox.poll)
+            except (ValueError, TypeError) as e:
+                await _send_ws(send, {"type": "error", "error": str(e)})
+                continue
+
+            wait = live_routes.frame_wait(live, message)
+            if wait > 0:
+                await asyncio.sleep(wait)
+            payloads, keep_open = await _offload(ctx, _in_app_context, live_routes.handle_message, live, message)
+            for payload in payloads:
+                await _send_ws(send, payload)
+            if not keep_open:
+                return
+    finally:
+        reader.cancel()
+        if live is not None:
+            live_routes.close_live_session(live)
+        if not inbox.closed:
+            await send({'type': 'websocket.close', 'code': 1000})
@@ -0,0 +1,185 @@
+"""
+Offline batch processor: applies an editor recipe to whole directories without Flask.
+
+    python batch_cli.py --input photos/ --output out/ \
+        --recipe '[{"op": "resize", "params": {"percentage": 50}}]' --format jpeg
+
+The recipe uses the same operation names and params as POST /api/batch (see
+services/operations.py) and may also be given as @recipe.json.
+Files whose content, recipe and format match an entry in the output directory's
+manifest are skipped, so the command is safe to re-run from cron.
+"""
+import os
+import sys
+import glob
+import json
+import time
+import hashlib
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from PIL import Image
+import config # Imports from backend/config.py
+from services import image_service, operations, version_store, encoder, animation
+from utils import file_helpers
+
+MANIFEST_FILENAME = '.haguma_manifest.json'
+MANIFEST_FLUSH_EVERY = 50 # Completed files between manifest writes
+
+
+def _load_recipe(value):
+    if value.startswith('@'):
+        with open(value[1:], 'r') as f:
+            value = f.read()
+    try:
+        steps = json.loads(value)
+    except ValueError:
+        raise ValueError("Recipe must be valid JSON (or @path to a JSON file).")
+    return steps, operations.parse_recipe(steps)
+
+
+def _collect_inputs(pattern):
+    """Returns (base_dir, [input paths]) for a directory or a glob pattern."""
+    if os.path.isdir(pattern):
+        base_dir = pattern
+        paths = [entry.path for entry in file_helpers.iter_files(pattern)]
+    else:
+        paths = [p for p in glob.glob(pattern, recursive=True) if os.path.isfile(p)]
+        base_dir = os.path.commonpath([os.path.dirname(os.path.abspath(p)) for p in paths]) if paths else '.'
+    paths = sorted(p for p in paths if image_service.allowed_file(os.path.basename(p)))
+    return base_dir, paths
+
+
+def _load_manifest(output_dir):
+    manifest_path = os.path.join(output_dir, MANIFEST_FILENAME)
+    if not os.path.exists(manifest_path):
+        return {}
+    with open(manifest_path, 'r') as f:
+        return json.load(f)
+
+
+def _save_manifest(output_dir, manifest):
+    manifest_path = os.path.join(output_dir, MANIFEST_FILENAME)
+    file_helpers.atomic_write_bytes(manifest_path, json.dumps(manifest, indent=1, sort_keys=True).encode('utf-8'))
+
+
+def _process_file(input_path, output_stem, recipe, target_format, preset=None, target_bytes=None):
+    """
+    Worker: runs the recipe on one file and writes the result next to output_stem.
+    Returns (output_path, output_bytes). Runs in a separate process.
+    """
+    with Image.open(input_path) as img:
+        img.load()
+        source_format = img.format
+        result_img = image_service.run_recipe(img, recipe)
+
+    if isinstance(result_img, animation.AnimatedFrames):
+        extension = encoder.normalize_format(target_format) if target_format else os.path.splitext(input_path)[1].lstrip('.').lower()
+        if extension.upper() in animation.ANIMATED_FORMATS:
+            output_path = f"{output_stem}.{extension}"
+            animation.save(result_img, output_path) # Encoder presets don't apply to animations
+            return output_path, os.path.getsize(output_path)
+        result_img = result_img.frames[0] # A still format gets the first frame
+
+    if target_format:
+        data, info = encoder.encode_image(result_img, target_format, preset=preset, target_bytes=target_bytes)
+        output_path = f"{output_stem}.{info['extension']}"
+        file_helpers.atomic_write_bytes(output_path, data)
+    else:
+        output_path = f"{output_stem}.{os.path.splitext(input_path)[1].lstrip('.').lower()}"
+        file_helpers.atomic_save_image(result_img, output_path, format=source_format)
+    return output_path, os.path.getsize(output_path)
+
+
+def run(input_pattern, output_dir, recipe_steps, recipe, target_format=None, workers=None, force=False, preset=None, target_bytes=None):
+    """Processes every matching file and returns (processed, skipped, failed)."""
+    base_dir, input_paths = _collect_inputs(input_pattern)
+    if not input_paths:
+        print(f"No {', '.join(sorted(config.ALLOWED_EXTENSIONS))} files found for {input_pattern}")
+        return 0, 0, 0
+
+    os.makedirs(output_dir, exist_ok=True)
+    manifest = {} if force else _load_manifest(output_dir)
+    # The manifest key ties a result to the exact input bytes, recipe and output format
+    recipe_key = hashlib.sha1(json.dumps([recipe_steps, target_format, preset, target_bytes], sort_keys=True).encode('utf-8')).hexdigest()[:16]
+
+    total = len(input_paths)
+    processed = skipped = failed = 0
+    bytes_in = bytes_out = 0
+    started = time.monotonic()
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {}
+        for input_path in input_paths:
+            key = f"{version_store.hash_file(input_path)}:{recipe_key}"
+            relative_path = os.path.relpath(os.path.abspath(input_path), os.path.abspath(base_dir))
+            previous_output = manifest.get(key)
+            if previous_output and os.path.exists(os.path.join(output_dir, previous_output)):
+                skipped += 1
+                print(f"[{processed + skipped + failed:>{len(str(total))}}/{total}] skip {relative_path}")
+                continue
+            output_stem = os.path.join(output_dir, os.path.splitext(relative_path)[0])
+            future = executor.submit(_process_file, input_path, output_stem, recipe, target_format, preset, target_bytes)
+            futures[future] = (key, input_path, relative_path)
+
+        completed_since_flush = 0
+        try:
+            for future in as_completed(futures):
+                key, input_path, relative_path = futures[future]
+                done = processed + skipped + failed + 1
+                try:
+                    output_path, output_size = future.result()
+                except Exception as e:
+                    failed += 1
+                    print(f"[{done:>{len(str(total))}}/{total}] FAIL {relative_path}: {e}", file=sys.stderr)
+                    continue
+                processed += 1
+                bytes_in += os.path.getsize(input_path)
+                bytes_out += output_size
+                manifest[key] = os.path.relpath(output_path, output_dir)
+                print(f"[{done:>{len(str(total))}}/{total}] ok   {relative_path} -> {manifest[key]} ({output_size / 1024:.0f} KB)")
+
+                completed_since_flush += 1
+                if completed_since_flush >= MANIFEST_FLUSH_EVERY:
+                    _save_manifest(output_dir, manifest)
+                    completed_since_flush = 0
+        finally:
+            # Keep whatever finished, even if interrupted
+            _save_manifest(output_dir, manifest)
+
+    elapsed = max(time.monotonic() - started, 1e-6)
+    print(
+        f"Processed {processed} images ({skipped} skipped, {failed} failed) in {elapsed:.2f}s: "
+        f"{processed / elapsed:.1f} images/s, {bytes_in / elapsed / (1024 * 1024):.1f} MB/s read, "
+        f"{bytes_out / elapsed / (1024 * 1024):.1f} MB/s written"
+    )
+    return processed, skipped, failed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Apply an editor recipe to many images without the web app.")
+    parser.add_argument('--input', '-i', required=True, help="Input directory or glob pattern (quote it), e.g. 'photos/**/*.jpg'")
+    parser.add_argument('--output', '-o', required=True, help="Output directory (also holds the skip manifest)")
+    parser.add_argument('--recipe', '-r', required=True, help="Recipe JSON, or @path/to/recipe.json")
+    parser.add_argument('--format', '-f', choices=encoder.SUPPORTED_OUTPUT_FORMATS, help="Output format (default: keep each file's format)")
+    parser.add_argument('--preset', '-p', help="Encoder preset for --format, e.g. web, high, small, lossless, optimized")
+    parser.add_argument('--target-kb', type=int, default=None, help="Largest output size in KB (jpeg/webp); quality is searched to fit")
+    parser.add_argument('--workers', '-w', type=int, default=None, help="Worker processes (default: CPU count)")
+    parser.add_argument('--force', action='store_true', help="Ignore the manifest and reprocess every file")
+    args = parser.parse_args(argv)
+
+    try:
+        recipe_steps, recipe = _load_recipe(args.recipe)
+        if args.preset or args.target_kb:
+            if not args.format:
+                raise ValueError("--preset and --target-kb need --format.")
+            encoder.get_save_options(args.format, args.preset)
+    except (OSError, ValueError) as e:
+        parser.error(str(e))
+
+    target_bytes = args.target_kb * 1024 if args.target_kb else None
+    _, _, failed = run(args.input, args.output, recipe_steps, recipe, args.format, args.workers, args.force, args.preset, target_bytes)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,162 @@
+"""
+Fits the CPU cost model (utils/cost_model.py) to this machine.
+
+    python calibrate_costs.py                          # writes config.COST_MODEL_PATH
+    python calibrate_costs.py --sizes 800x600,4000x3000 --repeat 5 --output /tmp/costs.json
+
+Times every registered operation (services/operations.py) and the working-file decode and
+encode of each format on photo-like test images of several sizes, one thread at a time, and
+fits a fixed overhead plus a rate per megapixel for each kind of work. Running servers pick the
+file up when they start. Run it on the hardware that serves requests, while it is otherwise idle.
+"""
+import io
+import os
+import sys
+import time
+import argparse
+import tempfile
+import PIL
+from PIL import Image
+import config # Imports from backend/config.py
+from services import operations, encoder
+from utils import cost_model, file_helpers
+from loadtest import make_test_image
+
+# (operation, JSON params) timed at every size. Each one's work must be known apart from one kind
+# (e.g. the smart crop's search, on top of the crop), which its timings are used to fit.
+SAMPLES = [
+    ('rotate', {'angle': 90}),
+    ('rotate', {'angle': 180}),
+    ('flip', {'axis': 'horizontal'}),
+    ('crop', {'preset': 'square'}),
+    ('crop', {'preset': 'square', 'anchor': 'smart'}),
+    ('resize', {'percentage': 50}),
+    ('resize', {'percentage': 150}),
+    ('grayscale', {'intensity': 100}),
+    ('brightness', {'level': 30}),
+    ('contrast', {'level': 30}),
+    ('filter', {'type': 'blur', 'intensity': 40}),
+    ('filter', {'type': 'sharpen', 'intensity': 50}),
+    ('auto', {'mode': 'levels'}),
+]
+FORMATS = ['jpeg', 'png', 'webp', 'gif'] # Working-file formats (uploads keep theirs)
+
+
+def _time(fn, repeat):
+    """Fastest of repeat runs, in seconds: the least disturbed by anything else on the machine."""
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def _measure(images, repeat, folder):
+    """Returns [(label, [(kind, megapixels), ...], seconds), ...]."""
+    measurements = []
+    for img in images:
+        width, height = img.size
+        for op, params in SAMPLES:
+            operation = operations.OPERATIONS[op]
+            kwargs = operation.parse(params)
+            seconds = _time(lambda: operation.apply(img, **kwargs), repeat)
+            measurements.append((f"{op} {params} {width}x{height}", operation.work(width, height, kwargs), seconds))
+        megapixels = width * height / 1e6
+        for file_format in FORMATS:
+            if file_format not in encoder.SUPPORTED_OUTPUT_FORMATS:
+                continue
+            # The same calls residency makes for a working file
+            path = os.path.join(folder, f"calibration.{file_format}")
+            seconds = _time(lambda: file_helpers.atomic_save_image(img, path), repeat)
+            measurements.append((f"encode {file_format} {width}x{height}", [(f'encode-{file_format}', megapixels)], seconds))
+
+            def decode():
+                with Image.open(path) as decoded:
+                    decoded.load()
+            seconds = _time(decode, repeat)
+            measurements.append((f"decode {file_format} {width}x{height}", [(f'decode-{file_format}', megapixels)], seconds))
+    return measurements
+
+
+def _seconds(coefficients, work):
+    return sum(coefficients[kind][0] + coefficients[kind][1] * megapixels for kind, megapixels in work)
+
+
+def _fit_line(points):
+    """Least-squares (fixed, per megapixel) through [(megapixels, seconds), ...], fixed >= 0."""
+    n = len(points)
+    mean_x = sum(x for x, _ in points) / n
+    mean_y = sum(y for _, y in points) / n
+    spread = sum((x - mean_x) ** 2 for x, _ in points)
+    rate = sum((x - mean_x) * (y - mean_y) for x, y in points) / spread if spread else 0.0
+    fixed = mean_y - rate * mean_x
+    if fixed < 0 or rate < 0:
+        # Through the origin instead: a negative overhead is noise in the small sizes
+        fixed = 0.0
+        rate = max(0.0, sum(x * y for x, y in points) / (sum(x * x for x, _ in points) or 1.0))
+    return fixed, rate
+
+
+def fit(measurements):
+    """{kind: (fixed seconds, seconds per megapixel)}; kinds are fitted once the rest of their samples' work is."""
+    coefficients = {}
+    pending = list(measurements)
+    while pending:
+        points = {}
+        for label, work, seconds in pending:
+            unknown = {kind for kind, _ in work if kind not in coefficients}
+            if len(unknown) == 1:
+                kind = unknown.pop()
+                known = [(k, mp) for k, mp in work if k != kind]
+                megapixels = sum(mp for k, mp in work if k == kind)
+                points.setdefault(kind, []).append((megapixels, max(0.0, seconds - _seconds(coefficients, known))))
+        if not points:
+            raise ValueError(f"Can't fit: {', '.join(label for label, _, _ in pending)}")
+        for kind, kind_points in points.items():
+            coefficients[kind] = _fit_line(kind_points)
+        pending = [m for m in pending if any(kind not in coefficients for kind, _ in m[1])]
+    return coefficients
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Fit the operation cost model to this machine.")
+    parser.add_argument('--sizes', default='640x480,1600x1200,3200x2400',
+                        help="Test image sizes as WxH,... (default: %(default)s)")
+    parser.add_argument('--repeat', '-r', type=int, default=3, help="Timed runs per measurement; the fastest counts")
+    parser.add_argument('--output', '-o', default=config.COST_MODEL_PATH, help="Where to write the fit (default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    try:
+        sizes = [tuple(int(v) for v in size.lower().split('x')) for size in args.sizes.split(',')]
+    except ValueError:
+        parser.error("--sizes must look like 640x480,1600x1200")
+    if len(sizes) < 2:
+        parser.error("--sizes needs at least two sizes to separate overhead from per-pixel cost")
+
+    print("Generating test images...")
+    images = [Image.open(io.BytesIO(make_test_image(width, height, 'png'))).convert('RGB') for width, height in sizes]
+
+    print(f"Timing {len(SAMPLES)} operations and {len(FORMATS)} formats at {len(sizes)} sizes...")
+    with tempfile.TemporaryDirectory() as folder:
+        measurements = _measure(images, args.repeat, folder)
+    coefficients = fit(measurements)
+
+    print(f"\n{'kind':<14}{'fixed ms':>10}{'ms / MP':>10}")
+    for kind in sorted(coefficients):
+        fixed, rate = coefficients[kind]
+        print(f"{kind:<14}{fixed * 1000:>10.2f}{rate * 1000:>10.2f}")
+    worst = max(measurements, key=lambda m: abs(_seconds(coefficients, m[1]) - m[2]) / max(m[2], 1e-3))
+    error = abs(_seconds(coefficients, worst[1]) - worst[2]) / max(worst[2], 1e-3)
+    print(f"\nLargest relative error: {error:.0%} ({worst[0]})")
+
+    cost_model.save_coefficients(
+        {kind: list(value) for kind, value in coefficients.items()}, args.output,
+        {"sizes": [f"{w}x{h}" for w, h in sizes], "pillow": PIL.__version__})
+    print(f"Written to {args.output}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
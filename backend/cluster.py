@@ -0,0 +1,444 @@
+"""
+Runs several backend processes on this machine behind a session-affinity router.
+
+    python cluster.py --processes 4 --port 5001              # router on :5001, backends on :5101, :5102, ...
+    python cluster.py --processes 4 --gunicorn               # backends under gunicorn instead of the dev server
+    python cluster.py --processes 4 --asgi                   # backends under uvicorn (asgi.py)
+    curl -X POST localhost:5001/api/cluster/scale -H "X-Haguma-Cluster-Token: $HAGUMA_CLUSTER_TOKEN" -d '{"processes": 6}'
+    curl localhost:5001/api/cluster/status -H "X-Haguma-Cluster-Token: $HAGUMA_CLUSTER_TOKEN"
+
+Every request whose URL carries a session (or upload / batch) id goes to the process owning that id
+on a consistent-hash ring (utils/affinity.py); other requests are spread round-robin. Processes
+mint new ids they own, and on a ring change each one releases the sessions it no longer owns; the
+new owner loads them (with their undo/redo history) from the shared session journal on first use.
+While the ring changes, only requests for ids that move are held, until in-flight requests for them
+have finished and every process has the new ring. Crashed processes are restarted.
+
+All processes share TEMP_FOLDER, the version store and the session journal, so they must run on
+one machine (or share those directories). The /api/cluster admin calls need HAGUMA_CLUSTER_TOKEN
+set when starting the router (the backends get the same token) and are refused without it.
+"""
+import os
+import re
+import hmac
+import sys
+import json
+import time
+import select
+import signal
+import socket
+import secrets
+import argparse
+import itertools
+import threading
+import subprocess
+import urllib.error
+import urllib.request
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import config # For the cluster token
+from utils.affinity import HashRing
+
+# The id in these URLs decides the owning process
+ROUTED_PATH = re.compile(r'^/api/(?:process|download|region|histogram|export|live|uploads|batch)/([0-9a-fA-F-]{36})(?:[/?]|$)')
+HOP_BY_HOP_HEADERS = {'connection', 'keep-alive', 'proxy-connection', 'proxy-authorization', 'te', 'trailer', 'upgrade'}
+PIPE_BYTES = 64 * 1024
+HEALTH_POLL_SECONDS = 0.2
+SUPERVISE_SECONDS = 1.0
+
+
+class Node:
+    def __init__(self, node_id, port):
+        self.node_id = node_id
+        self.port = port
+        self.process = None
+        self.ready = False # Started and holding the current ring
+        self.restarts = 0
+
+
+class Cluster:
+    def __init__(self, args):
+        self.args = args
+        # Shared with the backends for the ring pushes; without a configured one, admin calls are off
+        self.token = config.CLUSTER_TOKEN or secrets.token_hex(16)
+        self.nodes = {} # node_id -> Node
+        self.ring = None
+        self._pending_ring = None # Ring being rolled out; requests whose owner changes wait for it
+        self._condition = threading.Condition()
+        self._inflight = Counter() # routing key (None for keyless requests) -> requests being proxied
+        self._rebalance_lock = threading.Lock()
+        self._round_robin = itertools.count()
+        self._stopping = False
+
+    # --- Processes ---
+
+    def _start(self, node):
+        env = dict(os.environ,
+                   HAGUMA_NODE_ID=node.node_id,
+                   HAGUMA_CLUSTER_TOKEN=self.token,
+                   FLASK_HOST='127.0.0.1',
+                   FLASK_PORT=str(node.port),
+                   FLASK_DEBUG='false')
+        if self.args.asgi:
+            env['HAGUMA_ASGI_THREADS'] = str(self.args.threads)
+            command = [sys.executable, '-m', 'uvicorn', 'asgi:app', '--host', '127.0.0.1', '--port', str(node.port)]
+        elif self.args.gunicorn:
+            # Preloaded and warmed up per gunicorn.conf.py; a crashed worker is re-forked warm
+            command = ['gunicorn', '-c', 'gunicorn.conf.py', '--bind', f'127.0.0.1:{node.port}', '--threads', str(self.args.threads)]
+        else:
+            command = [sys.executable, 'app.py']
+        node.ready = False
+        node.process = subprocess.Popen(command, cwd=os.path.dirname(os.path.abspath(__file__)), env=env)
+
+    def _wait_healthy(self, node):
+        deadline = time.monotonic() + self.args.startup_timeout
+        while time.monotonic() < deadline:
+            if node.process.poll() is not None:
+                raise RuntimeError(f"{node.node_id} exited with code {node.process.returncode} during startup.")
+            try:
+                with urllib.request.urlopen(f'http://127.0.0.1:{node.port}/', timeout=2):
+                    return
+            except (urllib.error.URLError, OSError):
+                time.sleep(HEALTH_POLL_SECONDS)
+        raise RuntimeError(f"{node.node_id} did not answer on port {node.port} within {self.args.startup_timeout}s.")
+
+    def _push_ring(self, node, members):
+        request = urllib.request.Request(
+            f'http://127.0.0.1:{node.port}/api/cluster/ring',
+            data=json.dumps({"members": members}).encode('utf-8'),
+            headers={'Content-Type': 'application/json', 'X-Haguma-Cluster-Token': self.token},
+            method='POST')
+        # Releasing waits for each moving session's running operation, so allow for the longest one
+        with urllib.request.urlopen(request, timeout=self.args.drain_timeout + 60) as response:
+            return json.loads(response.read())["released"]
+
+    def _stop(self, node):
+        if node.process and node.process.poll() is None:
+            node.process.terminate()
+            try:
+                node.process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                node.process.kill()
+                node.process.wait()
+
+    def _node_id(self, index):
+        return f'node-{index}'
+
+    # --- Ring changes ---
+
+    def scale(self, processes):
+        """Changes the number of backend processes, handing sessions over. Returns a summary."""
+        if processes < 1:
+            raise ValueError("At least one process is needed.")
+        with self._rebalance_lock:
+            members = [self._node_id(i) for i in range(processes)]
+            new_ring = HashRing(members)
+            started = []
+            for i, node_id in enumerate(members):
+                if node_id not in self.nodes:
+                    node = Node(node_id, self.args.backend_port + i)
+                    self._start(node)
+                    started.append(node)
+            for node in started:
+                self._wait_healthy(node)
+
+            with self._condition:
+                self._pending_ring = new_ring
+                self.nodes.update((node.node_id, node) for node in started)
+                self._drain(new_ring)
+
+            released = 0
+            try:
+                # Every member gets the new ring; old members release what moved away from them
+                for node_id in members:
+                    released += self._push_ring(self.nodes[node_id], members)
+            finally:
+                with self._condition:
+                    for node_id in members:
+                        self.nodes[node_id].ready = True
+                    self.ring = new_ring
+                    self._pending_ring = None
+                    removed = [node for node_id, node in self.nodes.items() if node_id not in members]
+                    for node in removed:
+                        del self.nodes[node.node_id]
+                    self._condition.notify_all()
+
+            # Their sessions are journaled and now owned elsewhere
+            for node in removed:
+                self._stop(node)
+            return {"members": members, "started": [n.node_id for n in started],
+                    "stopped": [n.node_id for n in removed], "released": released}
+
+    def _drain(self, new_ring):
+        """Waits (holding the condition) until no request whose owner changes is still running."""
+        deadline = time.monotonic() + self.args.drain_timeout
+        while True:
+            moving = [key for key, count in self._inflight.items() if count and self._moves(key, new_ring)]
+            remaining = deadline - time.monotonic()
+            if not moving or remaining <= 0:
+                if moving:
+                    print(f"cluster: {len(moving)} requests still running after {self.args.drain_timeout}s; "
+                          "handing their sessions over anyway.", file=sys.stderr)
+                return
+            self._condition.wait(remaining)
+
+    def _moves(self, key, new_ring):
+        # Keyless requests (uploads, new batches) mint ids for the current ring, so they move too
+        return key is None or self.ring is None or self.ring.owner(key) != new_ring.owner(key)
+
+    # --- Routing ---
+
+    def acquire(self, key):
+        """Returns the node for a routing key and counts the request as in flight, or None on timeout."""
+        deadline = time.monotonic() + self.args.drain_timeout + self.args.startup_timeout
+        with self._condition:
+            while True:
+                node = self._pick(key)
+                if node is not None:
+                    self._inflight[key] += 1
+                    return node
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                self._condition.wait(remaining)
+
+    def _pick(self, key):
+        if self.ring is None or (self._pending_ring is not None and self._moves(key, self._pending_ring)):
+            return None
+        if key is None:
+            ready = [node for node in (self.nodes.get(m) for m in self.ring.members) if node and node.ready]
+            return ready[next(self._round_robin) % len(ready)] if ready else None
+        node = self.nodes.get(self.ring.owner(key))
+        return node if node and node.ready else None
+
+    def release(self, key):
+        with self._condition:
+            self._inflight[key] -= 1
+            if not self._inflight[key]:
+                del self._inflight[key]
+            self._condition.notify_all()
+
+    # --- Supervision ---
+
+    def supervise(self):
+        """Restarts crashed processes; they get the ring again before taking requests."""
+        while not self._stopping:
+            time.sleep(SUPERVISE_SECONDS)
+            with self._rebalance_lock:
+                for node in list(self.nodes.values()):
+                    if self._stopping or node.process.poll() is None:
+                        continue
+                    print(f"cluster: {node.node_id} exited with code {node.process.returncode}; restarting.", file=sys.stderr)
+                    with self._condition:
+                        node.ready = False
+                    node.restarts += 1
+                    try:
+                        self._start(node)
+                        self._wait_healthy(node)
+                        self._push_ring(node, self.ring.members)
+                    except Exception as e:
+                        print(f"cluster: could not restart {node.node_id}: {e}", file=sys.stderr)
+                        continue
+                    with self._condition:
+                        node.ready = True
+                        self._condition.notify_all()
+
+    def shutdown(self):
+        self._stopping = True
+        for node in list(self.nodes.values()):
+            self._stop(node)
+
+    def status(self):
+        with self._condition:
+            return {
+                "members": self.ring.members if self.ring else None,
+                "rebalancing": self._pending_ring is not None,
+                "in_flight": sum(self._inflight.values()),
+                "nodes": [{
+                    "node_id": node.node_id,
+                    "port": node.port,
+                    "pid": node.process.pid if node.process else None,
+                    "ready": node.ready,
+                    "restarts": node.restarts
+                } for node in self.nodes.values()]
+            }
+
+
+class RouterHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    cluster = None # Set by main()
+
+    def log_message(self, format, *args):
+        if self.cluster.args.verbose:
+            super().log_message(format, *args)
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.wfile.write(body)
+        self.close_connection = True
+
+    def _handle(self):
+        path = self.path.split('?', 1)[0]
+        if path.startswith('/api/cluster'):
+            return self._admin(path)
+
+        match = ROUTED_PATH.match(self.path)
+        key = match.group(1).lower() if match else None
+        node = self.cluster.acquire(key)
+        if node is None:
+            return self._send_json(503, {"error": "No backend process is available for this request."})
+        try:
+            self._proxy(node)
+        finally:
+            self.cluster.release(key)
+
+    def _admin_authorized(self):
+        # A proxy in front of the router (nginx) makes every client look local, so the address alone
+        # doesn't tell; the caller must know the token the router was started with
+        token = self.headers.get('X-Haguma-Cluster-Token', '')
+        return bool(config.CLUSTER_TOKEN) and hmac.compare_digest(token, config.CLUSTER_TOKEN)
+
+    def _admin(self, path):
+        # The backends' own /api/cluster routes are never reachable through here
+        if self.client_address[0] not in ('127.0.0.1', '::1') or not self._admin_authorized():
+            return self._send_json(404, {"error": "Not found."})
+        if path == '/api/cluster/status' and self.command == 'GET':
+            return self._send_json(200, self.cluster.status())
+        if path == '/api/cluster/scale' and self.command == 'POST':
+            try:
+                data = json.loads(self.rfile.read(int(self.headers.get('Content-Length') or 0)) or b'{}')
+                return self._send_json(200, self.cluster.scale(int(data.get('processes'))))
+            except (ValueError, TypeError) as e:
+                return self._send_json(400, {"error": str(e)})
+            except Exception as e:
+                return self._send_json(500, {"error": f"Scaling failed: {e}"})
+        return self._send_json(404, {"error": "Not found."})
+
+    def _proxy(self, node):
+        upgrade = self.headers.get('Upgrade') is not None and 'upgrade' in self.headers.get('Connection', '').lower()
+        try:
+            upstream = socket.create_connection(('127.0.0.1', node.port))
+        except OSError:
+            return self._send_json(502, {"error": "Backend process is not reachable."})
+        self.close_connection = True
+        try:
+            head = [f'{self.command} {self.path} HTTP/1.1']
+            for name, value in self.headers.items():
+                lower = name.lower()
+                if lower in HOP_BY_HOP_HEADERS or lower in ('expect', 'x-haguma-cluster-token', 'x-forwarded-for'):
+                    continue
+                head.append(f'{name}: {value}')
+            head.append(f'X-Forwarded-For: {self.client_address[0]}')
+            head.append('Connection: Upgrade' if upgrade else 'Connection: close')
+            if upgrade:
+                head.append(f'Upgrade: {self.headers["Upgrade"]}')
+            upstream.sendall(('\r\n'.join(head) + '\r\n\r\n').encode('latin-1'))
+
+            # We read the body ourselves, so answer the client's Expect header here
+            if self.headers.get('Expect', '').lower() == '100-continue':
+                self.wfile.write(b'HTTP/1.1 100 Continue\r\n\r\n')
+                self.wfile.flush()
+            if self.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+                self._copy_chunked_body(upstream)
+            else:
+                self._copy_body(upstream, int(self.headers.get('Content-Length') or 0))
+
+            self._pipe(upstream, upgrade)
+        except (ConnectionError, socket.timeout):
+            pass # Either side went away; closing both ends tells the other
+        finally:
+            upstream.close()
+
+    def _copy_body(self, upstream, remaining):
+        while remaining > 0:
+            data = self.rfile.read1(min(remaining, PIPE_BYTES))
+            if not data:
+                raise ConnectionResetError("Client closed the connection mid-body.")
+            upstream.sendall(data)
+            remaining -= len(data)
+
+    def _copy_chunked_body(self, upstream):
+        # Forwarded as-is; parsed only to find where the body ends
+        while True:
+            size_line = self.rfile.readline(1024)
+            if not size_line:
+                raise ConnectionResetError("Client closed the connection mid-body.")
+            upstream.sendall(size_line)
+            size = int(size_line.split(b';', 1)[0].strip() or b'0', 16)
+            if size == 0:
+                while True: # Trailers, up to the empty line
+                    line = self.rfile.readline(65537)
+                    upstream.sendall(line)
+                    if line in (b'\r\n', b'\n', b''):
+                        return
+            self._copy_body(upstream, size + 2) # Chunk data and its CRLF
+
+    def _pipe(self, upstream, upgrade):
+        """
+        Streams the response back. A client that disconnects while waiting closes the upstream
+        connection, which the backend notices and cancels the operation (utils/cancellation.py).
+        For upgraded connections (live WebSockets) it's a tunnel in both directions.
+        """
+        client = self.connection
+        self.wfile.flush()
+        while True:
+            readable, _, _ = select.select([client, upstream], [], [])
+            if upstream in readable:
+                data = upstream.recv(PIPE_BYTES)
+                if not data:
+                    return
+                client.sendall(data)
+            if client in readable:
+                data = client.recv(PIPE_BYTES)
+                if not data:
+                    return
+                if upgrade:
+                    upstream.sendall(data)
+                # Anything else from the client is a pipelined request; we close after this one
+
+    do_GET = do_POST = do_PUT = do_PATCH = do_DELETE = do_HEAD = do_OPTIONS = _handle
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run several backend processes behind a session-affinity router.")
+    parser.add_argument('--processes', '-n', type=int, default=os.cpu_count() or 2, help="Backend processes (default: CPU count).")
+    parser.add_argument('--host', default='0.0.0.0', help="Router address.")
+    parser.add_argument('--port', type=int, default=int(os.environ.get('FLASK_PORT', 5001)), help="Router port.")
+    parser.add_argument('--backend-port', type=int, default=5101, help="Port of the first backend process; the others follow.")
+    parser.add_argument('--gunicorn', action='store_true', help="Run each backend under gunicorn instead of Flask's server.")
+    parser.add_argument('--asgi', action='store_true', help="Run each backend under uvicorn through the ASGI front-end.")
+    parser.add_argument('--threads', type=int, default=8, help="gunicorn (or ASGI executor) threads per backend process.")
+    parser.add_argument('--drain-timeout', type=float, default=30.0,
+                        help="Seconds a ring change waits for running requests on moving sessions.")
+    parser.add_argument('--startup-timeout', type=float, default=60.0, help="Seconds to wait for a backend process to come up.")
+    parser.add_argument('--verbose', '-v', action='store_true', help="Log every routed request.")
+    args = parser.parse_args()
+
+    cluster = Cluster(args)
+    RouterHandler.cluster = cluster
+    server = ThreadingHTTPServer((args.host, args.port), RouterHandler)
+    server.daemon_threads = True
+
+    def stop(signum, frame):
+        threading.Thread(target=server.shutdown, daemon=True).start()
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    try:
+        summary = cluster.scale(args.processes)
+        print(f"cluster: router on {args.host}:{args.port}, backends {', '.join(summary['members'])} "
+              f"on ports {args.backend_port}-{args.backend_port + args.processes - 1}", file=sys.stderr)
+        threading.Thread(target=cluster.supervise, daemon=True).start()
+        server.serve_forever()
+    finally:
+        server.server_close()
+        cluster.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -6,8 +6,120 @@ BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 
 TEMP_FOLDER_NAME = 'temp_images'
 TEMP_FOLDER = os.path.join(BASE_DIR, TEMP_FOLDER_NAME)
+# Hot working files (current session image, conversions). Point this at a RAM-backed
+# directory such as /dev/shm/arteditor to keep them off disk.
+WORKING_FOLDER = os.environ.get('HAGUMA_WORKING_FOLDER', os.path.join(TEMP_FOLDER, 'sessions'))
+# Content-addressed history versions (see services/version_store.py), kept on disk
+VERSION_FOLDER = os.environ.get('HAGUMA_VERSION_FOLDER', os.path.join(TEMP_FOLDER, 'versions'))
+# Idle sessions' working files are demoted here (see services/residency.py)
+COLD_FOLDER = os.environ.get('HAGUMA_COLD_FOLDER', os.path.join(TEMP_FOLDER, 'cold'))
+STORAGE_SHARD_DEPTH = 2 # Levels of 2-hex-char subdirectories (256 * 256 shards)
 
-ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg'}
+ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'webp'}
 MAX_FILE_SIZE_MB = 12
 SESSION_TIMEOUT_HOURS = 1 # Hours for cleanup
-MAX_CONTENT_LENGTH = MAX_FILE_SIZE_MB * 1024 * 1024 # In bytes
\ No newline at end of file
+MAX_CONTENT_LENGTH = MAX_FILE_SIZE_MB * 1024 * 1024 # In bytes
+
+# Modifying requests for one session are serialized. For these operations, a request still
+# waiting when a newer one of the same kind arrives is answered as "superseded" instead of run.
+COALESCED_OPERATIONS = {'brightness', 'contrast', 'grayscale', 'filter', 'update'}
+
+# Live adjustment channel (WebSocket, see routes/live_routes.py)
+LIVE_PREVIEW_MAX_DIMENSION = 1024 # Longer side of the low-resolution preview proxy, in px
+LIVE_PREVIEW_QUALITY = 70 # JPEG quality of streamed preview frames
+LIVE_MAX_FPS = 30 # Upper bound on frames per second per connection
+
+# Session residency tiers: decoded in RAM -> working file on disk -> cold (demoted) -> evicted
+RESIDENCY_MEMORY_QUOTA_MB = int(os.environ.get('HAGUMA_MEMORY_QUOTA_MB', 512)) # Decoded pixels held in RAM
+RESIDENCY_DISK_QUOTA_MB = int(os.environ.get('HAGUMA_DISK_QUOTA_MB', 4096)) # Working + cold + version files
+RESIDENCY_IDLE_SECONDS = 300 # Idle time before a session is demoted to the cold tier
+RESIDENCY_SWEEP_SECONDS = 60 # How often idle sessions are looked for
+
+# Batch processing (see services/batch_service.py)
+BATCH_WORKERS = int(os.environ.get('HAGUMA_BATCH_WORKERS', os.cpu_count() or 2)) # Shared worker pool size
+BATCH_MAX_ITEMS = 100 # Files + session ids per batch
+BATCH_MAX_CONTENT_LENGTH = 200 * 1024 * 1024 # Request body limit for batch uploads, in bytes
+
+# Multi-format export (see services/export_service.py)
+EXPORT_WORKERS = int(os.environ.get('HAGUMA_EXPORT_WORKERS', os.cpu_count() or 2)) # Concurrent encodes across requests
+
+# Output encoding (see services/encoder.py)
+ENCODER_WORKERS = int(os.environ.get('HAGUMA_ENCODER_WORKERS', os.cpu_count() or 2)) # Concurrent quality-search encodes
+
+# Animated GIF/WebP/PNG editing (see services/animation.py): frames are edited in parallel, at most
+# ANIMATION_FRAME_WINDOW decoded at once, on threads that hand them to COMPUTE_PROCESSES when set
+ANIMATION_FRAME_THREADS = int(os.environ.get('HAGUMA_ANIMATION_FRAME_THREADS', min(4, os.cpu_count() or 2)))
+ANIMATION_FRAME_WINDOW = 8
+
+# Memory accounting (see utils/memory_budget.py); 0 disables a limit
+MEMORY_REQUEST_LIMIT_MB = int(os.environ.get('HAGUMA_MEMORY_REQUEST_LIMIT_MB', 1024)) # Estimated peak of a single operation
+MEMORY_WORKER_LIMIT_MB = int(os.environ.get('HAGUMA_MEMORY_WORKER_LIMIT_MB', 2048)) # Estimated peaks of all in-flight operations per process
+MEMORY_WAIT_SECONDS = 10 # How long an operation waits for room under the worker limit
+MEMORY_SAMPLE_SECONDS = 0.005 # RSS sampling interval while operations run
+
+# Cooperative cancellation (see utils/cancellation.py): an operation still running past its deadline,
+# or whose client disconnected, is abandoned without touching the session. 0 disables a deadline.
+OPERATION_DEADLINES_SECONDS = {
+    'default': int(os.environ.get('HAGUMA_OPERATION_DEADLINE_SECONDS', 55)), # Under nginx's 60s proxy_read_timeout
+    # Transposes and crops finish in well under a second; anything slower is stuck
+    'rotate': 30,
+    'flip': 30,
+    'crop': 30,
+    'crop-custom': 30,
+}
+# Expected durations (see utils/cost_model.py): an edit estimated to take this many times its remaining
+# deadline is refused before it starts, rather than cancelled at the deadline. 0 disables.
+COST_ADMISSION_FACTOR = 2.0
+# Coefficients fitted by calibrate_costs.py on this hardware; the built-in ones are used without it
+COST_MODEL_PATH = os.environ.get('HAGUMA_COST_MODEL', os.path.join(BASE_DIR, 'cost_model.json'))
+# Speculative conversions (see services/speculation.py): after each edit, the ?format= downloads the
+# session is likely to ask for next are encoded in the background while no request is running
+SPECULATION_CPU_PERCENT = int(os.environ.get('HAGUMA_SPECULATION_CPU_PERCENT', 25)) # Of one core, on average; 0 disables
+SPECULATION_DISK_MB = int(os.environ.get('HAGUMA_SPECULATION_DISK_MB', 256)) # Precomputed files kept per process; 0 disables
+SPECULATION_FORMATS = 2 # Conversions precomputed per version
+SPECULATION_MAX_SECONDS = 2.0 # Conversions estimated to take longer are left to the download
+SPECULATION_IDLE_SECONDS = 0.2 # Quiet time after the last request before background work (re)starts
+SPECULATION_DEFAULT_FORMAT = 'jpeg' # What the frontend's Save As dialog offers first
+DISCONNECT_PROBE_INTERVAL_SECONDS = 0.25 # Minimum time between client connection checks
+CANCELLATION_BAND_ROWS = 512 # Rows processed between checkpoints in banded operations
+
+# Resumable chunked uploads (see services/upload_service.py)
+UPLOAD_READ_BYTES = 64 * 1024 # Request body is streamed to disk in pieces of this size
+UPLOAD_HEADER_PROBE_BYTES = 256 * 1024 # An upload whose format isn't recognised within this many bytes is rejected
+UPLOAD_EXPIRY_SECONDS = SESSION_TIMEOUT_HOURS * 3600 # Unfinished uploads idle this long are discarded
+
+# Upload deduplication (see version_store's ingest index)
+INGEST_INDEX_MAX_ENTRIES = 10000 # Distinct uploaded originals remembered
+INGEST_RETENTION_SECONDS = int(os.environ.get('HAGUMA_INGEST_RETENTION_SECONDS', 24 * 3600)) # Originals kept for re-uploads after their sessions end
+
+# Smart crop: longer side, in px, of the grayscale proxy whose edge energy picks the crop window
+SMART_CROP_PROXY_DIMENSION = 256
+
+# Histograms and channel statistics (see services/image_stats.py), cached per history version
+IMAGE_STATS_CACHE_ENTRIES = 256
+
+# Session journal (see services/session_journal.py): history survives restarts and deploys.
+# Empty disables it. Keep it on persistent disk next to VERSION_FOLDER.
+SESSION_JOURNAL_PATH = os.environ.get('HAGUMA_SESSION_JOURNAL', os.path.join(TEMP_FOLDER, 'session_journal.sqlite3'))
+
+# Multi-process mode (see cluster.py and utils/affinity.py)
+AFFINITY_VIRTUAL_NODES = 64 # Points per process on the consistent-hash ring
+CLUSTER_TOKEN = os.environ.get('HAGUMA_CLUSTER_TOKEN', '') # Shared secret for the router's /api/cluster calls; empty disables them
+
+# Compute worker processes (see services/compute_pool.py). Pixels travel between the request
+# handlers and the workers in shared memory (utils/pixel_buffers.py); 0 runs operations in the
+# request thread instead. Under Docker, give the container enough /dev/shm (shm_size).
+COMPUTE_PROCESSES = int(os.environ.get('HAGUMA_COMPUTE_PROCESSES', 0))
+PIXEL_BUFFER_LIMIT_MB = int(os.environ.get('HAGUMA_PIXEL_BUFFER_LIMIT_MB', 1024)) # Shared pixel buffers alive at once
+
+# ASGI front-end (see asgi.py): request bodies are received and files are streamed on the event
+# loop, so idle and slow connections cost no thread; the routes themselves (and the image work
+# they do outside COMPUTE_PROCESSES) run on this many threads.
+ASGI_THREADS = int(os.environ.get('HAGUMA_ASGI_THREADS', 16))
+ASGI_BODY_SPOOL_BYTES = 1024 * 1024 # Request bodies beyond this are spooled to a temp file as they arrive
+ASGI_FILE_CHUNK_BYTES = 256 * 1024 # Downloads are sent in pieces of this size
+
+# Uncompressed, memory-mapped copy of each session's current pixels (see utils/raw_image.py):
+# crops and region reads of sessions not in the RAM tier skip decoding. Costs width * height * 4
+# bytes of disk per session (1 for grayscale).
+RAW_WORKING_IMAGES = os.environ.get('HAGUMA_RAW_WORKING_IMAGES', 'False').lower() == 'true'
@@ -0,0 +1,46 @@
+"""
+Production serving: gunicorn -c gunicorn.conf.py
+
+The app is created and warmed up (Pillow plugins, codecs, URL map) once in the master process,
+before the worker is forked, so a worker - including one restarted after a crash or a
+max_requests recycle - serves its first request without importing or initializing anything.
+Sessions are restored and background jobs started in the worker, which holds the session state.
+"""
+import os
+import time
+
+_started = time.monotonic()
+
+bind = os.environ.get('HAGUMA_BIND', '0.0.0.0:5001')
+# Session history, locks and decoded images live in the worker's memory, so one worker per
+# node; run several nodes behind cluster.py to use more processes.
+workers = 1
+# Threads let long-lived live adjustment WebSockets share the worker with regular requests
+threads = int(os.environ.get('HAGUMA_THREADS', 8))
+wsgi_app = 'app:create_app(worker_setup=False)'
+preload_app = True
+
+
+def when_ready(server):
+    # Master, after the app is loaded and before the worker is forked
+    from app import warm_up
+    warm_up(server.app.wsgi())
+    server.log.info(f"Preloaded and warmed up in {time.monotonic() - _started:.3f}s.")
+
+
+def post_fork(server, worker):
+    worker.forked_at = time.monotonic()
+
+
+def post_worker_init(worker):
+    from app import setup_worker
+    setup_worker(worker.wsgi)
+    worker.first_request_logged = False
+
+
+def post_request(worker, req, environ, resp):
+    if not worker.first_request_logged:
+        worker.first_request_logged = True
+        now = time.monotonic()
+        worker.log.info(f"First request served {now - worker.forked_at:.3f}s after the worker was forked, "
+                        f"{now - _started:.3f}s after startup.")
@@ -0,0 +1,382 @@
+"""
+Load generator that replays realistic editing sessions against the backend.
+
+    python loadtest.py --concurrency 8 --duration 60                         # in-process (Flask test client)
+    python loadtest.py --url http://localhost:5001 --server-pid 1234 -c 16   # against a running server
+
+Each virtual user loops over session scripts: upload, a mix of /process/... calls (slider
+adjustments come in quick bursts), undo/redo, an /update re-upload and downloads with
+format conversion. The report has throughput, p50/p95/p99 latency and error rate per route,
+plus peak RSS and temp storage usage.
+"""
+import io
+import os
+import sys
+import json
+import time
+import uuid
+import random
+import shutil
+import tempfile
+import argparse
+import threading
+import urllib.error
+import urllib.request
+from PIL import Image, ImageFilter
+import config # Imports from backend/config.py
+from utils import file_helpers
+
+# (operation, weight, body factory); slider operations are sent as bursts like a dragged slider
+OPERATION_MIX = [
+    ('brightness', 20, lambda rng: {"level": rng.randint(-60, 60)}),
+    ('contrast', 15, lambda rng: {"level": rng.randint(-60, 60)}),
+    ('filter', 10, lambda rng: {"type": rng.choice(['blur', 'sharpen']), "intensity": rng.randint(0, 60)}),
+    ('grayscale', 8, lambda rng: {"intensity": rng.randint(20, 100)}),
+    ('resize', 10, lambda rng: {"percentage": rng.randint(70, 95)}),
+    ('rotate', 8, lambda rng: {"angle": rng.choice([90, -90, 180])}),
+    ('flip', 8, lambda rng: {"axis": rng.choice(['horizontal', 'vertical'])}),
+    ('crop', 6, lambda rng: {"preset": rng.choice(['square', '16x9', '4:3'])}),
+]
+SLIDER_OPERATIONS = {'brightness', 'contrast', 'filter', 'grayscale'}
+SLIDER_INTERVAL_SECONDS = 0.03 # Gap between requests of one slider burst
+DOWNLOAD_FORMATS = [None, 'jpeg', 'png', 'webp']
+RESOURCE_SAMPLE_SECONDS = 0.5
+
+
+# --- Transports ---
+
+def _encode_multipart(fields):
+    """fields: {name: (filename, bytes)} -> (body, content type) for urllib."""
+    boundary = uuid.uuid4().hex
+    body = io.BytesIO()
+    for name, (filename, data) in fields.items():
+        body.write(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'.encode())
+        body.write(b'Content-Type: application/octet-stream\r\n\r\n')
+        body.write(data)
+        body.write(b'\r\n')
+    body.write(f'--{boundary}--\r\n'.encode())
+    return body.getvalue(), f'multipart/form-data; boundary={boundary}'
+
+
+class HttpTransport:
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip('/')
+
+    def request(self, method, path, json_body=None, files=None):
+        """Returns (status, body bytes)."""
+        headers = {}
+        data = None
+        if files:
+            data, headers['Content-Type'] = _encode_multipart(files)
+        elif json_body is not None:
+            data = json.dumps(json_body).encode('utf-8')
+            headers['Content-Type'] = 'application/json'
+        req = urllib.request.Request(self.base_url + path, data=data, headers=headers, method=method)
+        try:
+            with urllib.request.urlopen(req, timeout=120) as response:
+                return response.status, response.read()
+        except urllib.error.HTTPError as e:
+            return e.code, e.read()
+
+
+class InProcessTransport:
+    def __init__(self, app):
+        self.app = app
+        self._local = threading.local()
+
+    @property
+    def client(self):
+        # Test clients aren't thread-safe: each thread (a virtual user, or one request of its
+        # slider burst) gets its own
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = self._local.client = self.app.test_client()
+        return client
+
+    def request(self, method, path, json_body=None, files=None):
+        kwargs = {}
+        if files:
+            kwargs['data'] = {name: (io.BytesIO(data), filename) for name, (filename, data) in files.items()}
+            kwargs['content_type'] = 'multipart/form-data'
+        elif json_body is not None:
+            kwargs['json'] = json_body
+        response = self.client.open(path, method=method, **kwargs)
+        body = response.get_data()
+        response.close()
+        return response.status_code, body
+
+
+def _create_in_process_app():
+    # Keep the run's files out of the real temp folder
+    temp_root = tempfile.mkdtemp(prefix='haguma_loadtest_')
+    config.TEMP_FOLDER = temp_root
+    config.WORKING_FOLDER = os.path.join(temp_root, 'sessions')
+    config.COLD_FOLDER = os.path.join(temp_root, 'cold')
+    config.VERSION_FOLDER = os.path.join(temp_root, 'versions')
+    config.SESSION_JOURNAL_PATH = os.path.join(temp_root, 'session_journal.sqlite3')
+    from app import create_app
+    app = create_app(worker_setup=False) # No scheduler, and no journaled sessions to restore
+    app.logger.setLevel('WARNING')
+    return app, temp_root
+
+
+# --- Session Scripts ---
+
+def make_test_image(width, height, extension, seed=0):
+    """Photo-like test image (gradient + texture) so encoders do realistic work."""
+    base = Image.linear_gradient('L').resize((width, height)).convert('RGB')
+    rng = random.Random(seed)
+    texture = Image.effect_noise((width, height), 30 + rng.randint(0, 30)).convert('RGB')
+    img = Image.blend(base, texture, 0.35).filter(ImageFilter.SMOOTH)
+    buffer = io.BytesIO()
+    img.save(buffer, format='JPEG' if extension in ('jpg', 'jpeg') else 'PNG', quality=90)
+    return buffer.getvalue()
+
+
+def _parse_size_mix(value):
+    """'800x600:5,2000x1500:3' -> [((800, 600), 5), ((2000, 1500), 3)]"""
+    mix = []
+    for part in value.split(','):
+        size, _, weight = part.partition(':')
+        width, height = (int(v) for v in size.lower().split('x'))
+        mix.append(((width, height), float(weight or 1)))
+    return mix
+
+
+class Recorder:
+    def __init__(self):
+        self.samples = {} # { route: [(latency_seconds, status), ...] }
+        self.sessions = 0
+        self.lock = threading.Lock()
+
+    def call(self, transport, route, method, path, **kwargs):
+        started = time.perf_counter()
+        try:
+            status, body = transport.request(method, path, **kwargs)
+        except Exception:
+            status, body = 0, b'' # Connection errors count as failures
+        latency = time.perf_counter() - started
+        with self.lock:
+            self.samples.setdefault(route, []).append((latency, status))
+        return status, body
+
+
+def run_session(transport, recorder, rng, images, extension):
+    """One scripted editing session."""
+    image_bytes = rng.choice(images)
+    status, body = recorder.call(transport, 'POST /upload', 'POST', '/api/upload',
+                                 files={'file': (f"loadtest.{extension}", image_bytes)})
+    if status != 200:
+        return
+    upload = json.loads(body)
+    base = f"/api/process/{upload['image_session_id']}/{upload['original_extension']}"
+
+    operations, weights = zip(*[(op[0], op[1]) for op in OPERATION_MIX])
+    body_factories = {op: factory for op, _, factory in OPERATION_MIX}
+    for _ in range(rng.randint(3, 8)):
+        op = rng.choices(operations, weights)[0]
+        if op not in SLIDER_OPERATIONS:
+            recorder.call(transport, f'POST /process/{op}', 'POST', f"{base}/{op}", json_body=body_factories[op](rng))
+            continue
+        # A dragged slider fires overlapping requests; the server coalesces them (409 superseded)
+        burst = []
+        for _ in range(rng.randint(2, 5)):
+            request_thread = threading.Thread(target=recorder.call, args=(transport, f'POST /process/{op}', 'POST', f"{base}/{op}"),
+                                              kwargs={"json_body": body_factories[op](rng)})
+            request_thread.start()
+            burst.append(request_thread)
+            time.sleep(SLIDER_INTERVAL_SECONDS)
+        for request_thread in burst:
+            request_thread.join()
+
+    if rng.random() < 0.5:
+        recorder.call(transport, 'POST /process/undo', 'POST', f"{base}/undo")
+        if rng.random() < 0.5:
+            recorder.call(transport, 'POST /process/redo', 'POST', f"{base}/redo")
+
+    if rng.random() < 0.3:
+        # Client-side edits (canvas drawing) come back as a full re-upload
+        recorder.call(transport, 'POST /process/update', 'POST', f"{base}/update",
+                      files={'file': (f"edited.{upload['original_extension']}", image_bytes)})
+
+    download_base = f"/api/download/{upload['image_session_id']}/{upload['original_extension']}"
+    for target_format in rng.sample(DOWNLOAD_FORMATS, 2):
+        if target_format:
+            recorder.call(transport, f'GET /download?format={target_format}', 'GET', f"{download_base}?format={target_format}")
+        else:
+            recorder.call(transport, 'GET /download', 'GET', download_base)
+
+    with recorder.lock:
+        recorder.sessions += 1
+
+
+# --- Resource Sampling ---
+
+def _read_rss_bytes(pid):
+    try:
+        with open(f"/proc/{pid}/status", 'r') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    if pid == os.getpid():
+        import resource # Not on Windows; ru_maxrss is already a peak
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    return None
+
+
+def _folder_bytes(folder):
+    total = 0
+    for entry in file_helpers.iter_files(folder):
+        try:
+            total += entry.stat().st_size
+        except OSError:
+            pass
+    return total
+
+
+def _sample_resources(stop, peaks, pid, folder):
+    while not stop.is_set():
+        rss = _read_rss_bytes(pid) if pid else None
+        if rss:
+            peaks['rss_bytes'] = max(peaks['rss_bytes'], rss)
+        if folder:
+            peaks['disk_bytes'] = max(peaks['disk_bytes'], _folder_bytes(folder))
+        stop.wait(RESOURCE_SAMPLE_SECONDS)
+
+
+# --- Report ---
+
+def _percentile(sorted_values, percent):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(percent / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+def build_report(recorder, elapsed, peaks):
+    routes = {}
+    total_requests = total_errors = 0
+    for route, samples in sorted(recorder.samples.items()):
+        latencies = sorted(latency for latency, _ in samples)
+        # 409 means a newer slider request replaced this one: expected, not an error
+        errors = sum(1 for _, status in samples if (status >= 400 and status != 409) or status == 0)
+        superseded = sum(1 for _, status in samples if status == 409)
+        routes[route] = {
+            "count": len(samples),
+            "errors": errors,
+            "error_rate": errors / len(samples),
+            "superseded": superseded,
+            "p50_ms": _percentile(latencies, 50) * 1000,
+            "p95_ms": _percentile(latencies, 95) * 1000,
+            "p99_ms": _percentile(latencies, 99) * 1000,
+        }
+        total_requests += len(samples)
+        total_errors += errors
+    return {
+        "elapsed_seconds": elapsed,
+        "sessions": recorder.sessions,
+        "requests": total_requests,
+        "requests_per_second": total_requests / elapsed if elapsed else 0,
+        "sessions_per_second": recorder.sessions / elapsed if elapsed else 0,
+        "error_rate": total_errors / total_requests if total_requests else 0,
+        "peak_rss_mb": peaks['rss_bytes'] / (1024 * 1024) if peaks['rss_bytes'] else None,
+        "peak_disk_mb": peaks['disk_bytes'] / (1024 * 1024),
+        "routes": routes
+    }
+
+
+def print_report(report):
+    print(f"\n{report['sessions']} sessions, {report['requests']} requests in {report['elapsed_seconds']:.1f}s: "
+          f"{report['requests_per_second']:.1f} req/s, {report['sessions_per_second']:.2f} sessions/s, "
+          f"error rate {report['error_rate'] * 100:.2f}%")
+    rss = f"{report['peak_rss_mb']:.0f} MB" if report['peak_rss_mb'] is not None else "n/a"
+    print(f"Peak RSS: {rss}   Peak temp storage: {report['peak_disk_mb']:.1f} MB\n")
+    print(f"{'route':<32}{'count':>7}{'err%':>7}{'409':>6}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}")
+    for route, stats in report['routes'].items():
+        print(f"{route:<32}{stats['count']:>7}{stats['error_rate'] * 100:>7.1f}{stats['superseded']:>6}"
+              f"{stats['p50_ms']:>9.1f}{stats['p95_ms']:>9.1f}{stats['p99_ms']:>9.1f}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Simulate concurrent editing sessions and report latency/throughput.")
+    parser.add_argument('--url', help="Base URL of a running server (default: in-process test client)")
+    parser.add_argument('--concurrency', '-c', type=int, default=4, help="Virtual users running sessions in parallel")
+    parser.add_argument('--duration', '-d', type=float, default=30, help="Seconds to run (ignored with --sessions)")
+    parser.add_argument('--sessions', '-n', type=int, default=None, help="Stop after this many sessions instead")
+    parser.add_argument('--sizes', default='800x600:5,2000x1500:3,4000x3000:1',
+                        help="Image size mix as WxH:weight,... (default: %(default)s)")
+    parser.add_argument('--extension', choices=sorted(config.ALLOWED_EXTENSIONS), default='jpg', help="Upload format")
+    parser.add_argument('--server-pid', type=int, help="PID to sample RSS from in --url mode")
+    parser.add_argument('--temp-folder', help="Storage folder to measure in --url mode (same machine)")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--json', dest='json_path', help="Also write the report as JSON to this path")
+    args = parser.parse_args(argv)
+
+    try:
+        size_mix = _parse_size_mix(args.sizes)
+    except ValueError:
+        parser.error("--sizes must look like 800x600:5,2000x1500:3")
+
+    if args.url:
+        return _run(args, size_mix, lambda: HttpTransport(args.url), args.server_pid, args.temp_folder)
+    app, folder = _create_in_process_app()
+    try:
+        return _run(args, size_mix, lambda: InProcessTransport(app), os.getpid(), folder)
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
+
+def _run(args, size_mix, make_transport, pid, folder):
+    # A few distinct images per size, weighted by the mix
+    print("Generating test images...")
+    images = []
+    for (width, height), weight in size_mix:
+        variants = [make_test_image(width, height, args.extension, seed) for seed in range(2)]
+        images.extend(variants * max(1, int(round(weight))))
+
+    recorder = Recorder()
+    peaks = {"rss_bytes": 0, "disk_bytes": 0}
+    stop = threading.Event()
+    sampler = threading.Thread(target=_sample_resources, args=(stop, peaks, pid, folder), daemon=True)
+    sampler.start()
+
+    deadline = time.monotonic() + args.duration
+    session_budget = [args.sessions]
+    budget_lock = threading.Lock()
+
+    def virtual_user(index):
+        rng = random.Random(args.seed * 1000 + index)
+        transport = make_transport()
+        while True:
+            if args.sessions is not None:
+                with budget_lock:
+                    if session_budget[0] <= 0:
+                        return
+                    session_budget[0] -= 1
+            elif time.monotonic() >= deadline:
+                return
+            run_session(transport, recorder, rng, images, args.extension)
+
+    print(f"Running {args.concurrency} virtual users against {args.url or 'in-process app'}...")
+    started = time.monotonic()
+    users = [threading.Thread(target=virtual_user, args=(i,), daemon=True) for i in range(args.concurrency)]
+    for user in users:
+        user.start()
+    for user in users:
+        user.join()
+    elapsed = time.monotonic() - started
+    stop.set()
+    sampler.join()
+
+    report = build_report(recorder, elapsed, peaks)
+    print_report(report)
+    if args.json_path:
+        with open(args.json_path, 'w') as f:
+            json.dump(report, f, indent=2)
+    return 1 if report['error_rate'] > 0 else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
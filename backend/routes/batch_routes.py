@@ -0,0 +1,104 @@
+import os
+import json
+from flask import Blueprint, request, jsonify, send_from_directory, current_app, Response, stream_with_context
+from services import batch_service
+import config # For batch limits
+
+# --- Batch Routes ---
+# POST /api/batch                       multipart: files (repeated), recipe (JSON string),
+#                                       optional sessions (JSON list) and format;
+#                                       or JSON: {"recipe": [...], "sessions": [...], "format": "png"}
+# GET  /api/batch/<batch_id>            status of every item
+# GET  /api/batch/<batch_id>/events     per-item updates as newline-delimited JSON, until done
+# GET  /api/batch/<batch_id>/download   zip of all successful results
+
+batch_bp = Blueprint('batch_bp', __name__, url_prefix='/api')
+
+
+def _parse_json_field(value, name):
+    if value is None or value == '':
+        return None
+    try:
+        return json.loads(value)
+    except ValueError:
+        raise ValueError(f"'{name}' must be valid JSON.")
+
+
+@batch_bp.route('/batch', methods=['POST'])
+def create_batch_route():
+    try:
+        if request.is_json:
+            data = request.get_json()
+            files = []
+            recipe = data.get('recipe')
+            sessions = data.get('sessions')
+            output_format = data.get('format')
+        else:
+            # Batches carry many files, so they get their own body limit (Flask >= 3.1)
+            try:
+                request.max_content_length = config.BATCH_MAX_CONTENT_LENGTH
+            except AttributeError:
+                pass
+            files = request.files.getlist('files')
+            recipe = _parse_json_field(request.form.get('recipe'), 'recipe')
+            sessions = _parse_json_field(request.form.get('sessions'), 'sessions')
+            output_format = request.form.get('format')
+
+        if sessions is not None and not isinstance(sessions, list):
+            return jsonify({"error": "'sessions' must be a list."}), 400
+
+        batch_status = batch_service.create_batch(files, sessions, recipe, output_format)
+        return jsonify(batch_status), 202
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        current_app.logger.error(f"Batch creation error: {e}", exc_info=True)
+        return jsonify({"error": "Server error while creating batch."}), 500
+
+
+@batch_bp.route('/batch/<batch_id>', methods=['GET'])
+def batch_status_route(batch_id):
+    batch_status = batch_service.get_batch_status(batch_id)
+    if not batch_status:
+        return jsonify({"error": "Batch not found or expired."}), 404
+    return jsonify(batch_status), 200
+
+
+@batch_bp.route('/batch/<batch_id>/events', methods=['GET'])
+def batch_events_route(batch_id):
+    if not batch_service.get_batch_status(batch_id):
+        return jsonify({"error": "Batch not found or expired."}), 404
+
+    def generate():
+        for event in batch_service.iter_batch_events(batch_id):
+            # Empty lines are keepalives
+            yield (json.dumps({"type": "item", **event}) if event else '') + '\n'
+        yield json.dumps({"type": "done", **batch_service.get_batch_status(batch_id)}) + '\n'
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='application/x-ndjson',
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"} # Don't let nginx buffer updates
+    )
+
+
+@batch_bp.route('/batch/<batch_id>/download', methods=['GET'])
+def batch_download_route(batch_id):
+    try:
+        archive_path = batch_service.build_archive(batch_id)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 409
+    except Exception as e:
+        current_app.logger.error(f"Batch archive error for {batch_id}: {e}", exc_info=True)
+        return jsonify({"error": "Server error while building batch archive."}), 500
+    if not archive_path:
+        return jsonify({"error": "Batch not found or expired."}), 404
+
+    directory, filename = os.path.split(archive_path)
+    return send_from_directory(
+        directory=directory,
+        path=filename,
+        as_attachment=True,
+        download_name=f"haguma_batch_{batch_id[:8]}.zip",
+        mimetype='application/zip'
+    )
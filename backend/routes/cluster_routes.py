@@ -0,0 +1,55 @@
+import hmac
+from flask import Blueprint, request, jsonify, current_app
+import config # For the cluster token
+from services import image_service, residency
+from utils import affinity, session_locks
+
+# --- Cluster Routes ---
+# Called by cluster.py's router only (it never forwards /api/cluster/... from clients), and
+# only with the shared X-Haguma-Cluster-Token it started this process with.
+# GET  /api/cluster          this process's node id and ring
+# POST /api/cluster/ring     JSON {"members": [...]}: installs the ring, then releases the sessions
+#                            this process no longer owns -> {"released": n}
+
+cluster_bp = Blueprint('cluster_bp', __name__, url_prefix='/api')
+
+
+def _authorized():
+    token = request.headers.get('X-Haguma-Cluster-Token', '')
+    return bool(config.CLUSTER_TOKEN) and hmac.compare_digest(token, config.CLUSTER_TOKEN)
+
+
+@cluster_bp.route('/cluster', methods=['GET'])
+def cluster_state_route():
+    if not _authorized():
+        return jsonify({"error": "Not found."}), 404
+    return jsonify({**affinity.get_state(), "sessions": len(image_service.session_history)}), 200
+
+
+@cluster_bp.route('/cluster/ring', methods=['POST'])
+def cluster_ring_route():
+    if not _authorized():
+        return jsonify({"error": "Not found."}), 404
+    data = request.get_json(silent=True)
+    members = data.get('members') if data else None
+    if not isinstance(members, list) or not all(isinstance(m, str) for m in members):
+        return jsonify({"error": "'members' must be a list of node ids."}), 400
+    try:
+        affinity.set_ring(members)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 409
+
+    # From here on new ids are drawn for the new ring; hand over what now belongs elsewhere.
+    # Waiting for each session's lock lets a running edit finish (and journal) before it moves.
+    released = 0
+    for session_id in set(image_service.session_history) | set(residency.get_session_ids()):
+        if affinity.owns(session_id):
+            continue
+        try:
+            session_locks.run_exclusive(session_id, 'handoff',
+                                        lambda: image_service.release_session(session_id), coalesce=False)
+            released += 1
+        except Exception as e:
+            current_app.logger.error(f"Cluster: could not release session {session_id}: {e}", exc_info=True)
+    current_app.logger.info(f"Cluster: ring is now {members}; released {released} sessions.")
+    return jsonify({"released": released}), 200
@@ -1,11 +1,70 @@
-from flask import Blueprint, request, jsonify, send_from_directory, current_app
-from services import image_service
+from flask import Blueprint, request, jsonify, send_file, send_from_directory, current_app, Response, stream_with_context, g
+from services import image_service, operations, residency, version_store, export_service, session_journal, compute_pool, image_stats, animation, speculation
 import config # For TEMP_FOLDER if needed directly, though service should handle paths
 import os
 from PIL import UnidentifiedImageError # For specific exception handling
+from utils import session_locks
+from utils.session_locks import RequestSuperseded
+from utils import memory_budget, cost_model
+from utils.memory_budget import MemoryLimitExceeded
+from utils import cancellation
+from utils.cancellation import OperationCancelled
 
 image_bp = Blueprint('image_bp', __name__, url_prefix='/api')
 
+@image_bp.before_request
+def _pin_session():
+    # Routes use the working file get_temp_filepath found, mostly outside the session lock;
+    # the idle-session demotion leaves it in place until the request is over
+    image_session_id = (request.view_args or {}).get('image_session_id')
+    if image_session_id:
+        residency.pin(image_session_id)
+        g.pinned_session_id = image_session_id
+
+@image_bp.teardown_request
+def _unpin_session(error=None):
+    image_session_id = g.pop('pinned_session_id', None)
+    if image_session_id:
+        residency.unpin(image_session_id)
+
+def _superseded_response(image_session_id, error):
+    # Not a failure: a newer request of the same kind for this session is going to run instead
+    current_app.logger.info(f"Superseded request for {image_session_id}: {str(error)}")
+    return jsonify({"error": str(error), "superseded": True}), 409
+
+def _memory_limit_response(image_session_id, error):
+    # 413: this image is too large for the operation; 503: too many large operations in flight
+    current_app.logger.warning(f"Memory limit for {image_session_id}: {str(error)}")
+    response = jsonify({"error": str(error), "memory_limited": True})
+    if error.retry_after:
+        response.headers['Retry-After'] = str(error.retry_after)
+    return response, error.status_code
+
+def _disconnect_probe():
+    # The ASGI front-end (asgi.py) hands over its own probe, fed by the server's disconnect event
+    probe = request.environ.get('haguma.disconnect_probe')
+    if probe is not None:
+        return probe
+    # The raw client socket, where the server exposes it (gunicorn sync workers, werkzeug dev server)
+    sock = request.environ.get('gunicorn.socket') or request.environ.get('werkzeug.socket')
+    return cancellation.socket_disconnect_probe(sock) if sock is not None else None
+
+def _run_operation(image_session_id, kind, func):
+    # Like session_locks.run_exclusive, but under the operation's deadline and the client's
+    # connection: a request abandoned while queued behind others never starts
+    def run():
+        cancellation.checkpoint()
+        return func()
+    with cancellation.scope(kind, _disconnect_probe()):
+        return session_locks.run_exclusive(image_session_id, kind, run)
+
+def _cancelled_response(image_session_id, error):
+    # Nothing was written: the session's image and history are as before the request.
+    # 504 for a deadline; 499 (nginx's "client closed request") when nobody is listening anyway
+    current_app.logger.warning(f"Cancelled request for {image_session_id}: {str(error)}")
+    status_code = 504 if isinstance(error, cancellation.DeadlineExceeded) else 499
+    return jsonify({"error": str(error), "cancelled": True, "reason": error.reason}), status_code
+
 @image_bp.route('/upload', methods=['POST'])
 def upload_image_route():
     if 'file' not in request.files:
@@ -23,6 +82,7 @@ def upload_image_route():
             "original_extension": upload_data["original_extension"],
             "initial_dimensions": upload_data["initial_dimensions"],
             "format": upload_data["format"],
+            "frames": upload_data["frames"],
             "size_bytes": upload_data["size_bytes"]
         }
         # Add history status (should be false/false initially, but good to be consistent)
@@ -41,235 +101,73 @@ def upload_image_route():
         return jsonify({"error": "An unexpected server error occurred during upload."}), 500
 
 
-@image_bp.route('/process/<image_session_id>/<original_extension>/resize', methods=['POST'])
-def resize_image_route(image_session_id, original_extension):
-    filepath = image_service.get_temp_filepath(image_session_id, original_extension)
-    if not os.path.exists(filepath):
-        return jsonify({"error": "Image session not found or file does not exist."}), 404
-
-    data = request.get_json()
+def _missing_params_message(operation, data):
+    # The answers the per-operation routes gave before the registry, which clients may match on
+    required = operation.required_params()
+    if len(required) == 1:
+        return f"Missing JSON payload or '{required[0]}' parameter."
     if not data:
-        return jsonify({"error": "Missing JSON payload."}), 400
-
-    try:
-        new_metadata = image_service.process_resize(
-            filepath,
-            width_px=data.get('width_px'),
-            height_px=data.get('height_px'),
-            percentage=data.get('percentage'),
-            maintain_aspect_ratio=data.get('maintain_aspect_ratio', True)
-        )
-        history_status = image_service.get_history_status(image_session_id)
-        new_metadata.update(history_status)
-        return jsonify(new_metadata), 200
-    except FileNotFoundError: # Should be caught by the check above, but good practice
-        return jsonify({"error": "Image file not found for processing."}), 404
-    except ValueError as e: # Validation errors from service (e.g. bad params)
-        current_app.logger.warning(f"Resize input error for {image_session_id}: {str(e)}")
-        return jsonify({"error": str(e)}), 400
-    except RuntimeError as e: # Unexpected errors during processing
-        current_app.logger.error(f"Resize runtime error for {image_session_id}: {str(e)}", exc_info=True)
-        return jsonify({"error": str(e)}), 500
-    except Exception as e:
-        current_app.logger.error(f"Unexpected resize error for {image_session_id}: {str(e)}", exc_info=True)
-        return jsonify({"error": "An unexpected server error occurred during resize."}), 500
+        return "Missing JSON payload."
+    return f"Missing required parameters. Need: {', '.join(required)}"
 
+# One route for every registered operation (services/operations.py); undo, redo and update
+# have their own routes below, which Flask matches before this one
+@image_bp.route('/process/<image_session_id>/<original_extension>/<op>', methods=['POST'])
+def process_image_route(image_session_id, original_extension, op):
+    operation = operations.OPERATIONS.get(op)
+    if operation is None:
+        return jsonify({"error": f"Unknown operation '{op}'. Allowed: {', '.join(operations.OPERATIONS)}"}), 404
 
-@image_bp.route('/process/<image_session_id>/<original_extension>/rotate', methods=['POST'])
-def rotate_image_route(image_session_id, original_extension):
     filepath = image_service.get_temp_filepath(image_session_id, original_extension)
     if not os.path.exists(filepath):
         return jsonify({"error": "Image session not found or file does not exist."}), 404
 
-    data = request.get_json()
-    if not data or 'angle' not in data:
-        return jsonify({"error": "Missing JSON payload or 'angle' parameter."}), 400
+    data = request.get_json(silent=True) or {}
+    missing = operation.missing_params(data)
+    if missing or (operation.payload_required and not data):
+        return jsonify({"error": _missing_params_message(operation, data)}), 400
 
     try:
-        new_metadata = image_service.process_rotate(filepath, data['angle'])
+        kwargs = operation.parse(data)
+        new_metadata = _run_operation(image_session_id, op, lambda: operations.run(op, filepath, kwargs))
         history_status = image_service.get_history_status(image_session_id)
         new_metadata.update(history_status)
         return jsonify(new_metadata), 200
+    except RequestSuperseded as e:
+        return _superseded_response(image_session_id, e)
+    except MemoryLimitExceeded as e:
+        return _memory_limit_response(image_session_id, e)
+    except OperationCancelled as e:
+        return _cancelled_response(image_session_id, e)
     except FileNotFoundError:
         return jsonify({"error": "Image file not found for processing."}), 404
-    except ValueError as e: # Validation errors (e.g. bad angle)
-        current_app.logger.warning(f"Rotate input error for {image_session_id}: {str(e)}")
-        return jsonify({"error": str(e)}), 400
-    except RuntimeError as e: # Unexpected errors
-        current_app.logger.error(f"Rotate runtime error for {image_session_id}: {str(e)}", exc_info=True)
-        return jsonify({"error": str(e)}), 500
-    except Exception as e:
-        current_app.logger.error(f"Unexpected rotate error for {image_session_id}: {str(e)}", exc_info=True)
-        return jsonify({"error": "An unexpected server error occurred during rotation."}), 500
-
-
-@image_bp.route('/process/<image_session_id>/<original_extension>/flip', methods=['POST'])
-def flip_image_route(image_session_id, original_extension):
-    filepath = image_service.get_temp_filepath(image_session_id, original_extension)
-    if not os.path.exists(filepath):
-        return jsonify({"error": "Image session not found or file does not exist."}), 404
-
-    data = request.get_json()
-    if not data or 'axis' not in data:
-        return jsonify({"error": "Missing JSON payload or 'axis' parameter."}), 400
-
-    try:
-        new_metadata = image_service.process_flip(filepath, data['axis'])
-        history_status = image_service.get_history_status(image_session_id)
-        new_metadata.update(history_status)
-        return jsonify(new_metadata), 200
-    except ValueError as e:
-        return jsonify({"error": str(e)}), 400
-    except Exception as e:
-        current_app.logger.error(f"Flip error: {e}", exc_info=True)
-        return jsonify({"error": "Server error during flip."}), 500
-
-
-@image_bp.route('/process/<image_session_id>/<original_extension>/crop', methods=['POST'])
-def crop_image_route(image_session_id, original_extension):
-    filepath = image_service.get_temp_filepath(image_session_id, original_extension)
-    if not os.path.exists(filepath):
-        return jsonify({"error": "Image session not found or file does not exist."}), 404
-
-    data = request.get_json()
-    if not data or 'preset' not in data:
-        return jsonify({"error": "Missing JSON payload or 'preset' parameter."}), 400
-
-    try:
-        new_metadata = image_service.process_crop(filepath, data['preset'])
-        history_status = image_service.get_history_status(image_session_id)
-        new_metadata.update(history_status)
-        return jsonify(new_metadata), 200
-    except ValueError as e:
-        return jsonify({"error": str(e)}), 400
-    except Exception as e:
-        current_app.logger.error(f"Crop error: {e}", exc_info=True)
-        return jsonify({"error": "Server error during crop."}), 500
-
-
-@image_bp.route('/process/<image_session_id>/<original_extension>/crop-custom', methods=['POST'])
-def crop_custom_image_route(image_session_id, original_extension):
-    filepath = image_service.get_temp_filepath(image_session_id, original_extension)
-    if not os.path.exists(filepath):
-        return jsonify({"error": "Image session not found or file does not exist."}), 404
-
-    data = request.get_json()
-    if not data:
-        return jsonify({"error": "Missing JSON payload."}), 400
-
-    # Validate required parameters
-    required_params = ['x', 'y', 'width', 'height']
-    if not all(param in data for param in required_params):
-        return jsonify({"error": f"Missing required parameters. Need: {', '.join(required_params)}"}), 400
-
-    try:
-        new_metadata = image_service.process_custom_crop(
-            filepath, 
-            x=data['x'], 
-            y=data['y'], 
-            width=data['width'], 
-            height=data['height']
-        )
-        history_status = image_service.get_history_status(image_session_id)
-        new_metadata.update(history_status)
-        return jsonify(new_metadata), 200
-    except ValueError as e:
-        current_app.logger.warning(f"Custom crop validation error for {image_session_id}: {str(e)}")
-        return jsonify({"error": str(e)}), 400
-    except Exception as e:
-        current_app.logger.error(f"Custom crop error for {image_session_id}: {e}", exc_info=True)
-        return jsonify({"error": "Server error during custom crop."}), 500
-
-
-
-@image_bp.route('/process/<image_session_id>/<original_extension>/grayscale', methods=['POST'])
-def grayscale_image_route(image_session_id, original_extension):
-    filepath = image_service.get_temp_filepath(image_session_id, original_extension)
-    if not os.path.exists(filepath):
-        return jsonify({"error": "Image session not found or file does not exist."}), 404
-
-    data = request.get_json()
-    # Default to 100 if not provided (backward compatibility)
-    intensity = data.get('intensity', 100) if data else 100
-
-    try:
-        new_metadata = image_service.process_grayscale(filepath, intensity)
-        history_status = image_service.get_history_status(image_session_id)
-        new_metadata.update(history_status)
-        return jsonify(new_metadata), 200
-    except ValueError as e:
-        return jsonify({"error": str(e)}), 400
-    except Exception as e:
-        current_app.logger.error(f"Grayscale error: {e}", exc_info=True)
-        return jsonify({"error": "Server error during grayscale conversion."}), 500
-
-
-@image_bp.route('/process/<image_session_id>/<original_extension>/brightness', methods=['POST'])
-def brightness_image_route(image_session_id, original_extension):
-    filepath = image_service.get_temp_filepath(image_session_id, original_extension)
-    if not os.path.exists(filepath):
-        return jsonify({"error": "Image session not found or file does not exist."}), 404
-
-    data = request.get_json()
-    if not data or 'level' not in data:
-        return jsonify({"error": "Missing JSON payload or 'level' parameter."}), 400
-
-    try:
-        new_metadata = image_service.process_brightness(filepath, data['level'])
-        history_status = image_service.get_history_status(image_session_id)
-        new_metadata.update(history_status)
-        return jsonify(new_metadata), 200
-    except ValueError as e:
-        return jsonify({"error": str(e)}), 400
-    except Exception as e:
-        current_app.logger.error(f"Brightness error: {e}", exc_info=True)
-        return jsonify({"error": "Server error during brightness adjustment."}), 500
-
-
-@image_bp.route('/process/<image_session_id>/<original_extension>/contrast', methods=['POST'])
-def contrast_image_route(image_session_id, original_extension):
-    filepath = image_service.get_temp_filepath(image_session_id, original_extension)
-    if not os.path.exists(filepath):
-        return jsonify({"error": "Image session not found or file does not exist."}), 404
-
-    data = request.get_json()
-    if not data or 'level' not in data:
-        return jsonify({"error": "Missing JSON payload or 'level' parameter."}), 400
-
-    try:
-        new_metadata = image_service.process_contrast(filepath, data['level'])
-        history_status = image_service.get_history_status(image_session_id)
-        new_metadata.update(history_status)
-        return jsonify(new_metadata), 200
-    except ValueError as e:
+    except ValueError as e: # Validation errors from service (e.g. bad params)
+        current_app.logger.warning(f"{operation.label.capitalize()} input error for {image_session_id}: {str(e)}")
         return jsonify({"error": str(e)}), 400
     except Exception as e:
-        current_app.logger.error(f"Contrast error: {e}", exc_info=True)
-        return jsonify({"error": "Server error during contrast adjustment."}), 500
+        current_app.logger.error(f"Unexpected {operation.label} error for {image_session_id}: {str(e)}", exc_info=True)
+        if operation.shows_runtime_errors and isinstance(e, RuntimeError):
+            return jsonify({"error": str(e)}), 500
+        return jsonify({"error": operation.server_error}), 500
 
 
-@image_bp.route('/process/<image_session_id>/<original_extension>/filter', methods=['POST'])
-def filter_image_route(image_session_id, original_extension):
+@image_bp.route('/histogram/<image_session_id>/<original_extension>', methods=['GET'])
+def histogram_route(image_session_id, original_extension):
     filepath = image_service.get_temp_filepath(image_session_id, original_extension)
     if not os.path.exists(filepath):
-        return jsonify({"error": "Image session not found or file does not exist."}), 404
-
-    data = request.get_json()
-    if not data or 'type' not in data:
-        return jsonify({"error": "Missing JSON payload or 'type' parameter."}), 400
-
-    intensity = data.get('intensity', 0)
+        return jsonify({"error": "Image not found or session expired."}), 404
 
     try:
-        new_metadata = image_service.process_filter(filepath, data['type'], intensity)
-        history_status = image_service.get_history_status(image_session_id)
-        new_metadata.update(history_status)
-        return jsonify(new_metadata), 200
-    except ValueError as e:
-        return jsonify({"error": str(e)}), 400
+        # Under the session's lock, so the statistics are cached for the version they describe
+        stats = _run_operation(image_session_id, 'histogram', lambda: image_service.get_histogram(filepath))
+        return jsonify(stats), 200
+    except OperationCancelled as e:
+        return _cancelled_response(image_session_id, e)
+    except FileNotFoundError:
+        return jsonify({"error": "Image not found or session expired."}), 404
     except Exception as e:
-        current_app.logger.error(f"Filter error: {e}", exc_info=True)
-        return jsonify({"error": "Server error during filter application."}), 500
+        current_app.logger.error(f"Histogram error for {image_session_id}: {e}", exc_info=True)
+        return jsonify({"error": "Server error while computing the histogram."}), 500
 
 
 @image_bp.route('/download/<image_session_id>/<original_extension>', methods=['GET'])
@@ -290,8 +188,23 @@ def download_image_route(image_session_id, original_extension):
     
     if target_format:
         try:
-            # Convert and get path to temporary converted file
-            converted_filepath = image_service.convert_format(filepath_on_server, target_format)
+            # Optional encoder settings: ?preset=web and/or ?target_kb=200 (jpeg/webp)
+            target_kb = request.args.get('target_kb', type=int)
+            preset = request.args.get('preset')
+            converted_filepath = None
+            converted_here = False
+            if not target_kb:
+                # Plain conversions are likely precomputed after the last edit (services/speculation.py)
+                speculation.record_download(image_session_id, target_format, preset)
+                converted_filepath = image_service.get_precomputed_conversion(image_session_id, target_format, preset)
+            if converted_filepath is None:
+                with cancellation.scope('convert', _disconnect_probe()):
+                    converted_filepath = image_service.convert_format(
+                        filepath_on_server, target_format,
+                        preset=preset,
+                        target_bytes=target_kb * 1024 if target_kb else None
+                    )
+                converted_here = True
             
             # Serve the converted file
             directory, filename = os.path.split(converted_filepath)
@@ -308,10 +221,18 @@ def download_image_route(image_session_id, original_extension):
             mime_type = f'image/{target_format.lower()}'
             if target_format.lower() == 'jpg': mime_type = 'image/jpeg'
 
-            # Use send_file or send_from_directory. 
-            # Note: send_from_directory is safer but we need to know the dir.
-            # We know it's in the same dir as original (TEMP_FOLDER)
-            
+            if converted_here:
+                # This request's own file: unlinked once open, it's gone when the response is sent
+                # (where removing an open file fails, the cleanup job deletes it later)
+                converted_file = open(converted_filepath, 'rb')
+                try:
+                    os.remove(converted_filepath)
+                except OSError:
+                    pass
+                return send_file(converted_file, as_attachment=True, download_name=download_name, mimetype=mime_type)
+
+            # Precomputed conversions stay for later downloads of the same version.
+            # We know it's in the same (sharded) dir as the session's working file
             return send_from_directory(
                 directory=directory,
                 path=filename,
@@ -319,9 +240,11 @@ def download_image_route(image_session_id, original_extension):
                 download_name=download_name,
                 mimetype=mime_type
             )
-            # Note: The converted file is left in temp folder. 
-            # The cleanup script should handle it eventually.
             
+        except MemoryLimitExceeded as e:
+            return _memory_limit_response(image_session_id, e)
+        except OperationCancelled as e:
+            return _cancelled_response(image_session_id, e)
         except ValueError as e:
             return jsonify({"error": str(e)}), 400
         except Exception as e:
@@ -342,14 +265,76 @@ def download_image_route(image_session_id, original_extension):
     if original_extension.lower() == 'jpg':
         mime_type = 'image/jpeg'
     
+    # Sessions are sharded into subdirectories of WORKING_FOLDER
+    session_directory, session_filename = os.path.split(filepath_on_server)
     return send_from_directory(
-        directory=config.TEMP_FOLDER,
-        path=image_service.get_session_filename(image_session_id, original_extension), # just the filename
+        directory=session_directory,
+        path=session_filename, # just the filename
         as_attachment=True,
         download_name=download_name,
         mimetype=mime_type
     )
 
+@image_bp.route('/region/<image_session_id>/<original_extension>', methods=['GET'])
+def region_image_route(image_session_id, original_extension):
+    """
+    One rectangle of the current image: ?x=&y=&width=&height= in pixels, optional format and preset.
+    With raw working images enabled only the rows of the rectangle are read.
+    """
+    filepath_on_server = image_service.get_temp_filepath(image_session_id, original_extension)
+    if not os.path.exists(filepath_on_server):
+        return jsonify({"error": "Image not found or session expired."}), 404
+
+    box = [request.args.get(name, type=int) for name in ('x', 'y', 'width', 'height')]
+    if any(value is None for value in box):
+        return jsonify({"error": "Missing or invalid 'x', 'y', 'width' or 'height' parameter."}), 400
+    try:
+        data, info = image_service.read_region(
+            filepath_on_server, *box, target_format=request.args.get('format'), preset=request.args.get('preset'))
+    except FileNotFoundError:
+        return jsonify({"error": "Image not found or session expired."}), 404
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        current_app.logger.error(f"Region read error: {e}", exc_info=True)
+        return jsonify({"error": "Server error while reading image region."}), 500
+    return Response(data, mimetype=f"image/{info['extension']}", headers={"Cache-Control": "no-store"})
+
+@image_bp.route('/export/<image_session_id>/<original_extension>', methods=['POST'])
+def export_image_route(image_session_id, original_extension):
+    """
+    Streams a zip with several variants of the image, encoded in parallel.
+    JSON: {"exports": [{"format": "jpeg", "quality": 85, "max_dimension": 1200, "name": "web"}, ...],
+           "filename": "optional archive name"}
+    """
+    data = request.get_json(silent=True) or {}
+    filepath = image_service.get_temp_filepath(image_session_id, original_extension)
+    if not os.path.exists(filepath):
+        return jsonify({"error": "Image not found or session expired."}), 404
+
+    try:
+        specs = export_service.parse_export_specs(data.get('exports'))
+        chunks = export_service.stream_export(filepath, specs)
+    except FileNotFoundError:
+        return jsonify({"error": "Image not found or session expired."}), 404
+    except (ValueError, TypeError) as e:
+        return jsonify({"error": str(e)}), 400
+    except UnidentifiedImageError:
+        return jsonify({"error": "Cannot process this image type or image is corrupt."}), 400
+    except Exception as e:
+        current_app.logger.error(f"Export error for {image_session_id}: {e}", exc_info=True)
+        return jsonify({"error": "Server error during export."}), 500
+
+    download_name = data.get('filename') or "haguma_art_export"
+    if not download_name.lower().endswith('.zip'):
+        download_name = f"{download_name}.zip"
+    return Response(
+        stream_with_context(chunks),
+        mimetype='application/zip',
+        headers={"Content-Disposition": f"attachment; filename=\"{os.path.basename(download_name)}\""}
+    )
+
+
 @image_bp.route('/process/<image_session_id>/<original_extension>/undo', methods=['POST'])
 def undo_image_route(image_session_id, original_extension):
     filepath = image_service.get_temp_filepath(image_session_id, original_extension)
@@ -357,13 +342,16 @@ def undo_image_route(image_session_id, original_extension):
         return jsonify({"error": "Image session not found or file does not exist."}), 404
 
     try:
-        new_metadata, error = image_service.undo_image(image_session_id, original_extension)
+        new_metadata, error = session_locks.run_exclusive(
+            image_session_id, 'undo', lambda: image_service.undo_image(image_session_id, original_extension))
         if error:
             return jsonify({"error": error}), 400
         
         history_status = image_service.get_history_status(image_session_id)
         new_metadata.update(history_status)
         return jsonify(new_metadata), 200
+    except RequestSuperseded as e:
+        return _superseded_response(image_session_id, e)
     except Exception as e:
         current_app.logger.error(f"Undo error: {e}", exc_info=True)
         return jsonify({"error": "Server error during undo."}), 500
@@ -375,17 +363,39 @@ def redo_image_route(image_session_id, original_extension):
         return jsonify({"error": "Image session not found or file does not exist."}), 404
 
     try:
-        new_metadata, error = image_service.redo_image(image_session_id, original_extension)
+        new_metadata, error = session_locks.run_exclusive(
+            image_session_id, 'redo', lambda: image_service.redo_image(image_session_id, original_extension))
         if error:
             return jsonify({"error": error}), 400
         
         history_status = image_service.get_history_status(image_session_id)
         new_metadata.update(history_status)
         return jsonify(new_metadata), 200
+    except RequestSuperseded as e:
+        return _superseded_response(image_session_id, e)
     except Exception as e:
         current_app.logger.error(f"Redo error: {e}", exc_info=True)
         return jsonify({"error": "Server error during redo."}), 500
 
+@image_bp.route('/stats', methods=['GET'])
+def stats_route():
+    # Capacity planning: residency tier occupancy and transitions, version dedup, lock contention,
+    # memory estimates versus measured RSS growth and expected versus measured durations per operation,
+    # downloads precomputed in the background, cancelled operations, journal writes, compute worker tasks and shared pixel buffers, histogram cache hits
+    return jsonify({
+        "residency": residency.get_stats(),
+        "versions": version_store.get_stats(),
+        "session_locks": session_locks.get_stats(),
+        "memory": memory_budget.get_stats(),
+        "costs": cost_model.get_stats(),
+        "speculation": speculation.get_stats(),
+        "cancellation": cancellation.get_stats(),
+        "journal": session_journal.get_stats(),
+        "compute": compute_pool.get_stats(),
+        "image_stats": image_stats.get_cache_stats(),
+        "animation": animation.get_stats()
+    }), 200
+
 @image_bp.app_errorhandler(413) # Register for the blueprint or app
 def request_entity_too_large_handler(error):
     return jsonify(error=f"File is too large. Maximum size is {config.MAX_FILE_SIZE_MB}MB."), 413
@@ -403,7 +413,8 @@ def update_image_route(image_session_id, original_extension):
     
     try:
         current_app.logger.info(f"Update route: Processing file for session {image_session_id}, extension {original_extension}")
-        new_metadata = image_service.update_image_from_client(image_session_id, original_extension, file)
+        new_metadata = session_locks.run_exclusive(
+            image_session_id, 'update', lambda: image_service.update_image_from_client(image_session_id, original_extension, file))
         
         # Get history status
         history_status = image_service.get_history_status(image_session_id)
@@ -411,6 +422,8 @@ def update_image_route(image_session_id, original_extension):
         
         current_app.logger.info(f"Update route: Successfully updated image")
         return jsonify(new_metadata), 200
+    except RequestSuperseded as e:
+        return _superseded_response(image_session_id, e)
     except FileNotFoundError as e:
         current_app.logger.error(f"Update error - File not found: {str(e)}")
         return jsonify({"error": "Session not found"}), 404
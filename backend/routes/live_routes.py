@@ -0,0 +1,205 @@
+import os
+import json
+import time
+from flask import Blueprint, current_app
+from flask_sock import Sock
+from services import image_service, operations, residency
+import config # For live preview settings
+from utils import session_locks
+from utils.session_locks import RequestSuperseded
+from utils.memory_budget import MemoryLimitExceeded
+from utils import cancellation
+from utils.cancellation import OperationCancelled
+
+# --- Live Adjustment Channel ---
+# WebSocket at /api/live/<image_session_id>/<original_extension>
+#
+# Client -> server (text, JSON):
+#   {"type": "adjust", "op": "brightness", "params": {"level": 30}}   preview only
+#   {"type": "commit", "op": "brightness", "params": {"level": 30}}   apply at full resolution
+# Server -> client:
+#   binary JPEG frame for each rendered preview
+#   {"type": "ready" | "committed" | "error", ...} as text JSON
+#
+# Previews are rendered on a downscaled proxy. Only the newest pending adjust message is
+# rendered, so frames are naturally limited to the server's render throughput.
+
+live_bp = Blueprint('live_bp', __name__, url_prefix='/api')
+sock = Sock()
+
+# Operations offered here are the registry's live ones (services/operations.py)
+LIVE_OPERATIONS = [name for name, operation in operations.OPERATIONS.items() if operation.live]
+
+
+def _parse_message(raw):
+    message = json.loads(raw)
+    if not isinstance(message, dict):
+        raise ValueError("Message must be a JSON object.")
+    if message.get('type') not in ('adjust', 'commit'):
+        raise ValueError("Message 'type' must be 'adjust' or 'commit'.")
+    if message.get('op') not in LIVE_OPERATIONS:
+        raise ValueError(f"Unsupported live operation. Allowed: {', '.join(LIVE_OPERATIONS)}")
+
+    params = message.get('params') or {}
+    if not isinstance(params, dict):
+        raise ValueError("'params' must be a JSON object.")
+    # Also accept the keyword name for the filter type, as earlier clients sent it
+    if message['op'] == 'filter' and 'filter_type' in params and 'type' not in params:
+        params['type'] = params.pop('filter_type')
+    message['params'] = operations.OPERATIONS[message['op']].parse(params)
+    return message
+
+
+def _send(ws, payload):
+    ws.send(payload if isinstance(payload, bytes) else json.dumps(payload))
+
+
+# The channel's steps, shared by the flask-sock route below and the ASGI front-end (asgi.py),
+# which drives them from its event loop and runs the blocking ones on its executor.
+
+def open_live_session(image_session_id, original_extension):
+    """
+    Loads the session's preview proxy. Raises FileNotFoundError for an unknown session.
+    The working file isn't demoted while the channel is open; close with close_live_session.
+    """
+    residency.pin(image_session_id)
+    try:
+        filepath = image_service.get_temp_filepath(image_session_id, original_extension)
+        if not os.path.exists(filepath):
+            raise FileNotFoundError(filepath)
+        live = {"image_session_id": image_session_id, "filepath": filepath, "last_frame_at": 0.0}
+        _load_proxy(live)
+    except BaseException:
+        residency.unpin(image_session_id)
+        raise
+    return live
+
+
+def _file_version(filepath):
+    # Edits, undo and redo all put a new file in place, so any of them changes this
+    stat = os.stat(filepath)
+    return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+
+def _load_proxy(live):
+    version = _file_version(live["filepath"])
+    live["proxy"] = image_service.load_preview_proxy(live["filepath"], config.LIVE_PREVIEW_MAX_DIMENSION)
+    live["proxy_version"] = version
+
+
+def _current_proxy(live):
+    """The preview proxy, reloaded first if the image was changed since (e.g. by an HTTP edit or undo)."""
+    if _file_version(live["filepath"]) != live["proxy_version"]:
+        _load_proxy(live)
+    return live["proxy"]
+
+
+def close_live_session(live):
+    residency.unpin(live["image_session_id"])
+
+
+def ready_payload(live):
+    return {"type": "ready", "preview_width": live["proxy"].width, "preview_height": live["proxy"].height}
+
+
+def session_not_found_payload():
+    return {"type": "error", "error": "Image session not found or file does not exist."}
+
+
+def next_message(raw, poll):
+    """
+    Parses raw, then drains whatever queued up behind it (poll() returns the next raw message
+    without waiting, or None): only the newest adjust matters. A commit stops the drain so it
+    is never reordered behind later previews. Raises ValueError/TypeError for a bad message.
+    """
+    message = _parse_message(raw)
+    while message['type'] == 'adjust':
+        extra = poll()
+        if extra is None:
+            break
+        message = _parse_message(extra)
+    return message
+
+
+def frame_wait(live, message):
+    """Seconds to wait before handling message, keeping previews under LIVE_MAX_FPS."""
+    if message['type'] != 'adjust':
+        return 0.0
+    return 1.0 / config.LIVE_MAX_FPS - (time.monotonic() - live["last_frame_at"])
+
+
+def handle_message(live, message):
+    """
+    Renders a preview or applies a commit (blocking).
+    Returns (payloads to send, whether to keep the channel open); a payload is a JSON dict or a frame.
+    """
+    operation = operations.OPERATIONS[message['op']]
+
+    if message['type'] == 'adjust':
+        try:
+            frame = operation.apply(_current_proxy(live), **message['params'])
+            payload = image_service.encode_preview_frame(frame, config.LIVE_PREVIEW_QUALITY)
+            live["last_frame_at"] = time.monotonic()
+            return [payload], True
+        except FileNotFoundError:
+            return [session_not_found_payload()], False
+        except (ValueError, TypeError) as e:
+            return [{"type": "error", "error": str(e)}], True
+
+    # Commit: apply at full resolution through the same path as the HTTP routes
+    image_session_id = live["image_session_id"]
+    filepath = live["filepath"]
+    try:
+        # Deadline only: the socket belongs to the WebSocket, which reports its own disconnects
+        with cancellation.scope(message['op']):
+            new_metadata = session_locks.run_exclusive(
+                image_session_id, message['op'], lambda: operations.run(message['op'], filepath, message['params']))
+        new_metadata.update(image_service.get_history_status(image_session_id))
+        _load_proxy(live)
+        return [{"type": "committed", "op": message['op'], **new_metadata}], True
+    except RequestSuperseded as e:
+        return [{"type": "error", "error": str(e), "superseded": True}], True
+    except MemoryLimitExceeded as e:
+        return [{"type": "error", "error": str(e), "memory_limited": True}], True
+    except OperationCancelled as e:
+        return [{"type": "error", "error": str(e), "cancelled": True}], True
+    except FileNotFoundError:
+        return [{"type": "error", "error": "Image file not found for processing."}], False
+    except ValueError as e:
+        return [{"type": "error", "error": str(e)}], True
+    except Exception as e:
+        current_app.logger.error(f"Live commit error for {image_session_id}: {e}", exc_info=True)
+        return [{"type": "error", "error": "Server error while applying adjustment."}], True
+
+
+@sock.route('/live/<image_session_id>/<original_extension>', bp=live_bp)
+def live_adjust_route(ws, image_session_id, original_extension):
+    try:
+        live = open_live_session(image_session_id, original_extension)
+    except FileNotFoundError:
+        _send(ws, session_not_found_payload())
+        return
+    try:
+        _send(ws, ready_payload(live))
+
+        while True:
+            raw = ws.receive()
+            if raw is None:
+                break
+
+            try:
+                message = next_message(raw, lambda: ws.receive(timeout=0))
+            except (ValueError, TypeError) as e:
+                _send(ws, {"type": "error", "error": str(e)})
+                continue
+
+            wait = frame_wait(live, message)
+            if wait > 0:
+                time.sleep(wait)
+            payloads, keep_open = handle_message(live, message)
+            for payload in payloads:
+                _send(ws, payload)
+            if not keep_open:
+                break
+    finally:
+        close_live_session(live)
@@ -0,0 +1,121 @@
+from flask import Blueprint, request, jsonify, current_app
+from werkzeug.exceptions import ClientDisconnected
+from PIL import UnidentifiedImageError
+from services import upload_service, image_service
+from services.upload_service import UploadOffsetMismatch
+
+# --- Resumable Upload Routes ---
+# POST   /api/uploads                   JSON {"filename", "length", optional "sha256"} -> 201, upload id
+# HEAD   /api/uploads/<upload_id>       Upload-Offset / Upload-Length headers (where to resume)
+# GET    /api/uploads/<upload_id>       status as JSON
+# PATCH  /api/uploads/<upload_id>       body: raw bytes (application/offset+octet-stream),
+#                                       Upload-Offset header: where they go -> 204, new Upload-Offset
+# POST   /api/uploads/<upload_id>/finalize   -> same response as POST /api/upload
+# DELETE /api/uploads/<upload_id>       abort
+
+upload_bp = Blueprint('upload_bp', __name__, url_prefix='/api')
+
+CHUNK_CONTENT_TYPE = 'application/offset+octet-stream'
+
+
+def _offset_headers(upload_status):
+    return {
+        "Upload-Offset": str(upload_status["offset"]),
+        "Upload-Length": str(upload_status["length"]),
+        "Cache-Control": "no-store"
+    }
+
+
+def _not_found():
+    return jsonify({"error": "Upload not found or expired."}), 404
+
+
+@upload_bp.route('/uploads', methods=['POST'])
+def create_upload_route():
+    data = request.get_json(silent=True)
+    if not data:
+        return jsonify({"error": "Missing JSON payload."}), 400
+    try:
+        upload_status = upload_service.create_upload(data.get('filename'), data.get('length'), data.get('sha256'))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        current_app.logger.error(f"Upload creation error: {e}", exc_info=True)
+        return jsonify({"error": "Server error while starting upload."}), 500
+
+    headers = _offset_headers(upload_status)
+    headers["Location"] = f"/api/uploads/{upload_status['upload_id']}"
+    return jsonify(upload_status), 201, headers
+
+
+@upload_bp.route('/uploads/<upload_id>', methods=['HEAD', 'GET'])
+def upload_status_route(upload_id):
+    upload_status = upload_service.get_upload_status(upload_id)
+    if not upload_status:
+        return _not_found()
+    return jsonify(upload_status), 200, _offset_headers(upload_status)
+
+
+@upload_bp.route('/uploads/<upload_id>', methods=['PATCH'])
+def append_chunk_route(upload_id):
+    if request.mimetype != CHUNK_CONTENT_TYPE:
+        return jsonify({"error": f"Chunks must be sent as {CHUNK_CONTENT_TYPE}."}), 415
+    offset = request.headers.get('Upload-Offset', type=int)
+    if offset is None or offset < 0:
+        return jsonify({"error": "Missing or invalid Upload-Offset header."}), 400
+
+    try:
+        # request.stream is read as it arrives; the chunk is never buffered whole
+        upload_status = upload_service.append_chunk(upload_id, offset, request.stream)
+    except UploadOffsetMismatch as e:
+        return jsonify({"error": str(e), "offset": e.offset}), 409, {"Upload-Offset": str(e.offset)}
+    except ClientDisconnected:
+        # The bytes that did arrive are kept; the client resumes from HEAD's offset
+        current_app.logger.info(f"Upload {upload_id}: client disconnected mid-chunk")
+        return jsonify({"error": "Client disconnected."}), 400
+    except ValueError as e:
+        current_app.logger.warning(f"Upload {upload_id} rejected: {str(e)}")
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        current_app.logger.error(f"Upload chunk error for {upload_id}: {e}", exc_info=True)
+        return jsonify({"error": "Server error while receiving upload."}), 500
+    if not upload_status:
+        return _not_found()
+    return '', 204, _offset_headers(upload_status)
+
+
+@upload_bp.route('/uploads/<upload_id>/finalize', methods=['POST'])
+def finalize_upload_route(upload_id):
+    try:
+        upload_data = upload_service.finalize_upload(upload_id)
+    except ValueError as e:
+        current_app.logger.warning(f"Upload {upload_id} finalize error: {str(e)}")
+        return jsonify({"error": str(e)}), 400
+    except UnidentifiedImageError as e:
+        current_app.logger.warning(f"Upload {upload_id} UnidentifiedImageError: {str(e)}")
+        return jsonify({"error": str(e)}), 415
+    except Exception as e:
+        current_app.logger.error(f"Upload finalize error for {upload_id}: {e}", exc_info=True)
+        return jsonify({"error": "An unexpected server error occurred during upload."}), 500
+    if not upload_data:
+        return _not_found()
+
+    # Same response as POST /api/upload
+    response_data = {
+        "image_session_id": upload_data["image_session_id"],
+        "filename": upload_data["filename"],
+        "original_extension": upload_data["original_extension"],
+        "initial_dimensions": upload_data["initial_dimensions"],
+        "format": upload_data["format"],
+        "frames": upload_data["frames"],
+        "size_bytes": upload_data["size_bytes"]
+    }
+    response_data.update(image_service.get_history_status(upload_data["image_session_id"]))
+    return jsonify(response_data), 200
+
+
+@upload_bp.route('/uploads/<upload_id>', methods=['DELETE'])
+def abort_upload_route(upload_id):
+    if not upload_service.abort_upload(upload_id):
+        return _not_found()
+    return '', 204
@@ -0,0 +1,168 @@
+import os
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from PIL import Image
+import config # Imports from backend/config.py
+from services import compute_pool
+from utils import file_helpers, cancellation
+
+# --- Animated Images ---
+# Multi-frame GIF, WebP and APNG working files are edited frame by frame: each composited frame
+# goes through the same apply_* function as a still image, on a pool of frame threads (which use
+# the compute worker processes when those are enabled). Frames are decoded only as the window of
+# ANIMATION_FRAME_WINDOW in-flight frames has room, so a long animation never has more than that
+# many decoded source frames and intermediates alive; the edited frames are kept (GIF frames
+# already reduced to their palette) until the file is written with the original timing.
+_executor = None
+_lock = threading.Lock()
+_stats = {"animations": 0, "frames": 0}
+
+ANIMATED_FORMATS = {'GIF', 'WEBP', 'PNG'} # Pillow formats that can write every frame back
+DEFAULT_FRAME_DURATION = 100 # ms, for frames that don't say
+
+
+class AnimatedFrames:
+    """The edited frames of an animation with their durations (ms) and container options."""
+    def __init__(self, frames, durations, format, options):
+        self.frames = frames
+        self.durations = durations
+        self.format = format
+        self.options = options
+
+    @property
+    def size(self):
+        return self.frames[0].size
+
+
+def _get_executor():
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=config.ANIMATION_FRAME_THREADS, thread_name_prefix='frames')
+        return _executor
+
+
+def _count(frames):
+    with _lock:
+        _stats["animations"] += 1
+        _stats["frames"] += frames
+
+
+def is_animated(img):
+    return getattr(img, 'is_animated', False) and img.format in ANIMATED_FORMATS
+
+
+def _container_options(img):
+    # Loop count and canvas background as read from the file; GIF backgrounds are palette
+    # indexes into a palette that won't survive re-quantization, so only WebP's color is kept
+    options = {}
+    if 'loop' in img.info:
+        options['loop'] = img.info['loop']
+    if img.format == 'WEBP' and isinstance(img.info.get('background'), tuple):
+        options['background'] = img.info['background']
+    return options
+
+
+def _frame_mode(img):
+    if img.mode in ('L', 'LA'):
+        return img.mode # Grayscale APNGs stay grayscale
+    has_alpha = img.mode in ('RGBA', 'PA') or 'transparency' in img.info
+    return 'RGBA' if has_alpha else 'RGB'
+
+
+def _frame_duration(img):
+    if img.format == 'WEBP':
+        img.load() # WebP frames carry their timing in the frame data; info is stale until loaded
+    return img.info.get('duration') or DEFAULT_FRAME_DURATION
+
+
+def first_frame(img):
+    """The animated img's first frame, in the mode its frames are edited in."""
+    img.seek(0)
+    return img.convert(_frame_mode(img))
+
+
+def _edit_frame(fn, frame, args, kwargs, deadline_seconds, scoped, palette):
+    # Runs on a frame thread, under the caller's remaining deadline (like a compute worker)
+    if scoped:
+        with cancellation.continued('frame', deadline_seconds):
+            result = compute_pool.run(fn, frame, *args, **kwargs)
+    else:
+        result = compute_pool.run(fn, frame, *args, **kwargs)
+    if palette and result.mode == 'RGB':
+        # What the GIF encoder would do when writing; here it runs in parallel and shrinks what's held
+        result = result.convert('P', palette=Image.Palette.ADAPTIVE)
+    return result
+
+
+def _wait(future):
+    # Keeps checkpointing while the frame is edited, so an abandoned request stops early
+    while True:
+        try:
+            return future.result(timeout=config.DISCONNECT_PROBE_INTERVAL_SECONDS)
+        except FutureTimeout:
+            cancellation.checkpoint()
+
+
+def map_frames(img, fn, *args, **kwargs):
+    """
+    Returns AnimatedFrames with fn(frame, *args, **kwargs) for every frame of the animated img.
+    fn must be a module-level function that doesn't modify its input (see compute_pool.run).
+    Every frame gets the same arguments, so content-dependent choices (a smart crop window,
+    an auto tone curve) must be made once by the caller and passed in.
+    """
+    executor = _get_executor()
+    deadline_seconds = cancellation.remaining_seconds()
+    scoped = cancellation.is_active()
+    palette = img.format == 'GIF'
+    pending = deque()
+    frames = []
+    durations = []
+    img.seek(0)
+    options = _container_options(img)
+    try:
+        for index in range(img.n_frames):
+            cancellation.checkpoint()
+            img.seek(index)
+            durations.append(_frame_duration(img))
+            frame = img.convert(_frame_mode(img)) # A copy: the frame threads never touch the file
+            pending.append(executor.submit(_edit_frame, fn, frame, args, kwargs, deadline_seconds, scoped, palette))
+            while len(pending) >= config.ANIMATION_FRAME_WINDOW:
+                frames.append(_wait(pending.popleft()))
+        while pending:
+            frames.append(_wait(pending.popleft()))
+    except BaseException:
+        for future in pending:
+            future.cancel()
+        raise
+    finally:
+        img.seek(0)
+    _count(len(frames))
+    return AnimatedFrames(frames, durations, img.format, options)
+
+
+def save_options(img):
+    """Pillow save options that write every frame of the animated img with its duration and loop count."""
+    durations = []
+    options = _container_options(img)
+    for index in range(img.n_frames):
+        img.seek(index)
+        durations.append(_frame_duration(img))
+    img.seek(0)
+    return dict(options, save_all=True, duration=durations)
+
+
+def save(animation, filepath):
+    """Atomically writes AnimatedFrames to filepath (format from its extension)."""
+    first, rest = animation.frames[0], animation.frames[1:]
+    options = dict(animation.options, save_all=True, append_images=rest, duration=animation.durations)
+    if os.path.splitext(filepath)[1].lower() == '.gif' and any(frame.mode == 'RGBA' for frame in animation.frames):
+        # Frames are complete pictures: clear each one, or transparent areas show the frame before
+        options['disposal'] = 2
+    file_helpers.atomic_save_image(first, filepath, **options)
+
+
+def get_stats():
+    with _lock:
+        return dict(_stats)
@@ -0,0 +1,259 @@
+import os
+import time
+import uuid
+import zipfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from werkzeug.datastructures import FileStorage
+import config # Imports from backend/config.py
+from services import image_service, operations, encoder, residency
+from utils import file_helpers, session_locks, affinity
+from utils.memory_budget import MemoryLimitExceeded
+
+# --- Batch Processing ---
+# One recipe applied to many images (new uploads and/or existing sessions) on a shared worker pool.
+# Every item becomes a regular session, so results can also be opened and edited individually.
+# { batch_id: { "status", "created", "recipe", "output_format", "items": [...], "events": [...],
+#               "condition": Condition, "archive_path" } }
+_batches = {}
+_lock = threading.Lock()
+_executor = None
+
+
+def _get_executor():
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=config.BATCH_WORKERS, thread_name_prefix='batch')
+        return _executor
+
+
+def _batch_dir(batch_id):
+    return file_helpers.get_shard_dir(config.WORKING_FOLDER, batch_id)
+
+
+def create_batch(file_storages, session_refs, recipe_steps, output_format=None):
+    """
+    Validates the request, stages uploads and queues every item on the worker pool.
+    session_refs: [{"image_session_id": ..., "original_extension": ...}, ...]
+    Returns the initial batch status. Raises ValueError for invalid input.
+    """
+    recipe = operations.parse_recipe(recipe_steps)
+    if output_format:
+        output_format = output_format.lower()
+        if output_format not in encoder.SUPPORTED_OUTPUT_FORMATS:
+            raise ValueError("Unsupported target format.")
+
+    file_storages = [f for f in (file_storages or []) if f and f.filename]
+    session_refs = session_refs or []
+    total = len(file_storages) + len(session_refs)
+    if total == 0:
+        raise ValueError("Batch needs at least one file or session id.")
+    if total > config.BATCH_MAX_ITEMS:
+        raise ValueError(f"Batch cannot have more than {config.BATCH_MAX_ITEMS} items.")
+
+    batch_id = affinity.new_id()
+    items = []
+
+    try:
+        for file_storage in file_storages:
+            if not image_service.allowed_file(file_storage.filename):
+                raise ValueError(f"File type not allowed for '{file_storage.filename}'. Allowed: {', '.join(config.ALLOWED_EXTENSIONS)}")
+            # Request streams are closed once the response is sent, so stage the bytes for the workers
+            staged_path = os.path.join(_batch_dir(batch_id), f"{batch_id}_{len(items)}.upload")
+            os.makedirs(os.path.dirname(staged_path), exist_ok=True)
+            file_storage.save(staged_path)
+            items.append({"index": len(items), "source": "upload", "filename": file_storage.filename, "staged_path": staged_path})
+
+        for ref in session_refs:
+            if not isinstance(ref, dict) or not ref.get('image_session_id') or not ref.get('original_extension'):
+                raise ValueError("Each session entry needs 'image_session_id' and 'original_extension'.")
+            items.append({
+                "index": len(items),
+                "source": "session",
+                "filename": image_service.get_session_filename(ref['image_session_id'], ref['original_extension']),
+                "image_session_id": ref['image_session_id'],
+                "original_extension": ref['original_extension'].lower()
+            })
+    except Exception:
+        # Nothing is queued yet: files staged before the invalid entry would never be picked up
+        for item in items:
+            if item.get("staged_path") and os.path.exists(item["staged_path"]):
+                os.remove(item["staged_path"])
+        raise
+
+    for item in items:
+        item.update({"status": "queued", "error": None, "result": None})
+        item["estimated_seconds"] = _estimate_item(recipe, item)
+
+    batch = {
+        "batch_id": batch_id,
+        "status": "running",
+        "created": time.time(),
+        "recipe": recipe,
+        "output_format": output_format,
+        "items": items,
+        "events": [],
+        "condition": threading.Condition(),
+        "archive_path": None
+    }
+    with _lock:
+        _batches[batch_id] = batch
+
+    executor = _get_executor()
+    # Longest first: a large image started last would keep the batch running on one worker
+    for item in sorted(items, key=lambda i: i["estimated_seconds"], reverse=True):
+        executor.submit(_run_item, batch, item)
+
+    return get_batch_status(batch_id)
+
+
+def _estimate_item(recipe, item):
+    """Expected seconds of the recipe on item (0 if its file can't be read)."""
+    if item["source"] == "upload":
+        filepath, extension = item["staged_path"], os.path.splitext(item["filename"])[1]
+    else:
+        filepath, extension = image_service.get_temp_filepath(item["image_session_id"], item["original_extension"]), None
+    cost = operations.estimate_file('recipe', filepath, {'recipe': recipe}, extension)
+    return cost.wall_seconds if cost else 0.0
+
+
+def _set_item_state(batch, item, **changes):
+    with batch["condition"]:
+        item.update(changes)
+        batch["events"].append(_public_item(item))
+        if all(i["status"] in ("done", "error") for i in batch["items"]):
+            batch["status"] = "done"
+        batch["condition"].notify_all()
+
+
+def _run_item(batch, item):
+    _set_item_state(batch, item, status="running")
+    try:
+        if item["source"] == "upload":
+            # Same validation and session setup as POST /api/upload
+            try:
+                with open(item["staged_path"], 'rb') as staged:
+                    upload_data = image_service.save_uploaded_file(FileStorage(stream=staged, filename=item["filename"]))
+            finally:
+                if os.path.exists(item["staged_path"]):
+                    os.remove(item["staged_path"])
+            item["image_session_id"] = upload_data["image_session_id"]
+            item["original_extension"] = upload_data["original_extension"]
+
+        session_id = item["image_session_id"]
+        with residency.pinned(session_id): # Not demoted between the edit and the conversion
+            filepath = image_service.get_temp_filepath(session_id, item["original_extension"])
+            if not os.path.exists(filepath):
+                raise FileNotFoundError("Image session not found or file does not exist.")
+
+            result = session_locks.run_exclusive(
+                session_id, 'recipe', lambda: operations.run('recipe', filepath, {'recipe': batch["recipe"]}), coalesce=False)
+
+            output_path = filepath
+            if batch["output_format"]:
+                output_path = image_service.convert_format(filepath, batch["output_format"])
+        item["output_path"] = output_path
+        result.update(image_service.get_history_status(session_id))
+        _set_item_state(batch, item, status="done", result=result)
+    except (FileNotFoundError, MemoryLimitExceeded) as e:
+        _set_item_state(batch, item, status="error", error=str(e))
+    except (ValueError, RuntimeError) as e:
+        _set_item_state(batch, item, status="error", error=str(e))
+    except Exception as e:
+        _set_item_state(batch, item, status="error", error=f"Unexpected error: {e}")
+
+
+def _public_item(item):
+    return {
+        "index": item["index"],
+        "source": item["source"],
+        "filename": item["filename"],
+        "status": item["status"],
+        "error": item["error"],
+        "result": item["result"],
+        "image_session_id": item.get("image_session_id"),
+        "original_extension": item.get("original_extension")
+    }
+
+
+def get_batch_status(batch_id):
+    batch = _batches.get(batch_id)
+    if not batch:
+        return None
+    with batch["condition"]:
+        items = [_public_item(item) for item in batch["items"]]
+        counts = {}
+        for item in items:
+            counts[item["status"]] = counts.get(item["status"], 0) + 1
+        return {
+            "batch_id": batch_id,
+            "status": batch["status"],
+            "total": len(items),
+            "counts": counts,
+            "estimated_seconds": round(sum(item["estimated_seconds"] for item in batch["items"]), 2), # Work, not wall time
+            "items": items
+        }
+
+
+def iter_batch_events(batch_id, keepalive_seconds=15):
+    """
+    Yields per-item status updates as they happen and returns once the batch is done.
+    Each update is the item dict; an empty dict is a keepalive.
+    """
+    batch = _batches.get(batch_id)
+    if not batch:
+        return
+    sent = 0
+    while True:
+        with batch["condition"]:
+            if sent >= len(batch["events"]) and batch["status"] != "done":
+                batch["condition"].wait(timeout=keepalive_seconds)
+            pending = batch["events"][sent:]
+            finished = batch["status"] == "done"
+        sent += len(pending)
+        if not pending and not finished:
+            yield {}
+        for event in pending:
+            yield event
+        if finished and sent >= len(batch["events"]):
+            return
+
+
+def build_archive(batch_id):
+    """
+    Writes the batch's results to a zip (once) and returns its path.
+    Returns None if the batch doesn't exist; raises ValueError while it is still running.
+    """
+    batch = _batches.get(batch_id)
+    if not batch:
+        return None
+    with batch["condition"]:
+        if batch["status"] != "done":
+            raise ValueError("Batch is still running.")
+        if batch["archive_path"] and os.path.exists(batch["archive_path"]):
+            return batch["archive_path"]
+
+        archive_path = os.path.join(_batch_dir(batch_id), f"{batch_id}_batch.zip")
+        temp_path = f"{archive_path}.{uuid.uuid4()}.tmp"
+        # Images are already compressed; storing avoids burning CPU on deflate
+        with zipfile.ZipFile(temp_path, 'w', compression=zipfile.ZIP_STORED) as archive:
+            for item in batch["items"]:
+                if item["status"] != "done" or not os.path.exists(item.get("output_path", "")):
+                    continue
+                stem = os.path.splitext(os.path.basename(item["filename"]))[0]
+                ext = os.path.splitext(item["output_path"])[1]
+                archive.write(item["output_path"], arcname=f"{item['index']:03d}_{stem}{ext}")
+        file_helpers.replace_file(temp_path, archive_path)
+        batch["archive_path"] = archive_path
+        return archive_path
+
+
+def prune_batches(max_age_seconds):
+    """Forgets batches older than max_age_seconds. Their files are left to the cleanup job."""
+    cutoff = time.time() - max_age_seconds
+    with _lock:
+        expired = [bid for bid, batch in _batches.items() if batch["created"] < cutoff and batch["status"] == "done"]
+        for batch_id in expired:
+            del _batches[batch_id]
+    return len(expired)
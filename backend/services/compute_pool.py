@@ -0,0 +1,112 @@
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+import config # Imports from backend/config.py
+from utils import pixel_buffers, cancellation
+
+# --- Compute Worker Processes ---
+# With COMPUTE_PROCESSES > 0, image operations run in a pool of worker processes instead of the
+# request thread, so the parts of Pillow that hold the GIL don't serialize the whole server.
+# The source image goes to the worker as a pixel buffer handle and the result comes back as one
+# (see utils/pixel_buffers.py); no pixels are pickled. The caller keeps checkpointing while it waits,
+# and the worker runs under the caller's remaining deadline.
+# Images that can't be shared (palette, animated, buffer limit reached) are processed in the caller's thread.
+_executor = None
+_lock = threading.Lock()
+_stats = {"tasks": 0, "in_thread": 0, "abandoned": 0, "pool_restarts": 0}
+
+
+def is_enabled():
+    return config.COMPUTE_PROCESSES > 0
+
+
+def _get_executor():
+    global _executor
+    with _lock:
+        if _executor is None:
+            # Forking a process that runs request threads could copy their held locks into the children
+            if 'forkserver' in multiprocessing.get_all_start_methods():
+                context = multiprocessing.get_context('forkserver')
+                context.set_forkserver_preload(['services.image_service']) # Imported once, not per worker
+            else:
+                context = multiprocessing.get_context('spawn')
+            _executor = ProcessPoolExecutor(max_workers=config.COMPUTE_PROCESSES, mp_context=context)
+        return _executor
+
+
+def _reset_executor(broken):
+    global _executor
+    with _lock:
+        if _executor is broken:
+            _executor = None
+            _stats["pool_restarts"] += 1
+    broken.shutdown(wait=False)
+
+
+def _count(key):
+    with _lock:
+        _stats[key] += 1
+
+
+def _run_in_worker(fn, handle, args, kwargs, deadline_seconds):
+    # Runs in the worker process
+    with pixel_buffers.attached(handle) as img:
+        with cancellation.continued('compute', deadline_seconds):
+            result = fn(img, *args, **kwargs)
+        # Exported before the source is unmapped: an operation may return its input unchanged
+        return pixel_buffers.export(result), dict(result.info)
+
+
+def _discard_result(future):
+    # The caller gave up; nobody will adopt the result
+    if not future.cancelled() and future.exception() is None:
+        pixel_buffers.discard(future.result()[0])
+
+
+def run(fn, img, *args, **kwargs):
+    """
+    Returns fn(img, *args, **kwargs), computed in a worker process when the pool is enabled.
+    fn must be a module-level function (it is sent to the worker by name) and must not modify img.
+    """
+    if not is_enabled():
+        return fn(img, *args, **kwargs)
+    source = pixel_buffers.share(img)
+    if source is None:
+        _count("in_thread")
+        return fn(img, *args, **kwargs)
+
+    cancellation.checkpoint()
+    executor = _get_executor()
+    try:
+        future = executor.submit(_run_in_worker, fn, pixel_buffers.handle_for(source), args, kwargs,
+                                 cancellation.remaining_seconds())
+        _count("tasks")
+        while True:
+            try:
+                handle, info = future.result(timeout=config.DISCONNECT_PROBE_INTERVAL_SECONDS)
+                break
+            except FutureTimeout:
+                cancellation.checkpoint()
+    except cancellation.OperationCancelled:
+        future.add_done_callback(_discard_result)
+        _count("abandoned")
+        raise
+    except BrokenProcessPool:
+        # A worker died (e.g. killed for memory); start a fresh pool next time and do this one here
+        _reset_executor(executor)
+        _count("in_thread")
+        return fn(img, *args, **kwargs)
+    except pixel_buffers.BufferUnavailable:
+        _count("in_thread")
+        return fn(img, *args, **kwargs)
+
+    result = pixel_buffers.adopt(handle)
+    result.info = info
+    return result
+
+
+def get_stats():
+    with _lock:
+        stats = dict(_stats)
+    return {"processes": config.COMPUTE_PROCESSES, **stats, "buffers": pixel_buffers.get_stats()}
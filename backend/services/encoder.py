@@ -0,0 +1,222 @@
+import io
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image, features
+import config # Imports from backend/config.py
+from services import animation
+from utils import cancellation, pixel_buffers
+
+# --- Output Encoding ---
+# Encoder presets per output format, plus a "target bytes" mode that searches the quality
+# setting to fit a size budget. Candidate qualities are tried concurrently on a downscaled
+# probe first; only a few are then confirmed at full resolution.
+
+SUPPORTED_OUTPUT_FORMATS = ['jpeg', 'jpg', 'png', 'gif', 'bmp']
+if features.check('webp'):
+    SUPPORTED_OUTPUT_FORMATS.append('webp')
+
+# { format: { preset: Pillow save options } }
+ENCODER_PRESETS = {
+    'jpeg': {
+        'default': {},
+        'web': {'quality': 82, 'optimize': True, 'progressive': True},
+        'high': {'quality': 92, 'optimize': True, 'subsampling': 0},
+        'small': {'quality': 60, 'optimize': True, 'progressive': True},
+    },
+    'webp': {
+        'default': {'quality': 80},
+        'web': {'quality': 80, 'method': 6},
+        'high': {'quality': 92, 'method': 6},
+        'small': {'quality': 60, 'method': 6},
+        'lossless': {'lossless': True, 'method': 6},
+    },
+    'png': {
+        'default': {},
+        'optimized': {'optimize': True}, # Slowest zlib level plus filter search
+    },
+    'gif': {
+        'default': {},
+        'optimized': {'optimize': True},
+    },
+    'bmp': {
+        'default': {},
+    },
+}
+LOSSY_FORMATS = {'jpeg', 'webp'} # Formats with a quality setting (needed for target bytes)
+
+QUALITY_MIN = 10
+QUALITY_MAX = 95
+QUALITY_PROBE_STEP = 5 # Probe candidates: 95, 90, ..., 10
+QUALITY_SEARCH_ROUNDS = 4 # Full resolution rounds of up to 3 concurrent encodes each
+PROBE_MAX_PIXELS = 512 * 512
+
+_executor = None
+_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=config.ENCODER_WORKERS, thread_name_prefix='encoder')
+        return _executor
+
+
+def normalize_format(target_format):
+    """Returns the canonical format name ('jpg' -> 'jpeg'). Raises ValueError if unsupported."""
+    target_format = str(target_format).lower()
+    if target_format not in SUPPORTED_OUTPUT_FORMATS:
+        raise ValueError("Unsupported target format.")
+    return 'jpeg' if target_format == 'jpg' else target_format
+
+
+def prepare_for_format(img, target_format):
+    """
+    Returns (img, pillow_format, extension) ready to be saved as target_format.
+    Raises ValueError for unsupported formats.
+    """
+    target_format = normalize_format(target_format)
+
+    # Convert mode if necessary (e.g. RGBA to JPEG requires RGB)
+    if target_format == 'jpeg' and img.mode in ('RGBA', 'P', 'LA'):
+        img = img.convert('RGB')
+    return img, target_format.upper(), target_format
+
+
+def get_save_options(target_format, preset=None, quality=None):
+    """Returns the Pillow save options for a format/preset, with an optional quality override."""
+    target_format = normalize_format(target_format)
+    presets = ENCODER_PRESETS[target_format]
+    if preset and preset not in presets:
+        raise ValueError(f"Unknown preset '{preset}' for {target_format}. Allowed: {', '.join(presets)}")
+    options = dict(presets[preset or 'default'])
+    if quality is not None:
+        if target_format not in LOSSY_FORMATS:
+            raise ValueError(f"'quality' is not supported for {target_format}.")
+        options['quality'] = quality
+        options.pop('lossless', None)
+    return options
+
+
+def own_image(img):
+    """
+    A new Image object over img's pixels, without copying them. Image.save keeps its options on
+    the image object (encoderinfo) and can leave another thread's behind, so every save of an image
+    that other threads may also be saving goes through an object of its own. Read-only, like the
+    pixels it shares. Not for animated images, whose frames are read by seeking the file.
+    """
+    img.load()
+    own = img._new(img.im)
+    own.readonly = 1
+    if pixel_buffers.handle_for(img) is not None:
+        # Compute workers can still map the pixels by name; the original keeps the segment linked
+        own._pixel_buffer = pixel_buffers.handle_for(img)
+        own._shared_source = img
+    return own
+
+
+def _encode(img, pillow_format, options):
+    buffer = io.BytesIO()
+    if pillow_format in animation.ANIMATED_FORMATS and animation.is_animated(img):
+        options = dict(options, **animation.save_options(img)) # Every frame, with its timing
+    img.save(buffer, format=pillow_format, **options)
+    return buffer.getvalue()
+
+
+def encode_image(img, target_format, preset=None, quality=None, target_bytes=None):
+    """
+    Encodes img and returns (data, info).
+    info: {"format", "extension", "quality", "size_bytes"} plus "target_bytes"/"target_met" in target mode.
+    """
+    options = get_save_options(target_format, preset, quality)
+    img, pillow_format, extension = prepare_for_format(img, target_format)
+
+    if target_bytes is None:
+        data = _encode(img, pillow_format, options)
+        return data, {"format": extension, "extension": extension, "quality": options.get('quality'), "size_bytes": len(data)}
+
+    if extension not in LOSSY_FORMATS:
+        raise ValueError(f"Target size is only supported for {', '.join(sorted(LOSSY_FORMATS))}.")
+    if target_bytes <= 0:
+        raise ValueError("Target size must be positive.")
+    options.pop('lossless', None)
+    quality, data = _search_quality(img, pillow_format, options, target_bytes)
+    return data, {
+        "format": extension,
+        "extension": extension,
+        "quality": quality,
+        "size_bytes": len(data),
+        "target_bytes": target_bytes,
+        "target_met": len(data) <= target_bytes
+    }
+
+
+def _clamp_quality(quality):
+    return max(QUALITY_MIN, min(QUALITY_MAX, quality))
+
+
+def _spread(low, high, step, count=3):
+    # Up to count evenly spaced qualities in [low, high]
+    options = list(range(low, high + 1, step))
+    if len(options) <= count:
+        return options
+    return [options[(i + 1) * len(options) // (count + 1)] for i in range(count)]
+
+
+def _encode_qualities(executor, img, pillow_format, options, qualities, result=lambda data: data):
+    """[result(img encoded at quality) for quality in qualities], concurrently where possible."""
+    if animation.is_animated(img):
+        # All frames come from seeking the one image, so these can't overlap
+        return [result(_encode(img, pillow_format, {**options, 'quality': q})) for q in qualities]
+    images = [own_image(img) for _ in qualities] # Here, so img is loaded once, by this thread
+    return list(executor.map(
+        lambda own, q: result(_encode(own, pillow_format, {**options, 'quality': q})), images, qualities))
+
+
+def _search_quality(img, pillow_format, options, target_bytes):
+    """Returns (quality, data) for the highest quality that fits target_bytes (or the smallest output)."""
+    executor = _get_executor()
+
+    # 1. Probe: every candidate on a downscaled copy, concurrently
+    full_pixels = img.width * img.height
+    scale = min(1.0, (PROBE_MAX_PIXELS / full_pixels) ** 0.5)
+    probe = img
+    if scale < 1.0:
+        probe = img.resize((max(1, round(img.width * scale)), max(1, round(img.height * scale))), Image.Resampling.BILINEAR)
+    pixel_ratio = full_pixels / (probe.width * probe.height)
+
+    candidates = list(range(QUALITY_MAX, QUALITY_MIN - 1, -QUALITY_PROBE_STEP))
+    probe_sizes = _encode_qualities(executor, probe, pillow_format, options, candidates, len)
+
+    # Highest candidate whose predicted full resolution size fits
+    estimate = QUALITY_MIN
+    for quality, size in zip(candidates, probe_sizes):
+        if size * pixel_ratio <= target_bytes:
+            estimate = quality
+            break
+
+    # 2. Confirm at full resolution. Bytes don't scale exactly with pixel count, so each round
+    # narrows the bracket between the best fitting and the smallest too-big quality
+    step = QUALITY_PROBE_STEP
+    tried = {}
+    window = [estimate + step, estimate, estimate - step]
+    for _ in range(QUALITY_SEARCH_ROUNDS):
+        cancellation.checkpoint() # Between rounds of full resolution encodes
+        qualities = sorted({_clamp_quality(q) for q in window} - set(tried))
+        if not qualities:
+            break
+        encoded = _encode_qualities(executor, img, pillow_format, options, qualities)
+        tried.update(zip(qualities, encoded))
+
+        fitting = [q for q in tried if len(tried[q]) <= target_bytes]
+        low = max(fitting) + step if fitting else QUALITY_MIN
+        too_big = [q for q in tried if q >= low and len(tried[q]) > target_bytes]
+        high = min(too_big) - step if too_big else QUALITY_MAX
+        window = _spread(low, high, step)
+
+    fitting = [q for q in tried if len(tried[q]) <= target_bytes]
+    if fitting:
+        best = max(fitting)
+    else:
+        best = min(tried, key=lambda q: len(tried[q]))
+    return best, tried[best]
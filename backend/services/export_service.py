@@ -0,0 +1,157 @@
+import os
+import threading
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image
+import config # Imports from backend/config.py
+from services import residency, encoder
+
+# --- Multi-Format Export ---
+# Encodes several variants of a session image (format / size / quality) concurrently and
+# streams them to the client as a zip. Pillow's encoders release the GIL, so threads scale
+# across cores. Only the finished variants are held in memory, never the whole archive.
+# Variants can use encoder presets and a target size (see services/encoder.py).
+_executor = None
+_lock = threading.Lock()
+
+MAX_EXPORT_VARIANTS = 8
+
+
+def _get_executor():
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=config.EXPORT_WORKERS, thread_name_prefix='export')
+        return _executor
+
+
+def _optional_int(spec, key, index):
+    if spec.get(key) is None:
+        return None
+    try:
+        return int(spec[key])
+    except (TypeError, ValueError):
+        raise ValueError(f"Export {index}: '{key}' must be an integer.")
+
+
+def parse_export_specs(specs):
+    """
+    Validates export variants, e.g.
+    [{"format": "webp", "preset": "web", "max_dimension": 1200, "target_bytes": 150000, "name": "web"}].
+    "quality" overrides the preset's quality; "target_bytes" searches for the best quality that fits.
+    Returns a list of normalized spec dicts. Raises ValueError for invalid input.
+    """
+    if not isinstance(specs, list) or not specs:
+        raise ValueError("'exports' must be a non-empty list.")
+    if len(specs) > MAX_EXPORT_VARIANTS:
+        raise ValueError(f"Cannot export more than {MAX_EXPORT_VARIANTS} variants at once.")
+
+    parsed = []
+    used_names = set()
+    for i, spec in enumerate(specs, start=1):
+        if not isinstance(spec, dict) or not spec.get('format'):
+            raise ValueError(f"Export {i}: 'format' is required.")
+        target_format = str(spec['format']).lower()
+        if target_format not in encoder.SUPPORTED_OUTPUT_FORMATS:
+            raise ValueError(f"Export {i}: unsupported format. Allowed: {', '.join(encoder.SUPPORTED_OUTPUT_FORMATS)}")
+        extension = encoder.normalize_format(target_format)
+
+        quality = _optional_int(spec, 'quality', i)
+        if quality is not None and not 1 <= quality <= 95:
+            raise ValueError(f"Export {i}: 'quality' must be between 1 and 95.")
+        max_dimension = _optional_int(spec, 'max_dimension', i)
+        if max_dimension is not None and max_dimension <= 0:
+            raise ValueError(f"Export {i}: 'max_dimension' must be positive.")
+        target_bytes = _optional_int(spec, 'target_bytes', i)
+        if target_bytes is not None:
+            if target_bytes <= 0:
+                raise ValueError(f"Export {i}: 'target_bytes' must be positive.")
+            if extension not in encoder.LOSSY_FORMATS:
+                raise ValueError(f"Export {i}: 'target_bytes' is only supported for {', '.join(sorted(encoder.LOSSY_FORMATS))}.")
+        preset = spec.get('preset')
+        try:
+            encoder.get_save_options(extension, preset, quality)
+        except ValueError as e:
+            raise ValueError(f"Export {i}: {e}")
+
+        default_name = f"image_{max_dimension}px" if max_dimension else "image"
+        name = os.path.splitext(os.path.basename(str(spec.get('name') or default_name)))[0] or default_name
+        if name.startswith('.'):
+            name = default_name
+        # Same base name and format would collide inside the zip
+        if (name, extension) in used_names:
+            name = f"{name}_{i}"
+        used_names.add((name, extension))
+
+        parsed.append({
+            "format": extension,
+            "preset": preset,
+            "quality": quality,
+            "target_bytes": target_bytes,
+            "max_dimension": max_dimension,
+            "name": name
+        })
+    return parsed
+
+
+def encode_variant(img, spec):
+    """Encodes one export variant of img and returns (archive name, bytes)."""
+    if spec["max_dimension"] and max(img.size) > spec["max_dimension"]:
+        img = img.copy()
+        img.thumbnail((spec["max_dimension"], spec["max_dimension"]), Image.Resampling.LANCZOS)
+    data, info = encoder.encode_image(
+        img, spec["format"], preset=spec["preset"], quality=spec["quality"], target_bytes=spec["target_bytes"])
+    return f"{spec['name']}.{info['extension']}", data
+
+
+class _ChunkWriter:
+    # Write-only sink for ZipFile; without tell()/seek(), zipfile writes streaming-friendly data descriptors
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def stream_export(filepath, specs):
+    """
+    Starts encoding every variant and returns a generator of zip bytes.
+    The image is decoded before returning, so FileNotFoundError/ValueError surface to the caller.
+    """
+    if not os.path.exists(filepath):
+        raise FileNotFoundError("Image file not found.")
+
+    with residency.open_image(filepath) as img:
+        # Animated images are closed on leaving the block; their current frame is exported
+        source = img if not getattr(img, 'is_animated', False) else img.copy()
+    executor = _get_executor()
+    # Image.save keeps its options on the image object, so every variant encodes one of its own
+    futures = [executor.submit(encode_variant, encoder.own_image(source), spec) for spec in specs]
+
+    def generate():
+        writer = _ChunkWriter()
+        errors = []
+        with zipfile.ZipFile(writer, 'w', compression=zipfile.ZIP_STORED) as archive:
+            # Write in request order so the archive layout is deterministic
+            for spec, future in zip(specs, futures):
+                try:
+                    name, data = future.result()
+                except Exception as e:
+                    errors.append(f"{spec['name']}.{spec['format']}: {e}")
+                    continue
+                archive.writestr(name, data)
+                yield writer.drain()
+            if errors:
+                archive.writestr("errors.txt", "\n".join(errors) + "\n")
+        yield writer.drain()
+
+    return generate()
@@ -1,30 +1,37 @@
 import os
-import uuid
-import shutil
-import time
 import io
+import uuid
+import hashlib
+import threading
 from PIL import Image, UnidentifiedImageError, ImageOps, ImageEnhance, ImageFilter
 from werkzeug.utils import secure_filename
 import config # Imports from backend/config.py
+from services import residency, version_store, encoder, session_journal, compute_pool, image_stats, animation, speculation
+from utils import file_helpers, memory_budget, cancellation, affinity
 
 # --- History Management ---
-# { session_id: { "history": [file_v0, file_v1], "current_index": 0 } }
+# { session_id: { "history": [blob_v0, blob_v1], "current_index": 0 } }
+# History entries are content-addressed blobs from version_store, shared across sessions.
+# Every change is also written to the session journal, which restore_sessions() reads at startup.
 session_history = {}
 MAX_HISTORY_STEPS = 3
 
-def _init_history(session_id, filepath):
-    """Initializes history with the uploaded file."""
-    directory, filename = os.path.split(filepath)
-    name, ext = os.path.splitext(filename)
-    version_filename = f"{name}_v0{ext}"
-    version_filepath = os.path.join(directory, version_filename)
-    
-    shutil.copy2(filepath, version_filepath)
-    
+def _init_history(session_id, filepath, digest=None):
+    """Initializes history with the uploaded file. digest: its SHA-256, if already known."""
     session_history[session_id] = {
-        "history": [version_filepath],
+        "history": [version_store.store_version(filepath, digest=digest)],
         "current_index": 0
     }
+    _journal(session_id, filepath)
+    _speculate(session_id, filepath)
+
+def _journal(session_id, filepath):
+    session_data = session_history[session_id]
+    session_journal.record_session(session_id, filepath, session_data["history"], session_data["current_index"])
+
+def _speculate(session_id, filepath):
+    # Precomputes the likely downloads of the new current version in the background
+    speculation.schedule(session_id, filepath, _current_version(session_id))
 
 def _add_to_history(session_id, filepath):
     """
@@ -46,39 +53,126 @@ def _add_to_history(session_id, filepath):
     history = session_data["history"]
     current_index = session_data["current_index"]
 
+    # Create new version first, so a redo entry with the same content is reused rather than rewritten
+    version_blob = version_store.store_version(filepath)
+
     # Truncate redo history
     if current_index < len(history) - 1:
         for i in range(current_index + 1, len(history)):
-            try:
-                if os.path.exists(history[i]):
-                    os.remove(history[i])
-            except OSError:
-                pass
+            version_store.release_version(history[i])
         history = history[:current_index + 1]
 
-    # Create new version
-    directory, filename = os.path.split(filepath)
-    name, ext = os.path.splitext(filename)
-    timestamp = int(time.time() * 1000)
-    version_filename = f"{name}_v{timestamp}{ext}"
-    version_filepath = os.path.join(directory, version_filename)
-    
-    shutil.copy2(filepath, version_filepath)
-    history.append(version_filepath)
+    history.append(version_blob)
     current_index += 1
     
     # Limit history size
     if len(history) > MAX_HISTORY_STEPS + 1:
-        oldest_file = history.pop(0)
-        try:
-            if os.path.exists(oldest_file):
-                os.remove(oldest_file)
-        except OSError:
-            pass
+        version_store.release_version(history.pop(0))
         current_index -= 1
     
     session_data["history"] = history
     session_data["current_index"] = current_index
+    _journal(session_id, filepath)
+    _speculate(session_id, filepath)
+
+def expire_session(session_id):
+    """Drops the session's history and releases its version blobs."""
+    session_data = session_history.pop(session_id, None)
+    session_journal.forget_session(session_id)
+    speculation.forget(session_id)
+    if not session_data:
+        return
+    for version_blob in session_data["history"]:
+        version_store.release_version(version_blob)
+
+def restore_sessions():
+    """
+    Rebuilds session_history from the session journal after a restart, taking the version
+    references it implies and re-registering the working files with the residency tiers.
+    Sessions whose working file is gone are dropped. Returns (restored, dropped).
+    """
+    restored = dropped = 0
+    for session_id, filepath, history, current_index, last_access in session_journal.load_sessions():
+        with _restore_lock:
+            if session_id in session_history:
+                continue
+            if _restore_session(session_id, filepath, history, current_index, last_access):
+                restored += 1
+            else:
+                dropped += 1
+    session_journal.count_restore(restored, dropped)
+    return restored, dropped
+
+_restore_lock = threading.Lock()
+
+def _restore_session(session_id, filepath, history, current_index, last_access):
+    # Caller holds _restore_lock. Returns False if the session's working file is gone.
+    if not residency.restore_session(session_id, filepath, last_access):
+        session_journal.forget_session(session_id)
+        return False
+
+    # Versions deleted while we were down are skipped; the index follows the current version
+    kept = [i for i, blob_path in enumerate(history) if os.path.exists(blob_path)]
+    if not kept:
+        # Still editable; history restarts with the next edit
+        session_journal.forget_session(session_id)
+        return True
+    for i in kept:
+        version_store.adopt_version(history[i])
+    session_history[session_id] = {
+        "history": [history[i] for i in kept],
+        "current_index": max(0, len([i for i in kept if i <= current_index]) - 1)
+    }
+    if len(kept) != len(history):
+        _journal(session_id, filepath)
+    return True
+
+def prune_journal():
+    """
+    Forgets journaled sessions this process owns but hasn't loaded whose working file is gone
+    from both tiers. Behind the cluster router sessions are only restored on first use, so a
+    session that is never asked for again would otherwise keep its row, and its version blobs
+    (see version_store.collect_garbage), forever. Returns the number forgotten.
+    """
+    forgotten = 0
+    for session_id, filepath, _, _, _ in session_journal.load_sessions():
+        if session_id in session_history or not affinity.owns(session_id):
+            continue
+        with _restore_lock: # A session being loaded right now is in session_history before it's promoted
+            if session_id in session_history:
+                continue
+            if os.path.exists(filepath) or os.path.exists(residency.get_cold_filepath(session_id, filepath)):
+                continue
+            session_journal.forget_session(session_id)
+            forgotten += 1
+    return forgotten
+
+def load_journaled_session(session_id):
+    """
+    Takes over a session another backend process owned before the ring changed (see cluster.py),
+    from the session journal. Does nothing for sessions already here or not journaled.
+    """
+    if session_id in session_history:
+        return
+    journaled = session_journal.load_session(session_id)
+    if not journaled:
+        return
+    with _restore_lock:
+        if session_id not in session_history:
+            _restore_session(session_id, *journaled)
+
+def release_session(session_id):
+    """
+    Hands a session over to another backend process: drops its history, version references and
+    residency state here, leaving its files and journal row for the new owner to load.
+    Call under the session's lock so no operation on it is still running.
+    """
+    session_data = session_history.pop(session_id, None)
+    if session_data:
+        for version_blob in session_data["history"]:
+            version_store.release_version(version_blob)
+    residency.forget(session_id)
+    speculation.forget(session_id)
 
 def undo_image(session_id, original_extension):
     if session_id not in session_history:
@@ -90,7 +184,9 @@ def undo_image(session_id, original_extension):
         version_filepath = session_data["history"][session_data["current_index"]]
         
         current_filepath = get_temp_filepath(session_id, original_extension)
-        shutil.copy2(version_filepath, current_filepath)
+        version_store.restore_version(version_filepath, current_filepath)
+        _journal(session_id, current_filepath)
+        _speculate(session_id, current_filepath)
         
         return get_image_metadata(current_filepath), None
     else:
@@ -106,12 +202,19 @@ def redo_image(session_id, original_extension):
         version_filepath = session_data["history"][session_data["current_index"]]
         
         current_filepath = get_temp_filepath(session_id, original_extension)
-        shutil.copy2(version_filepath, current_filepath)
+        version_store.restore_version(version_filepath, current_filepath)
+        _journal(session_id, current_filepath)
+        _speculate(session_id, current_filepath)
         
         return get_image_metadata(current_filepath), None
     else:
         return None, "Cannot redo further."
 
+def _current_version(session_id):
+    # The version blob the working file currently holds (call under the session's lock)
+    session_data = session_history.get(session_id)
+    return session_data["history"][session_data["current_index"]] if session_data else None
+
 def get_history_status(session_id):
     if session_id not in session_history:
         return {"can_undo": False, "can_redo": False}
@@ -134,6 +237,7 @@ def get_image_metadata(image_path):
                 "width": img.width,
                 "height": img.height,
                 "format": img.format,
+                "frames": getattr(img, 'n_frames', 1),
                 "size_bytes": os.path.getsize(image_path)
             }
     except FileNotFoundError:
@@ -152,7 +256,13 @@ def get_session_filename(session_id, original_extension):
 
 def get_temp_filepath(session_id, original_extension):
     filename = get_session_filename(session_id, original_extension)
-    return os.path.join(config.TEMP_FOLDER, filename)
+    filepath = os.path.join(file_helpers.get_shard_dir(config.WORKING_FOLDER, session_id), filename)
+    # Behind the cluster router, sessions handed over from another process are loaded on first use
+    if affinity.get_node_id() and session_id not in session_history:
+        load_journaled_session(session_id)
+    # Idle sessions may have been demoted to the cold tier; accessing them brings them back
+    residency.ensure_hot(session_id, filepath)
+    return filepath
 
 # --- Core Service Functions ---
 def save_uploaded_file(file_storage):
@@ -175,27 +285,69 @@ def save_uploaded_file(file_storage):
 
     original_filename = secure_filename(file_storage.filename)
     original_extension = original_filename.rsplit('.', 1)[1].lower()
-    session_id = str(uuid.uuid4())
+    session_id = affinity.new_id()
     
-    session_filename_on_disk = get_session_filename(session_id, original_extension)
-    filepath = os.path.join(config.TEMP_FOLDER, session_filename_on_disk)
+    filepath = get_temp_filepath(session_id, original_extension)
     
     try:
-        file_storage.save(filepath)
-        # Verify it's a real image with Pillow
-        with Image.open(filepath) as img:
-            img.verify() # Verifies header, may not detect all corruption
-            # To be more thorough, attempt to load:
-            img_loaded = Image.open(filepath)
-            img_loaded.load() # Fully loads image data
-        
-        metadata = get_image_metadata(filepath)
-        if not metadata: # Should ideally not happen if verify/load passed
-            if os.path.exists(filepath): os.remove(filepath)
-            raise UnidentifiedImageError("Could not process image metadata after save.")
+        # The upload is already spooled by Werkzeug; hashing it tells us whether we've seen these bytes
+        digest = _hash_stream(file_storage.stream)
+        ingested = version_store.lookup_ingest(digest)
+        if ingested:
+            file_helpers.atomic_link(ingested["blob_path"], filepath) # Repeat upload: no new copy
+        else:
+            os.makedirs(os.path.dirname(filepath), exist_ok=True)
+            file_storage.save(filepath)
+    except Exception as e:
+        if os.path.exists(filepath): os.remove(filepath)
+        raise ValueError(f"An unexpected error occurred processing '{original_filename}'.")
+    return _register_upload(session_id, filepath, original_filename, original_extension, digest, ingested)
+
+
+def _hash_stream(stream):
+    digest = hashlib.sha256()
+    for chunk in iter(lambda: stream.read(version_store.HASH_CHUNK_SIZE), b''):
+        digest.update(chunk)
+    stream.seek(0)
+    return digest.hexdigest()
+
+
+def register_uploaded_file(session_id, filepath, original_filename, original_extension, digest=None):
+    """
+    Validates an uploaded file already at the session's filepath and starts its history.
+    Used by single-request and resumable uploads. The file is removed if it isn't a valid image.
+    digest: SHA-256 of the file if known; previously verified content is then not checked again.
+    """
+    ingested = version_store.lookup_ingest(digest) if digest else None
+    return _register_upload(session_id, filepath, original_filename, original_extension, digest, ingested)
 
-        # Initialize history
-        _init_history(session_id, filepath)
+
+def _register_upload(session_id, filepath, original_filename, original_extension, digest, ingested):
+    try:
+        if ingested:
+            # Same bytes as an upload verified before: reuse its metadata and, if still in memory, its pixels
+            img_loaded = ingested["image"]
+            metadata = dict(ingested["metadata"], size_bytes=os.path.getsize(filepath))
+        else:
+            # Verify it's a real image with Pillow
+            with Image.open(filepath) as img:
+                img.verify() # Verifies header, may not detect all corruption
+                # To be more thorough, attempt to load:
+                img_loaded = Image.open(filepath)
+                img_loaded.load() # Fully loads image data
+
+            metadata = get_image_metadata(filepath)
+            if not metadata: # Should ideally not happen if verify/load passed
+                if os.path.exists(filepath): os.remove(filepath)
+                raise UnidentifiedImageError("Could not process image metadata after save.")
+
+        # Initialize history; the session gets its own history even when the blob is shared
+        _init_history(session_id, filepath, digest=digest)
+        residency.ensure_hot(session_id, filepath) # Tracked from now on (the path was looked up before the file existed)
+        if digest:
+            version_store.remember_ingest(digest, session_history[session_id]["history"][0], metadata, img_loaded)
+        if img_loaded is not None:
+            residency.cache_image(img_loaded, filepath) # The first edit starts from decoded pixels
 
         return {
             "image_session_id": session_id,
@@ -203,6 +355,7 @@ def save_uploaded_file(file_storage):
             "original_extension": original_extension,
             "initial_dimensions": {"width": metadata["width"], "height": metadata["height"]},
             "format": metadata["format"],
+            "frames": metadata.get("frames", 1),
             "size_bytes": metadata["size_bytes"],
             "filepath_on_server": filepath # For internal use, not sent to client
         }
@@ -216,6 +369,134 @@ def save_uploaded_file(file_storage):
         raise ValueError(f"An unexpected error occurred processing '{original_filename}'.")
 
 
+# --- Cancellable Processing ---
+# Inside a request's cancellation scope, the long whole-image passes (LANCZOS resize, blur,
+# sharpen, enhancers) run in horizontal bands with a checkpoint between bands, so an abandoned
+# request stops within one band instead of finishing the pass. Bands are extended by the
+# filter's reach, so the stitched result matches a single pass.
+# The process_* functions check once more right before saving: past that point the edit is
+# committed to the working file and history, before it nothing about the session has changed.
+# Outside a scope (batch, CLI, previews) images are processed in one pass as before.
+_BANDED_MODES = {'L', 'RGB', 'RGBA'}
+
+def _use_bands(img):
+    return (cancellation.is_active() and img.mode in _BANDED_MODES
+            and img.height > 2 * config.CANCELLATION_BAND_ROWS)
+
+
+def _map_bands(img, fn, overlap=0):
+    """Returns fn applied to img band by band; overlap is the number of rows fn reads beyond a pixel."""
+    if not _use_bands(img):
+        cancellation.checkpoint()
+        return fn(img)
+
+    result = Image.new(img.mode, img.size)
+    for top in range(0, img.height, config.CANCELLATION_BAND_ROWS):
+        cancellation.checkpoint()
+        bottom = min(img.height, top + config.CANCELLATION_BAND_ROWS)
+        source_top, source_bottom = max(0, top - overlap), min(img.height, bottom + overlap)
+        band = fn(img.crop((0, source_top, img.width, source_bottom)))
+        result.paste(band.crop((0, top - source_top, img.width, bottom - source_top)), (0, top))
+    return result
+
+
+_WIDE_GRAY_MODES = {'I', 'I;16', 'I;16B', 'I;16L', 'I;16N'} # 16-bit PNGs
+
+def _editable(img):
+    """
+    img in a mode every apply_* function takes (L, LA, RGB or RGBA): ImageEnhance and ImageFilter
+    reject palette (GIF) and 1-bit images. 16-bit grayscale is scaled down to L rather than clipped.
+    """
+    if img.mode in _WIDE_GRAY_MODES:
+        return img.convert('I').point(lambda value: value * (1 / 256)).convert('L')
+    return image_stats.tonal_image(img)
+
+def _apply(fn, img, *args, **kwargs):
+    """fn(img, *args, **kwargs) in the compute pool; for an animation, on every frame (AnimatedFrames)."""
+    if animation.is_animated(img):
+        return animation.map_frames(img, fn, *args, **kwargs)
+    return compute_pool.run(fn, _editable(img), *args, **kwargs)
+
+
+def _resize_lanczos(img, size):
+    """LANCZOS resize; banded by output rows inside a cancellation scope."""
+    if not _use_bands(img):
+        cancellation.checkpoint()
+        return img.resize(size, Image.Resampling.LANCZOS)
+
+    new_width, new_height = size
+    scale = img.height / new_height
+    result = Image.new(img.mode, size)
+    # Each band resamples its own source box; Pillow reads the filter support around it.
+    # Rounding can differ from a single pass by one level in a few pixels along band edges
+    band_rows = max(1, int(config.CANCELLATION_BAND_ROWS / scale))
+    for top in range(0, new_height, band_rows):
+        cancellation.checkpoint()
+        bottom = min(new_height, top + band_rows)
+        band = img.resize((new_width, bottom - top), Image.Resampling.LANCZOS,
+                          box=(0, top * scale, img.width, bottom * scale))
+        result.paste(band, (0, top))
+    return result
+
+
+def apply_resize(img, width_px=None, height_px=None, percentage=None, maintain_aspect_ratio=True):
+    """
+    Returns a resized copy of img.
+    Raises ValueError for missing/invalid parameters.
+    """
+    original_width, original_height = img.size
+    new_width, new_height = original_width, original_height
+
+    if percentage:
+        if not (0 < float(percentage) <= 1000): # Allow up to 10x, min > 0
+            raise ValueError("Percentage must be between 1 and 1000.")
+        scale_factor = float(percentage) / 100.0
+        new_width = int(original_width * scale_factor)
+        new_height = int(original_height * scale_factor)
+    elif width_px or height_px:
+        target_w = int(width_px) if width_px else None
+        target_h = int(height_px) if height_px else None
+
+        if not target_w and not target_h:
+             raise ValueError("Either width, height, or percentage must be provided for resize.")
+
+        if maintain_aspect_ratio:
+            aspect_ratio = original_width / original_height
+            if target_w and not target_h:
+                new_width = target_w
+                new_height = int(target_w / aspect_ratio)
+            elif target_h and not target_w:
+                new_height = target_h
+                new_width = int(target_h * aspect_ratio)
+            elif target_w and target_h:
+                # Scale to fit within bounds while preserving ratio
+                # This effectively means using the more restrictive dimension
+                img_aspect_ratio = original_width / original_height
+                target_aspect_ratio = target_w / target_h
+                if img_aspect_ratio > target_aspect_ratio: # Image is wider than target box
+                    new_width = target_w
+                    new_height = int(target_w / img_aspect_ratio)
+                else: # Image is taller or same aspect as target box
+                    new_height = target_h
+                    new_width = int(target_h * img_aspect_ratio)
+            else: # No dimensions given (should be caught by earlier check)
+                pass
+        else: # Not maintaining aspect ratio
+            if target_w: new_width = target_w
+            if target_h: new_height = target_h
+    else:
+        raise ValueError("No valid resize parameters provided (width, height, or percentage).")
+
+    new_width = max(1, new_width if new_width is not None else original_width)
+    new_height = max(1, new_height if new_height is not None else original_height)
+
+    # Use ImageOps.contain if you want to ensure it fits AND pads if necessary
+    # For simple resize:
+    resized_img = _resize_lanczos(img, (new_width, new_height))
+    return resized_img
+
+
+@memory_budget.tracked('resize')
 def process_resize(filepath, width_px=None, height_px=None, percentage=None, maintain_aspect_ratio=True):
     """
     Resizes the image at the given filepath.
@@ -225,57 +506,10 @@ def process_resize(filepath, width_px=None, height_px=None, percentage=None, mai
         raise FileNotFoundError("Image file not found for processing.")
 
     try:
-        with Image.open(filepath) as img:
-            original_width, original_height = img.size
-            new_width, new_height = original_width, original_height
-
-            if percentage:
-                if not (0 < float(percentage) <= 1000): # Allow up to 10x, min > 0
-                    raise ValueError("Percentage must be between 1 and 1000.")
-                scale_factor = float(percentage) / 100.0
-                new_width = int(original_width * scale_factor)
-                new_height = int(original_height * scale_factor)
-            elif width_px or height_px:
-                target_w = int(width_px) if width_px else None
-                target_h = int(height_px) if height_px else None
-
-                if not target_w and not target_h:
-                     raise ValueError("Either width, height, or percentage must be provided for resize.")
-
-                if maintain_aspect_ratio:
-                    aspect_ratio = original_width / original_height
-                    if target_w and not target_h:
-                        new_width = target_w
-                        new_height = int(target_w / aspect_ratio)
-                    elif target_h and not target_w:
-                        new_height = target_h
-                        new_width = int(target_h * aspect_ratio)
-                    elif target_w and target_h:
-                        # Scale to fit within bounds while preserving ratio
-                        # This effectively means using the more restrictive dimension
-                        img_aspect_ratio = original_width / original_height
-                        target_aspect_ratio = target_w / target_h
-                        if img_aspect_ratio > target_aspect_ratio: # Image is wider than target box
-                            new_width = target_w
-                            new_height = int(target_w / img_aspect_ratio)
-                        else: # Image is taller or same aspect as target box
-                            new_height = target_h
-                            new_width = int(target_h * img_aspect_ratio)
-                    else: # No dimensions given (should be caught by earlier check)
-                        pass
-                else: # Not maintaining aspect ratio
-                    if target_w: new_width = target_w
-                    if target_h: new_height = target_h
-            else:
-                raise ValueError("No valid resize parameters provided (width, height, or percentage).")
-            
-            new_width = max(1, new_width if new_width is not None else original_width)
-            new_height = max(1, new_height if new_height is not None else original_height)
-            
-            # Use ImageOps.contain if you want to ensure it fits AND pads if necessary
-            # For simple resize:
-            resized_img = img.resize((new_width, new_height), Image.Resampling.LANCZOS)
-            resized_img.save(filepath) # Overwrite the temp file
+        with residency.open_image(filepath) as img:
+            resized_img = _apply(apply_resize, img, width_px, height_px, percentage, maintain_aspect_ratio)
+            cancellation.checkpoint()
+            residency.save_image(resized_img, filepath) # Overwrite the temp file
 
         updated_metadata = get_image_metadata(filepath)
         if not updated_metadata:
@@ -300,6 +534,19 @@ def process_resize(filepath, width_px=None, height_px=None, percentage=None, mai
         raise RuntimeError(f"An unexpected error occurred during resize: {e}")
 
 
+def apply_rotate(img, angle):
+    """Returns a rotated copy of img. Angle is user-facing (90 CW, -90 CCW, 180)."""
+    if angle not in [90, -90, 180]:
+        raise ValueError("Invalid rotation angle. Must be 90, -90, or 180.")
+    pil_angle = angle
+    if angle == 90: pil_angle = -90    # PIL rotates counter-clockwise
+    elif angle == -90: pil_angle = 90
+
+    rotated_img = img.rotate(pil_angle, expand=True, resample=Image.Resampling.BICUBIC)
+    return rotated_img
+
+
+@memory_budget.tracked('rotate')
 def process_rotate(filepath, angle):
     """
     Rotates the image at the given filepath. Angle is user-facing (90 CW, -90 CCW, 180).
@@ -312,13 +559,10 @@ def process_rotate(filepath, angle):
         raise ValueError("Invalid rotation angle. Must be 90, -90, or 180.")
 
     try:
-        with Image.open(filepath) as img:
-            pil_angle = angle
-            if angle == 90: pil_angle = -90    # PIL rotates counter-clockwise
-            elif angle == -90: pil_angle = 90
-            
-            rotated_img = img.rotate(pil_angle, expand=True, resample=Image.Resampling.BICUBIC)
-            rotated_img.save(filepath)
+        with residency.open_image(filepath) as img:
+            rotated_img = _apply(apply_rotate, img, angle)
+            cancellation.checkpoint()
+            residency.save_image(rotated_img, filepath)
 
         updated_metadata = get_image_metadata(filepath)
         if not updated_metadata:
@@ -341,6 +585,18 @@ def process_rotate(filepath, angle):
         raise RuntimeError(f"An unexpected error occurred during rotation: {e}")
 
 
+def apply_flip(img, axis):
+    """Returns a flipped copy of img. axis: 'horizontal' or 'vertical'"""
+    if axis not in ['horizontal', 'vertical']:
+        raise ValueError("Invalid flip axis. Must be 'horizontal' or 'vertical'.")
+    if axis == 'horizontal':
+        flipped_img = img.transpose(Image.FLIP_LEFT_RIGHT)
+    else:
+        flipped_img = img.transpose(Image.FLIP_TOP_BOTTOM)
+    return flipped_img
+
+
+@memory_budget.tracked('flip')
 def process_flip(filepath, axis):
     """
     Flips the image at the given filepath.
@@ -353,13 +609,10 @@ def process_flip(filepath, axis):
         raise ValueError("Invalid flip axis. Must be 'horizontal' or 'vertical'.")
 
     try:
-        with Image.open(filepath) as img:
-            if axis == 'horizontal':
-                flipped_img = img.transpose(Image.FLIP_LEFT_RIGHT)
-            else:
-                flipped_img = img.transpose(Image.FLIP_TOP_BOTTOM)
-            
-            flipped_img.save(filepath)
+        with residency.open_image(filepath) as img:
+            flipped_img = _apply(apply_flip, img, axis)
+            cancellation.checkpoint()
+            residency.save_image(flipped_img, filepath)
 
         updated_metadata = get_image_metadata(filepath)
         if not updated_metadata:
@@ -381,6 +634,23 @@ def process_flip(filepath, axis):
         raise RuntimeError(f"An unexpected error occurred during flip: {e}")
 
 
+def apply_grayscale(img, intensity=100):
+    """
+    Returns a (partially) desaturated copy of img.
+    intensity: 0 to 100 (0 = original color, 100 = full grayscale)
+    """
+    # Map intensity (0-100) to saturation factor (1.0 to 0.0)
+    # 0 intensity -> 1.0 saturation (original)
+    # 100 intensity -> 0.0 saturation (gray)
+    factor = 1.0 - (float(intensity) / 100.0)
+    factor = max(0.0, min(1.0, factor))
+
+    # Use ImageEnhance.Color for partial grayscale (desaturation)
+    enhancer = lambda band: ImageEnhance.Color(band).enhance(factor) # Per pixel
+    return _map_bands(img, enhancer)
+
+
+@memory_budget.tracked('grayscale')
 def process_grayscale(filepath, intensity=100):
     """
     Converts the image at the given filepath to grayscale.
@@ -390,17 +660,10 @@ def process_grayscale(filepath, intensity=100):
         raise FileNotFoundError("Image file not found for processing.")
 
     try:
-        # Map intensity (0-100) to saturation factor (1.0 to 0.0)
-        # 0 intensity -> 1.0 saturation (original)
-        # 100 intensity -> 0.0 saturation (gray)
-        factor = 1.0 - (float(intensity) / 100.0)
-        factor = max(0.0, min(1.0, factor))
-
-        with Image.open(filepath) as img:
-            # Use ImageEnhance.Color for partial grayscale (desaturation)
-            enhancer = ImageEnhance.Color(img)
-            grayscale_img = enhancer.enhance(factor)
-            grayscale_img.save(filepath)
+        with residency.open_image(filepath) as img:
+            grayscale_img = _apply(apply_grayscale, img, intensity)
+            cancellation.checkpoint()
+            residency.save_image(grayscale_img, filepath)
 
         updated_metadata = get_image_metadata(filepath)
         if not updated_metadata:
@@ -423,14 +686,8 @@ def process_grayscale(filepath, intensity=100):
         raise RuntimeError(f"An unexpected error occurred during grayscale conversion: {e}")
 
 
-def process_crop(filepath, preset):
-    """
-    Crops the image based on a preset aspect ratio.
-    preset: 'square', '16x9', '4x6', 'a4'
-    """
-    if not os.path.exists(filepath):
-        raise FileNotFoundError("Image file not found for processing.")
-
+def _parse_crop_ratio(preset):
+    """Returns the target width/height ratio for a crop preset or raises ValueError."""
     # Define ratios (width / height)
     ratios = {
         'square': 1.0,
@@ -458,31 +715,139 @@ def process_crop(filepath, preset):
         except ValueError:
              raise ValueError(f"Invalid crop preset: {preset}")
 
+    return target_ratio
+
+
+CROP_ANCHORS = ('center', 'smart')
+
+def _validate_crop_anchor(anchor):
+    if anchor not in CROP_ANCHORS:
+        raise ValueError(f"Invalid crop anchor: {anchor}. Must be one of: {', '.join(CROP_ANCHORS)}.")
+
+
+def _summed_area_table(values, width, height):
+    """Returns the (width + 1) x (height + 1) summed-area table of a row-major grid, as a flat list."""
+    stride = width + 1
+    table = [0] * (stride * (height + 1))
+    for y in range(height):
+        row_sum = 0
+        above = y * stride
+        row = above + stride
+        for x in range(width):
+            row_sum += values[y * width + x]
+            table[row + x + 1] = table[above + x + 1] + row_sum
+    return table
+
+
+def _window_sum(table, width, left, top, right, bottom):
+    stride = width + 1
+    return (table[bottom * stride + right] - table[top * stride + right]
+            - table[bottom * stride + left] + table[top * stride + left])
+
+
+def _smart_crop_origin(img, crop_width, crop_height):
+    """
+    Returns the (left, top) of the crop_width x crop_height window with the most detail.
+    Detail is edge energy on a small grayscale proxy; every window position is scored from one
+    summed-area table, so the search costs O(proxy pixels). Ties go to the most central window.
+    """
+    scale = max(img.width, img.height) / config.SMART_CROP_PROXY_DIMENSION
+    if scale > 1:
+        proxy_size = (max(1, round(img.width / scale)), max(1, round(img.height / scale)))
+        proxy = image_stats.tonal_image(img).resize(proxy_size, Image.Resampling.BOX, reducing_gap=2.0)
+    else:
+        proxy = img
+    proxy = proxy.convert('L')
+    cancellation.checkpoint()
+
+    edges = proxy.filter(ImageFilter.FIND_EDGES)
+    if proxy.width > 2 and proxy.height > 2:
+        edges = ImageOps.expand(ImageOps.crop(edges, 1), 1, 0) # The filter leaves the border unfiltered
+    energy = edges.tobytes()
+    table = _summed_area_table(energy, proxy.width, proxy.height)
+    scale_x, scale_y = img.width / proxy.width, img.height / proxy.height
+    window_w = min(proxy.width, max(1, round(crop_width / scale_x)))
+    window_h = min(proxy.height, max(1, round(crop_height / scale_y)))
+
+    center_x, center_y = (proxy.width - window_w) / 2, (proxy.height - window_h) / 2
+    best = None
+    for top in range(proxy.height - window_h + 1):
+        for left in range(proxy.width - window_w + 1):
+            score = _window_sum(table, proxy.width, left, top, left + window_w, top + window_h)
+            key = (score, -(abs(left - center_x) + abs(top - center_y)))
+            if best is None or key > best[0]:
+                best = (key, left, top)
+    _, left, top = best
+
+    # Back to full resolution, kept inside the image
+    left = min(img.width - crop_width, max(0, round(left * scale_x)))
+    top = min(img.height - crop_height, max(0, round(top * scale_y)))
+    return left, top
+
+
+def _crop_box(img, preset, anchor='center'):
+    """The (left, top, right, bottom) box apply_crop cuts from img."""
+    target_ratio = _parse_crop_ratio(preset)
+    _validate_crop_anchor(anchor)
+    width, height = img.size
+    current_ratio = width / height
+
+    # Calculate crop box to center the crop
+    if current_ratio > target_ratio:
+        # Image is wider than target, crop width
+        new_width = int(height * target_ratio)
+        new_height = height
+        left = (width - new_width) // 2
+        top = 0
+    else:
+        # Image is taller than target, crop height
+        new_width = width
+        new_height = int(width / target_ratio)
+        left = 0
+        top = (height - new_height) // 2
+
+    if anchor == 'smart':
+        left, top = _smart_crop_origin(img, new_width, new_height)
+    return (left, top, left + new_width, top + new_height)
+
+
+def _crop_to_box(img, box):
+    return img.crop(box)
+
+
+def apply_crop(img, preset, anchor='center'):
+    """
+    Returns img cropped to a preset aspect ratio.
+    preset: 'square', '16x9', '4x6', 'a4' or 'W:H'
+    anchor: 'center', or 'smart' to keep the most detailed part of the image
+    """
+    # Only the crop itself touches the full-resolution pixels
+    return _crop_to_box(img, _crop_box(img, preset, anchor))
+
+
+@memory_budget.tracked('crop')
+def process_crop(filepath, preset, anchor='center'):
+    """
+    Crops the image based on a preset aspect ratio.
+    preset: 'square', '16x9', '4x6', 'a4'
+    anchor: 'center' or 'smart' (see apply_crop)
+    """
+    if not os.path.exists(filepath):
+        raise FileNotFoundError("Image file not found for processing.")
+
+    _parse_crop_ratio(preset) # Validate before touching the file
+    _validate_crop_anchor(anchor)
+
     try:
-        with Image.open(filepath) as img:
-            width, height = img.size
-            current_ratio = width / height
-            
-            # Calculate crop box to center the crop
-            if current_ratio > target_ratio:
-                # Image is wider than target, crop width
-                new_width = int(height * target_ratio)
-                new_height = height
-                left = (width - new_width) // 2
-                top = 0
-                right = left + new_width
-                bottom = height
+        with residency.open_image(filepath) as img:
+            if animation.is_animated(img):
+                # One window for all frames, chosen on the first, so the picture doesn't jump around
+                cropped_img = animation.map_frames(img, _crop_to_box, _crop_box(img, preset, anchor))
             else:
-                # Image is taller than target, crop height
-                new_width = width
-                new_height = int(width / target_ratio)
-                left = 0
-                top = (height - new_height) // 2
-                right = width
-                bottom = top + new_height
-            
-            cropped_img = img.crop((left, top, right, bottom))
-            cropped_img.save(filepath)
+                # In this thread: a crop of a memory-mapped raw image only reads the rows it keeps
+                cropped_img = apply_crop(img, preset, anchor)
+            cancellation.checkpoint()
+            residency.save_image(cropped_img, filepath)
 
         updated_metadata = get_image_metadata(filepath)
         if not updated_metadata:
@@ -504,6 +869,41 @@ def process_crop(filepath, preset):
         raise RuntimeError(f"An unexpected error occurred during crop: {e}")
 
 
+def _validate_custom_crop(x, y, width, height):
+    """Raises ValueError unless the crop parameters are non-negative numbers with a positive size."""
+    if not all(isinstance(val, (int, float)) for val in [x, y, width, height]):
+        raise ValueError("All crop parameters must be numbers.")
+    
+    if width <= 0 or height <= 0:
+        raise ValueError("Crop width and height must be positive.")
+    
+    if x < 0 or y < 0:
+        raise ValueError("Crop x and y coordinates must be non-negative.")
+
+
+def apply_custom_crop(img, x, y, width, height):
+    """
+    Returns img cropped to the exact pixel rectangle (x, y, width, height).
+    Raises ValueError if the area is invalid or exceeds the image bounds.
+    """
+    _validate_custom_crop(x, y, width, height)
+    img_width, img_height = img.size
+
+    # Validate crop area is within image bounds
+    if x + width > img_width or y + height > img_height:
+        raise ValueError(f"Crop area exceeds image bounds. Image size: {img_width}x{img_height}, Crop area: {x},{y} to {x+width},{y+height}")
+
+    # PIL crop uses (left, upper, right, lower) tuple
+    left = int(x)
+    upper = int(y)
+    right = int(x + width)
+    lower = int(y + height)
+
+    cropped_img = img.crop((left, upper, right, lower))
+    return cropped_img
+
+
+@memory_budget.tracked('crop-custom')
 def process_custom_crop(filepath, x, y, width, height):
     """
     Crops the image to the exact coordinates specified.
@@ -514,32 +914,16 @@ def process_custom_crop(filepath, x, y, width, height):
     if not os.path.exists(filepath):
         raise FileNotFoundError("Image file not found for processing.")
 
-    # Validate parameters
-    if not all(isinstance(val, (int, float)) for val in [x, y, width, height]):
-        raise ValueError("All crop parameters must be numbers.")
-    
-    if width <= 0 or height <= 0:
-        raise ValueError("Crop width and height must be positive.")
-    
-    if x < 0 or y < 0:
-        raise ValueError("Crop x and y coordinates must be non-negative.")
+    _validate_custom_crop(x, y, width, height)
 
     try:
-        with Image.open(filepath) as img:
-            img_width, img_height = img.size
-            
-            # Validate crop area is within image bounds
-            if x + width > img_width or y + height > img_height:
-                raise ValueError(f"Crop area exceeds image bounds. Image size: {img_width}x{img_height}, Crop area: {x},{y} to {x+width},{y+height}")
-            
-            # PIL crop uses (left, upper, right, lower) tuple
-            left = int(x)
-            upper = int(y)
-            right = int(x + width)
-            lower = int(y + height)
-            
-            cropped_img = img.crop((left, upper, right, lower))
-            cropped_img.save(filepath)
+        with residency.open_image(filepath) as img:
+            if animation.is_animated(img):
+                cropped_img = animation.map_frames(img, apply_custom_crop, x, y, width, height)
+            else:
+                cropped_img = apply_custom_crop(img, x, y, width, height) # In this thread, like process_crop
+            cancellation.checkpoint()
+            residency.save_image(cropped_img, filepath)
 
         updated_metadata = get_image_metadata(filepath)
         if not updated_metadata:
@@ -562,40 +946,78 @@ def process_custom_crop(filepath, x, y, width, height):
 
 
 
-def convert_format(filepath, target_format):
+@memory_budget.tracked('convert')
+def convert_format(filepath, target_format, preset=None, quality=None, target_bytes=None):
     """
     Converts the image to the target format and returns the path to the new file.
-    Does NOT overwrite the original session file.
-    Returns (new_filepath, mimetype)
+    Does NOT overwrite the original session file. Every call writes a file of its own (concurrent
+    downloads and batch jobs may want different settings); the caller removes it when done.
+    preset/quality/target_bytes select encoder settings (see services/encoder.py).
     """
     if not os.path.exists(filepath):
         raise FileNotFoundError("Image file not found.")
 
-    target_format = target_format.lower()
-    if target_format not in ['jpeg', 'jpg', 'png', 'gif', 'bmp']:
-        raise ValueError("Unsupported target format.")
-    
-    if target_format == 'jpg': target_format = 'jpeg'
+    extension = encoder.normalize_format(target_format)
+    encoder.get_save_options(extension, preset, quality) # Validates before any work
 
     try:
+        with residency.open_image(filepath) as img:
+            data, _ = encoder.encode_image(img, extension, preset=preset, quality=quality, target_bytes=target_bytes)
+
         # Create a temp file for the download
         directory, filename = os.path.split(filepath)
         name, _ = os.path.splitext(filename)
-        new_filename = f"{name}_converted.{target_format}"
-        new_filepath = os.path.join(directory, new_filename)
-        
-        with Image.open(filepath) as img:
-            # Convert mode if necessary (e.g. RGBA to JPEG requires RGB)
-            if target_format == 'jpeg' and img.mode in ('RGBA', 'P'):
-                img = img.convert('RGB')
-            
-            img.save(new_filepath, format=target_format.upper())
-            
+        new_filepath = os.path.join(directory, f"{name}_converted_{uuid.uuid4().hex[:12]}.{extension}")
+        file_helpers.atomic_write_bytes(new_filepath, data)
         return new_filepath
+    except ValueError:
+        raise
     except Exception as e:
         raise RuntimeError(f"Error converting format: {e}")
 
 
+def get_precomputed_conversion(session_id, target_format, preset=None):
+    """
+    Path of the session's current image already converted to target_format with preset, by the
+    background speculation after its last change (see services/speculation.py), or None.
+    Only valid for serving right away: the file may be evicted later.
+    """
+    return speculation.lookup(session_id, _current_version(session_id), target_format, preset)
+
+
+def read_region(filepath, x, y, width, height, target_format=None, preset=None):
+    """
+    Encodes the pixel rectangle (x, y, width, height) of the current image, e.g. a tile of a
+    zoomed-in view. Returns (data, info) like encoder.encode_image. Raises ValueError for
+    areas outside the image or unsupported formats.
+    """
+    if not os.path.exists(filepath):
+        raise FileNotFoundError("Image file not found.")
+    extension = encoder.normalize_format(target_format or os.path.splitext(filepath)[1][1:])
+    encoder.get_save_options(extension, preset) # Validates before any work
+
+    with residency.open_image(filepath) as img:
+        region = apply_custom_crop(img, x, y, width, height)
+    return encoder.encode_image(region, extension, preset=preset)
+
+
+def apply_brightness(img, level):
+    """
+    Returns a brightness-adjusted copy of img.
+    level: Integer from -100 to 100.
+    """
+    # Map level (-100 to 100) to factor (0.0 to 2.0)
+    # 0 -> 1.0 (original)
+    # -100 -> 0.0 (black)
+    # 100 -> 2.0 (double brightness)
+    factor = 1.0 + (float(level) / 100.0)
+    factor = max(0.0, factor) # Ensure non-negative
+
+    enhancer = lambda band: ImageEnhance.Brightness(band).enhance(factor) # Per pixel
+    return _map_bands(img, enhancer)
+
+
+@memory_budget.tracked('brightness')
 def process_brightness(filepath, level):
     """
     Adjusts the brightness of the image.
@@ -605,17 +1027,10 @@ def process_brightness(filepath, level):
         raise FileNotFoundError("Image file not found for processing.")
 
     try:
-        # Map level (-100 to 100) to factor (0.0 to 2.0)
-        # 0 -> 1.0 (original)
-        # -100 -> 0.0 (black)
-        # 100 -> 2.0 (double brightness)
-        factor = 1.0 + (float(level) / 100.0)
-        factor = max(0.0, factor) # Ensure non-negative
-
-        with Image.open(filepath) as img:
-            enhancer = ImageEnhance.Brightness(img)
-            enhanced_img = enhancer.enhance(factor)
-            enhanced_img.save(filepath)
+        with residency.open_image(filepath) as img:
+            enhanced_img = _apply(apply_brightness, img, level)
+            cancellation.checkpoint()
+            residency.save_image(enhanced_img, filepath)
 
         updated_metadata = get_image_metadata(filepath)
         if not updated_metadata:
@@ -637,6 +1052,25 @@ def process_brightness(filepath, level):
         raise RuntimeError(f"An unexpected error occurred during brightness adjustment: {e}")
 
 
+def apply_contrast(img, level):
+    """
+    Returns a contrast-adjusted copy of img.
+    level: Integer from -100 to 100.
+    """
+    # Map level (-100 to 100) to factor (0.0 to 2.0)
+    # 0 -> 1.0 (original)
+    # -100 -> 0.0 (gray)
+    # 100 -> 2.0 (high contrast)
+    factor = 1.0 + (float(level) / 100.0)
+    factor = max(0.0, factor)
+
+    # Not banded: the contrast pivot is the mean of the whole image
+    cancellation.checkpoint()
+    enhancer = ImageEnhance.Contrast(img)
+    return enhancer.enhance(factor)
+
+
+@memory_budget.tracked('contrast')
 def process_contrast(filepath, level):
     """
     Adjusts the contrast of the image.
@@ -646,17 +1080,10 @@ def process_contrast(filepath, level):
         raise FileNotFoundError("Image file not found for processing.")
 
     try:
-        # Map level (-100 to 100) to factor (0.0 to 2.0)
-        # 0 -> 1.0 (original)
-        # -100 -> 0.0 (gray)
-        # 100 -> 2.0 (high contrast)
-        factor = 1.0 + (float(level) / 100.0)
-        factor = max(0.0, factor)
-
-        with Image.open(filepath) as img:
-            enhancer = ImageEnhance.Contrast(img)
-            enhanced_img = enhancer.enhance(factor)
-            enhanced_img.save(filepath)
+        with residency.open_image(filepath) as img:
+            enhanced_img = _apply(apply_contrast, img, level)
+            cancellation.checkpoint()
+            residency.save_image(enhanced_img, filepath)
 
         updated_metadata = get_image_metadata(filepath)
         if not updated_metadata:
@@ -678,6 +1105,32 @@ def process_contrast(filepath, level):
         raise RuntimeError(f"An unexpected error occurred during contrast adjustment: {e}")
 
 
+def apply_filter(img, filter_type, intensity=0):
+    """
+    Returns a filtered copy of img.
+    filter_type: 'blur', 'sharpen'
+    intensity: 0 to 100
+    """
+    if filter_type not in ['blur', 'sharpen']:
+        raise ValueError("Invalid filter type. Must be 'blur' or 'sharpen'.")
+
+    if filter_type == 'blur':
+        # Map intensity 0-100 to radius 0-10
+        radius = float(intensity) / 10.0
+        if radius > 0:
+            # The blur reads about 3 radii around each pixel
+            return _map_bands(img, lambda band: band.filter(ImageFilter.GaussianBlur(radius=radius)), overlap=int(3 * radius) + 4)
+        return img.copy() # No change
+    else:
+        # Map intensity 0-100 to sharpness factor 1.0-3.0
+        # 0 -> 1.0 (original)
+        # 100 -> 3.0 (extra sharp)
+        factor = 1.0 + (float(intensity) / 50.0)
+        # Sharpness blends with a 3x3 smoothed copy
+        return _map_bands(img, lambda band: ImageEnhance.Sharpness(band).enhance(factor), overlap=2)
+
+
+@memory_budget.tracked('filter')
 def process_filter(filepath, filter_type, intensity=0):
     """
     Applies a filter to the image.
@@ -691,23 +1144,10 @@ def process_filter(filepath, filter_type, intensity=0):
         raise ValueError("Invalid filter type. Must be 'blur' or 'sharpen'.")
 
     try:
-        with Image.open(filepath) as img:
-            if filter_type == 'blur':
-                # Map intensity 0-100 to radius 0-10
-                radius = float(intensity) / 10.0
-                if radius > 0:
-                    filtered_img = img.filter(ImageFilter.GaussianBlur(radius=radius))
-                else:
-                    filtered_img = img # No change
-            elif filter_type == 'sharpen':
-                # Map intensity 0-100 to sharpness factor 1.0-3.0
-                # 0 -> 1.0 (original)
-                # 100 -> 3.0 (extra sharp)
-                factor = 1.0 + (float(intensity) / 50.0)
-                enhancer = ImageEnhance.Sharpness(img)
-                filtered_img = enhancer.enhance(factor)
-            
-            filtered_img.save(filepath)
+        with residency.open_image(filepath) as img:
+            filtered_img = _apply(apply_filter, img, filter_type, intensity)
+            cancellation.checkpoint()
+            residency.save_image(filtered_img, filepath)
 
         updated_metadata = get_image_metadata(filepath)
         if not updated_metadata:
@@ -729,6 +1169,192 @@ def process_filter(filepath, filter_type, intensity=0):
         raise RuntimeError(f"An unexpected error occurred during filter application: {e}")
 
 
+def get_histogram(filepath):
+    """Histograms and channel statistics of the current image; cached per history version."""
+    if not os.path.exists(filepath):
+        raise FileNotFoundError("Image file not found.")
+    session_id = os.path.basename(filepath).split('.')[0]
+    with residency.open_image(filepath) as img:
+        return image_stats.get_stats(_current_version(session_id), img)
+
+
+def apply_lut(img, lut):
+    """Returns img mapped through a lookup table (256 entries per color band) in one pass; alpha is kept."""
+    img = image_stats.tonal_image(img)
+    if 'A' in img.getbands():
+        lut = lut + list(range(256))
+    return _map_bands(img, lambda band: band.point(lut))
+
+
+def apply_auto(img, mode='levels', clip=0.5):
+    """
+    Returns a copy of img with automatic levels, contrast or white balance, measured on img itself.
+    mode: 'levels', 'contrast', 'white-balance'
+    clip: percent of darkest/brightest pixels allowed to clip, 0 to 10
+    """
+    return apply_lut(img, image_stats.auto_lut(image_stats.compute_stats(img), mode, clip))
+
+
+@memory_budget.tracked('auto')
+def process_auto(filepath, mode, clip=0.5):
+    """
+    Applies automatic levels, contrast or white balance (see apply_auto).
+    The statistics of the current version are usually cached already (histogram view, undo/redo,
+    an earlier auto click), so the adjustment is a single lookup-table pass over the pixels.
+    Animations are measured on their first frame; every frame gets the same curve.
+    """
+    if not os.path.exists(filepath):
+        raise FileNotFoundError("Image file not found for processing.")
+
+    image_stats.validate_auto(mode, clip)
+
+    try:
+        session_id = os.path.basename(filepath).split('.')[0]
+        with residency.open_image(filepath) as img:
+            if not animation.is_animated(img):
+                img = _editable(img) # The curve is measured on the pixels it's applied to
+            stats = image_stats.get_stats(_current_version(session_id), img)
+            lut = image_stats.auto_lut(stats, mode, clip)
+            adjusted_img = _apply(apply_lut, img, lut)
+            cancellation.checkpoint()
+            residency.save_image(adjusted_img, filepath)
+
+        updated_metadata = get_image_metadata(filepath)
+        if not updated_metadata:
+             raise ValueError("Could not get metadata after auto adjustment.")
+        
+        # Update history
+        _add_to_history(session_id, filepath)
+
+        return {
+            "new_dimensions": {"width": updated_metadata["width"], "height": updated_metadata["height"]},
+            "new_size_bytes": updated_metadata["size_bytes"]
+        }
+    except FileNotFoundError:
+        raise
+    except UnidentifiedImageError:
+        raise ValueError("Cannot process this image type or image is corrupt.")
+    except Exception as e:
+        raise RuntimeError(f"An unexpected error occurred during auto adjustment: {e}")
+
+
+# --- Recipes ---
+# A recipe is a list of (op, kwargs) steps, parsed from the same operation names and JSON
+# parameters as the /api/process/<id>/<ext>/<op> routes by operations.parse_recipe.
+# { step op: apply function }; 'crop-box' and 'lut' only appear in recipes fixed for animations (see _fix_recipe)
+RECIPE_STEPS = {
+    'resize': apply_resize,
+    'rotate': apply_rotate,
+    'flip': apply_flip,
+    'crop': apply_crop,
+    'crop-custom': apply_custom_crop,
+    'grayscale': apply_grayscale,
+    'brightness': apply_brightness,
+    'contrast': apply_contrast,
+    'filter': apply_filter,
+    'auto': apply_auto,
+    'crop-box': _crop_to_box,
+    'lut': apply_lut,
+}
+
+
+def apply_recipe(img, recipe):
+    """Applies a parsed recipe to img in memory and returns the result."""
+    for op, kwargs in recipe:
+        cancellation.checkpoint()
+        img = RECIPE_STEPS[op](img, **kwargs)
+    return img
+
+
+def _fix_recipe(frame, recipe):
+    """
+    Returns the recipe with its crops and auto adjustments turned into the crop box and
+    lookup table they come to on frame, so each frame of an animation gets the same ones.
+    """
+    fixed = []
+    for op, kwargs in recipe:
+        if op == 'crop':
+            op, kwargs = 'crop-box', {'box': _crop_box(frame, **kwargs)}
+        elif op == 'auto':
+            stats = image_stats.compute_stats(frame)
+            op, kwargs = 'lut', {'lut': image_stats.auto_lut(stats, kwargs['mode'], kwargs['clip'])}
+        fixed.append((op, kwargs))
+        frame = RECIPE_STEPS[op](frame, **kwargs)
+    return fixed
+
+
+def run_recipe(img, recipe):
+    """
+    apply_recipe in the compute pool. An animation is edited frame by frame and comes back as
+    AnimatedFrames (see services/animation.py).
+    """
+    if animation.is_animated(img):
+        return animation.map_frames(img, apply_recipe, _fix_recipe(animation.first_frame(img), recipe))
+    return compute_pool.run(apply_recipe, _editable(img), recipe)
+
+
+@memory_budget.tracked('recipe')
+def process_recipe(filepath, recipe):
+    """
+    Applies a parsed recipe to the image at filepath as a single edit:
+    one decode, one encode and one history step.
+    """
+    if not os.path.exists(filepath):
+        raise FileNotFoundError("Image file not found for processing.")
+
+    try:
+        with residency.open_image(filepath) as img:
+            result_img = run_recipe(img, recipe)
+            cancellation.checkpoint()
+            residency.save_image(result_img, filepath)
+
+        updated_metadata = get_image_metadata(filepath)
+        if not updated_metadata:
+             raise ValueError("Could not get metadata after applying recipe.")
+        
+        # Update history
+        session_id = os.path.basename(filepath).split('.')[0]
+        _add_to_history(session_id, filepath)
+
+        return {
+            "new_dimensions": {"width": updated_metadata["width"], "height": updated_metadata["height"]},
+            "new_size_bytes": updated_metadata["size_bytes"]
+        }
+    except FileNotFoundError:
+        raise
+    except UnidentifiedImageError:
+        raise ValueError("Cannot process this image type or image is corrupt.")
+    except (ValueError, TypeError) as e:
+        raise ValueError(f"Invalid recipe parameters or image error: {e}")
+    except Exception as e:
+        raise RuntimeError(f"An unexpected error occurred while applying recipe: {e}")
+
+
+# --- Live Previews ---
+def load_preview_proxy(filepath, max_dimension):
+    """
+    Decodes the image downscaled so its longer side is at most max_dimension.
+    JPEGs are decoded directly at reduced scale via draft().
+    """
+    if not os.path.exists(filepath):
+        raise FileNotFoundError("Image file not found for preview.")
+
+    with Image.open(filepath) as img:
+        img.draft(None, (max_dimension, max_dimension))
+        proxy = _editable(img.copy()) # Previews run the same apply_* functions
+    proxy.thumbnail((max_dimension, max_dimension), Image.Resampling.BILINEAR)
+    return proxy
+
+
+def encode_preview_frame(img, quality):
+    """Encodes a preview frame as JPEG bytes."""
+    if img.mode not in ('RGB', 'L'):
+        img = img.convert('RGB')
+    buffer = io.BytesIO()
+    img.save(buffer, format='JPEG', quality=quality)
+    return buffer.getvalue()
+
+
 def update_image_from_client(session_id, original_extension, file_storage):
     """
     Updates the current image with a file provided by the client (e.g. after client-side drawing).
@@ -748,40 +1374,13 @@ def update_image_from_client(session_id, original_extension, file_storage):
         img = Image.open(io.BytesIO(file_bytes))
         img.verify()
         
-        # Save to a unique temporary file to avoid race conditions
-        unique_suffix = str(uuid.uuid4())
-        temp_filepath = f"{filepath}.{unique_suffix}.tmp"
-        
-        with open(temp_filepath, 'wb') as f:
-            f.write(file_bytes)
-        
     except UnidentifiedImageError:
         raise ValueError("Uploaded file is not a valid image")
     except Exception as e:
         raise ValueError(f"Failed to process uploaded file: {str(e)}")
     
-    # Try to replace the original file with retries to handle Windows file locking
-    max_retries = 5
-    for i in range(max_retries):
-        try:
-            os.replace(temp_filepath, filepath)
-            break
-        except PermissionError:
-            if i == max_retries - 1:
-                if os.path.exists(temp_filepath):
-                    try:
-                        os.remove(temp_filepath)
-                    except:
-                        pass
-                raise RuntimeError(f"Could not update image file {filepath} due to file lock. Please try again.")
-            time.sleep(0.2)
-        except Exception as e:
-            if os.path.exists(temp_filepath):
-                try:
-                    os.remove(temp_filepath)
-                except:
-                    pass
-            raise e
+    # Written to a unique temporary file and swapped in, so concurrent readers never see a partial image
+    file_helpers.atomic_write_bytes(filepath, file_bytes)
     
     # Add to history
     _add_to_history(session_id, filepath)
@@ -0,0 +1,160 @@
+import math
+import threading
+from collections import OrderedDict
+import config # Imports from backend/config.py
+
+# --- Image Statistics ---
+# Histograms and per-channel statistics for the histogram API and the auto-* adjustments.
+# History versions are content-addressed, so statistics are cached by version blob: computed
+# once per distinct image, then reused by every session, undo/redo step and auto adjustment
+# showing the same pixels.
+# { blob_path: stats }
+_cache = OrderedDict()
+_lock = threading.Lock()
+_counters = {"hits": 0, "misses": 0}
+
+AUTO_MODES = ('levels', 'contrast', 'white-balance')
+MAX_CLIP_PERCENT = 10.0
+MAX_WHITE_BALANCE_GAIN = 2.0 # Keeps a near-empty channel (e.g. a blue-free image) from being blown out
+
+
+def tonal_image(img):
+    """Returns img in an 8-bit mode with tonal bands (L, LA, RGB or RGBA), converting if needed."""
+    if img.mode in ('L', 'LA', 'RGB', 'RGBA'):
+        return img
+    if img.mode in ('P', 'PA'):
+        return img.convert('RGBA' if img.mode == 'PA' or 'transparency' in img.info else 'RGB')
+    if img.mode in ('1', 'I;16', 'I', 'F'):
+        return img.convert('L')
+    return img.convert('RGB') # CMYK, YCbCr, LAB, HSV
+
+
+def _percentile(histogram, percent):
+    """The smallest value with at least percent % of the counted pixels at or below it."""
+    total = sum(histogram)
+    threshold = total * percent / 100.0
+    cumulative = 0
+    for value, count in enumerate(histogram):
+        cumulative += count
+        if count and cumulative >= threshold:
+            return value
+    return len(histogram) - 1
+
+
+def _summarize(histogram):
+    total = sum(histogram)
+    if not total:
+        return {"histogram": histogram, "min": 0, "max": 0, "mean": 0.0, "stddev": 0.0, "median": 0}
+    mean = sum(value * count for value, count in enumerate(histogram)) / total
+    variance = sum(count * (value - mean) ** 2 for value, count in enumerate(histogram)) / total
+    used = [value for value, count in enumerate(histogram) if count]
+    return {
+        "histogram": histogram,
+        "min": used[0],
+        "max": used[-1],
+        "mean": round(mean, 3),
+        "stddev": round(math.sqrt(variance), 3),
+        "median": _percentile(histogram, 50)
+    }
+
+
+def compute_stats(img):
+    """
+    Returns {"width", "height", "pixels", "channels": {band: summary}, "luminance": summary},
+    where each summary has a 256-bin "histogram" plus min/max/mean/stddev/median.
+    Fully transparent pixels are not counted.
+    """
+    img = tonal_image(img)
+    bands = img.getbands()
+    color_bands = [band for band in bands if band != 'A']
+    # One pass over the pixels per histogram; alpha (when present) masks out transparent pixels
+    mask = img.getchannel('A') if 'A' in bands else None
+    histogram = img.histogram(mask=mask)
+    channels = {band: _summarize(histogram[i * 256:(i + 1) * 256]) for i, band in enumerate(color_bands)}
+    if len(color_bands) == 1:
+        luminance = channels[color_bands[0]]
+    else:
+        luminance = _summarize(img.convert('L').histogram(mask=mask))
+    return {
+        "width": img.width,
+        "height": img.height,
+        "pixels": sum(luminance["histogram"]),
+        "channels": channels,
+        "luminance": luminance
+    }
+
+
+def get_stats(version_blob, img):
+    """
+    Statistics of img, which must be the decoded contents of version_blob.
+    Cached per version; version_blob None computes without caching.
+    """
+    if version_blob:
+        with _lock:
+            stats = _cache.get(version_blob)
+            if stats is not None:
+                _cache.move_to_end(version_blob)
+                _counters["hits"] += 1
+                return stats
+    stats = compute_stats(img)
+    if version_blob:
+        with _lock:
+            _counters["misses"] += 1
+            _cache[version_blob] = stats
+            while len(_cache) > config.IMAGE_STATS_CACHE_ENTRIES:
+                _cache.popitem(last=False)
+    return stats
+
+
+def _stretch(low, high):
+    if high <= low:
+        return list(range(256))
+    scale = 255.0 / (high - low)
+    return [min(255, max(0, int(round((value - low) * scale)))) for value in range(256)]
+
+
+def _gain(factor):
+    return [min(255, int(round(value * factor))) for value in range(256)]
+
+
+def validate_auto(mode, clip_percent):
+    """Raises ValueError for an unknown auto mode or clip value; returns the clip as a float."""
+    if mode not in AUTO_MODES:
+        raise ValueError(f"Invalid auto mode. Must be one of: {', '.join(AUTO_MODES)}.")
+    try:
+        clip_percent = float(clip_percent)
+    except (TypeError, ValueError):
+        raise ValueError("Clip must be a number.")
+    if not 0 <= clip_percent <= MAX_CLIP_PERCENT:
+        raise ValueError(f"Clip must be between 0 and {MAX_CLIP_PERCENT:g} percent.")
+    return clip_percent
+
+
+def auto_lut(stats, mode, clip_percent=0.5):
+    """
+    Builds the lookup table (256 entries per band, for Image.point) of an automatic adjustment:
+      levels:        stretches each channel on its own to the full range (also removes color casts)
+      contrast:      stretches all channels by the same amount, from the luminance (keeps hues)
+      white-balance: scales channels so their means are equal (gray world)
+    clip_percent of the darkest and of the brightest pixels are allowed to clip.
+    Raises ValueError like validate_auto.
+    """
+    clip_percent = validate_auto(mode, clip_percent)
+    channels = stats["channels"]
+    if mode == 'levels':
+        tables = [_stretch(_percentile(summary["histogram"], clip_percent),
+                           _percentile(summary["histogram"], 100 - clip_percent)) for summary in channels.values()]
+    elif mode == 'contrast':
+        luminance = stats["luminance"]["histogram"]
+        table = _stretch(_percentile(luminance, clip_percent), _percentile(luminance, 100 - clip_percent))
+        tables = [table] * len(channels)
+    else:
+        means = [summary["mean"] for summary in channels.values()]
+        gray = sum(means) / len(means)
+        tables = [_gain(min(MAX_WHITE_BALANCE_GAIN, gray / mean)) if mean else list(range(256)) for mean in means]
+    return [entry for table in tables for entry in table]
+
+
+def get_cache_stats():
+    with _lock:
+        return {"entries": len(_cache), **_counters}
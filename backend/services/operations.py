@@ -0,0 +1,196 @@
+import os
+import config # Imports from backend/config.py
+from services import image_service, residency, encoder
+from utils import memory_budget, cost_model
+
+# --- Operation Registry ---
+# Every editing operation, declared once: the JSON parameters its route (/api/process/<id>/<ext>/<op>),
+# recipe step and live message take, its image_service implementation (apply_* on an image in
+# memory, process_* on a session's working file) and the work it does, which the cost model
+# (utils/cost_model.py) turns into expected seconds next to memory_budget's peak memory.
+
+
+class Operation:
+    """
+    params: [(json param, keyword argument, required, default), ...]
+    work(width, height, kwargs): [(cost model kind, megapixels), ...] for one image or frame
+    """
+    def __init__(self, name, label, apply, process, params, work, live=False, payload_required=False,
+                 server_error=None, shows_runtime_errors=False):
+        self.name = name
+        self.label = label # For log messages
+        self.server_error = server_error or f"Server error during {label}." # The route's 500 answer
+        self.shows_runtime_errors = shows_runtime_errors # 500 with the RuntimeError's own message instead
+        self.apply = apply
+        self.process = process
+        self.params = params
+        self.work = work
+        self.live = live # Offered on the live adjustment channel (routes/live_routes.py)
+        self.payload_required = payload_required # Even without required params, a request must say something
+
+    def required_params(self):
+        return [json_name for json_name, _, required, _ in self.params if required]
+
+    def missing_params(self, params):
+        """JSON names of required parameters absent from params."""
+        return [json_name for json_name, _, required, _ in self.params if required and json_name not in params]
+
+    def parse(self, params):
+        """Keyword arguments for apply/process from JSON params. Raises ValueError if some are missing."""
+        missing = self.missing_params(params)
+        if missing:
+            raise ValueError(f"Missing params for {self.name}: {', '.join(missing)}")
+        return {kwarg_name: params.get(json_name, default) for json_name, kwarg_name, _, default in self.params}
+
+
+def _megapixels(width, height):
+    return width * height / 1e6
+
+
+def _pixel_work(kind):
+    # Operations whose work is one pass over every pixel
+    return lambda width, height, kwargs: [(kind, _megapixels(width, height))]
+
+
+def _resize_work(width, height, kwargs):
+    new_width, new_height = memory_budget.output_size('resize', width, height, kwargs)
+    # Horizontal pass into a new_width x height intermediate, then the vertical pass; when
+    # shrinking, the filter reads proportionally more source pixels per output pixel
+    return [('resize', _megapixels(max(width, new_width), height) + _megapixels(new_width, max(height, new_height)))]
+
+
+def _crop_work(width, height, kwargs):
+    work = [('crop', _megapixels(width, height))] # The kept area is at most the whole image
+    if kwargs.get('anchor') == 'smart':
+        work.append(('smart-crop', _megapixels(width, height)))
+    return work
+
+
+def _custom_crop_work(width, height, kwargs):
+    crop_width, crop_height = memory_budget.output_size('crop-custom', width, height, kwargs)
+    return [('crop', _megapixels(crop_width, crop_height))]
+
+
+def _filter_work(width, height, kwargs):
+    return [('sharpen' if kwargs.get('filter_type') == 'sharpen' else 'blur', _megapixels(width, height))]
+
+
+OPERATIONS = {op.name: op for op in [
+    Operation('resize', 'resize', image_service.apply_resize, image_service.process_resize, [
+        ('width_px', 'width_px', False, None),
+        ('height_px', 'height_px', False, None),
+        ('percentage', 'percentage', False, None),
+        ('maintain_aspect_ratio', 'maintain_aspect_ratio', False, True)
+    ], _resize_work, payload_required=True,
+       server_error="An unexpected server error occurred during resize.", shows_runtime_errors=True),
+    Operation('rotate', 'rotation', image_service.apply_rotate, image_service.process_rotate,
+              [('angle', 'angle', True, None)], _pixel_work('rotate'),
+              server_error="An unexpected server error occurred during rotation.", shows_runtime_errors=True),
+    Operation('flip', 'flip', image_service.apply_flip, image_service.process_flip,
+              [('axis', 'axis', True, None)], _pixel_work('flip')),
+    Operation('crop', 'crop', image_service.apply_crop, image_service.process_crop,
+              [('preset', 'preset', True, None), ('anchor', 'anchor', False, 'center')], _crop_work),
+    Operation('crop-custom', 'custom crop', image_service.apply_custom_crop, image_service.process_custom_crop, [
+        ('x', 'x', True, None),
+        ('y', 'y', True, None),
+        ('width', 'width', True, None),
+        ('height', 'height', True, None)
+    ], _custom_crop_work),
+    Operation('grayscale', 'grayscale conversion', image_service.apply_grayscale, image_service.process_grayscale,
+              [('intensity', 'intensity', False, 100)], _pixel_work('grayscale'), live=True),
+    Operation('brightness', 'brightness adjustment', image_service.apply_brightness, image_service.process_brightness,
+              [('level', 'level', True, None)], _pixel_work('brightness'), live=True),
+    Operation('contrast', 'contrast adjustment', image_service.apply_contrast, image_service.process_contrast,
+              [('level', 'level', True, None)], _pixel_work('contrast'), live=True),
+    Operation('filter', 'filter application', image_service.apply_filter, image_service.process_filter,
+              [('type', 'filter_type', True, None), ('intensity', 'intensity', False, 0)], _filter_work, live=True),
+    Operation('auto', 'auto adjustment', image_service.apply_auto, image_service.process_auto,
+              [('mode', 'mode', False, 'levels'), ('clip', 'clip', False, 0.5)], _pixel_work('auto')),
+]}
+MAX_RECIPE_STEPS = 20
+
+
+def parse_recipe(steps):
+    """
+    Validates a recipe and returns it as [(op, kwargs), ...] for image_service.process_recipe.
+    Raises ValueError for unknown operations or missing parameters.
+    """
+    if not isinstance(steps, list) or not steps:
+        raise ValueError("Recipe must be a non-empty list of steps.")
+    if len(steps) > MAX_RECIPE_STEPS:
+        raise ValueError(f"Recipe cannot have more than {MAX_RECIPE_STEPS} steps.")
+
+    parsed = []
+    for i, step in enumerate(steps, start=1):
+        if not isinstance(step, dict) or step.get('op') not in OPERATIONS:
+            raise ValueError(f"Step {i}: unknown operation. Allowed: {', '.join(OPERATIONS)}")
+        operation = OPERATIONS[step['op']]
+        params = step.get('params') or {}
+        missing = operation.missing_params(params)
+        if missing:
+            raise ValueError(f"Step {i} ({operation.name}): missing '{missing[0]}' parameter.")
+        parsed.append((operation.name, operation.parse(params)))
+    return parsed
+
+
+def _apply_work(op, width, height, kwargs):
+    if op != 'recipe':
+        return OPERATIONS[op].work(width, height, kwargs)
+    work = []
+    for step_op, step_kwargs in kwargs.get('recipe') or []:
+        work.extend(OPERATIONS[step_op].work(width, height, step_kwargs))
+        width, height = memory_budget.output_size(step_op, width, height, step_kwargs)
+    return work
+
+
+def _file_format(extension):
+    try:
+        return encoder.normalize_format(extension.lstrip('.'))
+    except ValueError:
+        return None # Unknown formats cost no decode/encode time
+
+
+def estimate(op, width, height, mode, kwargs, frames=1, extension=None, decoded=False):
+    """
+    Cost (cost_model.Cost) of op ('recipe' for kwargs {'recipe': parsed recipe}) on a width x height
+    image in mode with frames frames, stored as extension: decoding it unless decoded, the edit,
+    and encoding the result back. Animation frames are edited in parallel (services/animation.py).
+    """
+    file_format = _file_format(extension or '')
+    output_width, output_height = memory_budget.output_size(op, width, height, kwargs)
+    io_work = []
+    if file_format and not decoded:
+        io_work.append((f'decode-{file_format}', frames * _megapixels(width, height)))
+    if file_format:
+        io_work.append((f'encode-{file_format}', frames * _megapixels(output_width, output_height)))
+    edit_work = [(kind, frames * megapixels) for kind, megapixels in _apply_work(op, width, height, kwargs)]
+
+    if frames > 1:
+        return cost_model.estimate(
+            op, io_work, edit_work, min(frames, config.ANIMATION_FRAME_THREADS), 'RGBA',
+            memory_budget.estimate_animation_bytes(op, width, height, frames, kwargs))
+    return cost_model.estimate(
+        op, io_work + edit_work, (), 1, mode, memory_budget.estimate_peak_bytes(op, width, height, mode, kwargs))
+
+
+def estimate_file(op, filepath, kwargs, extension=None):
+    """estimate() for the image at filepath, from its header. None if it can't be read."""
+    geometry = memory_budget.image_geometry(filepath)
+    if geometry is None:
+        return None
+    width, height, mode, frames = geometry
+    return estimate(op, width, height, mode, kwargs, frames,
+                    extension or os.path.splitext(filepath)[1], residency.is_decoded(filepath))
+
+
+def run(op, filepath, kwargs):
+    """
+    Runs op's process function ('recipe': image_service.process_recipe) on the working file under
+    its cost estimate: refused upfront when it can't finish within its deadline, timed otherwise.
+    """
+    process = image_service.process_recipe if op == 'recipe' else OPERATIONS[op].process
+    cost = estimate_file(op, filepath, kwargs)
+    if cost is None:
+        return process(filepath, **kwargs) # Let the operation report the missing/corrupt file
+    with cost_model.metered(op, cost):
+        return process(filepath, **kwargs)
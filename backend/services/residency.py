@@ -0,0 +1,342 @@
+import os
+import time
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from PIL import Image
+import config # Imports from backend/config.py
+from services import animation, encoder
+from utils import file_helpers, session_locks, pixel_buffers, raw_image
+
+# --- Tiered Session Residency ---
+# ram:  decoded pixels of recently used sessions, bounded by RESIDENCY_MEMORY_QUOTA_MB (LRU)
+# disk: the encoded working file in WORKING_FOLDER (may itself be a RAM-backed tmpfs)
+# cold: idle sessions' working files moved to COLD_FOLDER on disk; promoted back on access.
+#       They stay in their encoded format (PNG/JPEG/WebP), which general-purpose compression
+#       barely shrinks, so demotion only frees the working folder (e.g. a RAM-backed tmpfs).
+# Evicted sessions are gone; the cleanup job evicts expired sessions and, above
+# RESIDENCY_DISK_QUOTA_MB, the least recently used cold sessions.
+# With compute workers enabled, the ram tier's pixels are shared memory buffers whose lifetime
+# is their cache entry's (see utils/pixel_buffers.py).
+# With RAW_WORKING_IMAGES, the disk tier also has an uncompressed, memory-mapped copy of the
+# pixels (see utils/raw_image.py), read instead of decoding the working file.
+
+# { session_id: { "image": Image, "filepath": str, "token": (dev, inode, size), "nbytes": int } }
+_decoded = OrderedDict()
+_decoded_bytes = 0
+# { session_id: last access time }
+_last_access = {}
+# { session_id: (cold_filepath, size_bytes) }
+_cold = {}
+# { session_id: pins }: requests and live channels using the working file, which stays in place meanwhile
+_pins = {}
+_counters = {
+    "promotions_to_ram": 0,
+    "promotions_from_cold": 0,
+    "demotions_from_ram": 0,
+    "demotions_to_cold": 0,
+    "evictions": 0,
+    "raw_maps": 0
+}
+_lock = threading.RLock()
+
+
+def _session_id_for(filepath):
+    return os.path.basename(filepath).split('.')[0]
+
+
+def _file_token(filepath):
+    # Every writer swaps in a new file, so the inode identifies the contents. Not the mtime:
+    # linking the file into the version store refreshes it without changing the pixels.
+    stat = os.stat(filepath)
+    return (stat.st_dev, stat.st_ino, stat.st_size)
+
+
+def _image_nbytes(img):
+    return img.width * img.height * len(img.getbands())
+
+
+def get_cold_filepath(session_id, filepath):
+    return os.path.join(file_helpers.get_shard_dir(config.COLD_FOLDER, session_id), os.path.basename(filepath))
+
+
+def ensure_hot(session_id, filepath):
+    """
+    Marks the session as accessed and moves its working file back from the cold tier if needed.
+    Ids with a file in neither tier (unknown or expired sessions, uploads not saved yet) aren't tracked.
+    """
+    with _lock:
+        if os.path.exists(filepath):
+            _last_access[session_id] = time.time()
+            return
+        cold_entry = _cold.get(session_id)
+        cold_filepath = cold_entry[0] if cold_entry else get_cold_filepath(session_id, filepath)
+        if not os.path.exists(cold_filepath):
+            return
+        file_helpers.atomic_move(cold_filepath, filepath)
+        _cold.pop(session_id, None)
+        _last_access[session_id] = time.time()
+        _counters["promotions_from_cold"] += 1
+
+
+def pin(session_id):
+    """Keeps the session's working file where it is (not demoted) until the matching unpin."""
+    with _lock:
+        _pins[session_id] = _pins.get(session_id, 0) + 1
+
+
+def unpin(session_id):
+    with _lock:
+        if _pins.get(session_id, 0) > 1:
+            _pins[session_id] -= 1
+        else:
+            _pins.pop(session_id, None)
+
+
+@contextmanager
+def pinned(session_id):
+    pin(session_id)
+    try:
+        yield
+    finally:
+        unpin(session_id)
+
+
+def restore_session(session_id, filepath, last_access):
+    """
+    Re-registers a session known from before a restart, in whichever tier its working file is.
+    Returns False if the working file is in neither.
+    """
+    cold_filepath = get_cold_filepath(session_id, filepath)
+    with _lock:
+        if not os.path.exists(filepath):
+            if not os.path.exists(cold_filepath):
+                return False
+            _cold[session_id] = (cold_filepath, os.path.getsize(cold_filepath))
+        _last_access[session_id] = last_access
+    return True
+
+
+def is_decoded(filepath):
+    """Whether open_image(filepath) would be served from the RAM tier, without decoding."""
+    try:
+        token = _file_token(filepath)
+    except OSError:
+        return False
+    with _lock:
+        entry = _decoded.get(_session_id_for(filepath))
+        return bool(entry and entry["filepath"] == filepath and entry["token"] == token)
+
+
+@contextmanager
+def open_image(filepath):
+    """
+    Yields the decoded working image, served from the RAM tier when it is still current.
+    Cached pixels are shared by concurrent requests: each gets its own read-only Image object
+    over them (Pillow operations return new images), which it can also save on its own.
+    """
+    session_id = _session_id_for(filepath)
+    token = _file_token(filepath) # Raises FileNotFoundError like Image.open would
+
+    with _lock:
+        entry = _decoded.get(session_id)
+        cached = entry and entry["filepath"] == filepath and entry["token"] == token
+        if cached:
+            _decoded.move_to_end(session_id)
+    if cached:
+        yield encoder.own_image(entry["image"])
+        return
+
+    if config.RAW_WORKING_IMAGES:
+        # Mapped, not decoded: only the pages of the rows the caller touches are read. These go
+        # through the OS page cache, so they aren't held in (or counted against) the RAM tier.
+        img = raw_image.open_mapped(filepath, token)
+        if img is not None:
+            with _lock:
+                _counters["raw_maps"] += 1
+            yield img
+            return
+
+    img = Image.open(filepath)
+    if getattr(img, 'is_animated', False):
+        # Multi-frame images keep their file-backed frame access; don't cache them
+        try:
+            yield img
+        finally:
+            img.close()
+        return
+
+    try:
+        img.load() # Single-frame images release the file handle once loaded
+    except Exception:
+        img.close()
+        raise
+    _write_raw(img, filepath, token)
+    if config.COMPUTE_PROCESSES:
+        # Kept in shared memory, so compute workers read the cached pixels in place
+        shared = pixel_buffers.share(img)
+        if shared is not None:
+            img.close()
+            img = shared
+    _cache_decoded(session_id, filepath, img, token, promotion=True)
+    yield encoder.own_image(img)
+
+
+def save_image(img, filepath, **save_kwargs):
+    """
+    Atomically writes img as the new working file and keeps its pixels in the RAM tier.
+    img may also be edited animation frames (services/animation.py), which are written but not cached.
+    """
+    if isinstance(img, animation.AnimatedFrames):
+        animation.save(img, filepath)
+        with _lock:
+            _drop_decoded(_session_id_for(filepath))
+        return
+    file_helpers.atomic_save_image(img, filepath, **save_kwargs)
+    token = _file_token(filepath)
+    _write_raw(img, filepath, token)
+    _cache_decoded(_session_id_for(filepath), filepath, img, token)
+
+
+def cache_image(img, filepath):
+    """
+    Puts already decoded pixels of filepath's current contents in the RAM tier (e.g. right after
+    an upload was verified), so the first edit doesn't decode the file again.
+    The image may be shared with other sessions; like every cached image it is never modified.
+    """
+    if getattr(img, 'is_animated', False):
+        return # Same rule as open_image
+    token = _file_token(filepath)
+    _write_raw(img, filepath, token)
+    _cache_decoded(_session_id_for(filepath), filepath, img, token)
+
+
+def _write_raw(img, filepath, token):
+    if not config.RAW_WORKING_IMAGES or not raw_image.is_supported(img):
+        return
+    try:
+        raw_image.write(img, filepath, token)
+    except OSError:
+        pass # Left stale (its token no longer matches); reads decode the working file instead
+
+
+def _cache_decoded(session_id, filepath, img, token, promotion=False):
+    global _decoded_bytes
+    nbytes = _image_nbytes(img)
+    quota = config.RESIDENCY_MEMORY_QUOTA_MB * 1024 * 1024
+    with _lock:
+        _drop_decoded(session_id)
+        if nbytes > quota:
+            return
+        _decoded[session_id] = {"image": img, "filepath": filepath, "token": token, "nbytes": nbytes}
+        _decoded_bytes += nbytes
+        if promotion:
+            _counters["promotions_to_ram"] += 1
+        # Over the memory quota: demote least recently used sessions to the disk tier
+        while _decoded_bytes > quota and len(_decoded) > 1:
+            oldest_id = next(iter(_decoded))
+            _drop_decoded(oldest_id)
+            _counters["demotions_from_ram"] += 1
+
+
+def _drop_decoded(session_id):
+    global _decoded_bytes
+    # Caller holds _lock
+    entry = _decoded.pop(session_id, None)
+    if entry:
+        _decoded_bytes -= entry["nbytes"]
+    return entry
+
+
+def _demote_to_cold(session_id, cutoff):
+    # Runs under the session lock, so no locked operation is using the working file. Requests use
+    # it outside the lock too: they pin the session first, and may have accessed it since it was
+    # found idle. Returns whether the session was demoted.
+    with _lock:
+        if _pins.get(session_id) or _last_access.get(session_id, 0) >= cutoff:
+            return False
+        entry = _drop_decoded(session_id)
+        if entry:
+            _counters["demotions_from_ram"] += 1
+        filepath = entry["filepath"] if entry else _find_hot_filepath(session_id)
+        if not filepath or not os.path.exists(filepath):
+            _last_access.pop(session_id, None) # Its file is gone: nothing left to demote or track
+            return False
+        cold_filepath = get_cold_filepath(session_id, filepath)
+        file_helpers.atomic_move(filepath, cold_filepath)
+        raw_image.remove(raw_image.raw_path_for(filepath)) # Rebuilt on the next decode
+        _cold[session_id] = (cold_filepath, os.path.getsize(cold_filepath))
+        _counters["demotions_to_cold"] += 1
+        return True
+
+
+def _find_hot_filepath(session_id):
+    shard_dir = file_helpers.get_shard_dir(config.WORKING_FOLDER, session_id)
+    if not os.path.isdir(shard_dir):
+        return None
+    for filename in os.listdir(shard_dir):
+        if filename.split('.')[0] == session_id and filename.count('.') == 1:
+            return os.path.join(shard_dir, filename)
+    return None
+
+
+def demote_idle_sessions():
+    """Scheduled job: moves sessions idle for RESIDENCY_IDLE_SECONDS to the cold tier."""
+    cutoff = time.time() - config.RESIDENCY_IDLE_SECONDS
+    with _lock:
+        idle_ids = [sid for sid, accessed in _last_access.items()
+                    if accessed < cutoff and sid not in _cold and not _pins.get(sid)]
+
+    demoted = 0
+    for session_id in idle_ids:
+        if session_locks.is_busy(session_id):
+            continue
+        try:
+            if session_locks.run_exclusive(session_id, 'demote', lambda: _demote_to_cold(session_id, cutoff), coalesce=False):
+                demoted += 1
+        except OSError:
+            pass
+    return demoted
+
+
+def forget(session_id, evicted=False):
+    """Drops all residency state for a session (its files are removed by the caller)."""
+    with _lock:
+        _drop_decoded(session_id)
+        _last_access.pop(session_id, None)
+        _cold.pop(session_id, None)
+        _pins.pop(session_id, None)
+        if evicted:
+            _counters["evictions"] += 1
+
+
+def get_session_ids():
+    """Ids of all sessions with residency state in this process."""
+    with _lock:
+        return list(_last_access)
+
+
+def get_cold_sessions_by_age():
+    """Returns [(last_access, session_id, cold_filepath, size_bytes)], least recently used first."""
+    with _lock:
+        return sorted(
+            (_last_access.get(sid, 0), sid, path, size) for sid, (path, size) in _cold.items()
+        )
+
+
+def get_stats():
+    with _lock:
+        cold_bytes = sum(size for _, size in _cold.values())
+        return {
+            "tiers": {
+                "ram": {
+                    "sessions": len(_decoded),
+                    "bytes": _decoded_bytes,
+                    "quota_bytes": config.RESIDENCY_MEMORY_QUOTA_MB * 1024 * 1024
+                },
+                "disk": {"sessions": len(_last_access) - len(_cold)},
+                "cold": {"sessions": len(_cold), "bytes": cold_bytes},
+                "disk_quota_bytes": config.RESIDENCY_DISK_QUOTA_MB * 1024 * 1024
+            },
+            **_counters
+        }
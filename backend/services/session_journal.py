@@ -0,0 +1,164 @@
+import os
+import json
+import time
+import sqlite3
+import logging
+import threading
+import config # Imports from backend/config.py
+
+# --- Session Journal ---
+# Durable copy of image_service.session_history in SQLite: one row per live session with its
+# working file, history blobs and current index, rewritten on every history change (upload,
+# edit, undo/redo) and deleted when the session expires.
+# In WAL mode each change is a sequential append to the write-ahead log; synchronous=NORMAL
+# skips the fsync per commit (a power cut can lose the last few changes, never corrupt the file).
+# At startup, image_service.restore_sessions() reads one row per active session, so restart time
+# follows the number of live sessions rather than the size of the temp directories.
+
+logger = logging.getLogger(__name__)
+
+BUSY_TIMEOUT_MS = 5000
+
+_connection = None
+_lock = threading.Lock()
+_stats = {"writes": 0, "write_errors": 0, "restored": 0, "dropped": 0}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    session_id TEXT PRIMARY KEY,
+    filepath TEXT NOT NULL,
+    history TEXT NOT NULL,        -- JSON list of version blob paths
+    current_index INTEGER NOT NULL,
+    updated REAL NOT NULL
+)
+"""
+
+
+def is_enabled():
+    return bool(config.SESSION_JOURNAL_PATH)
+
+
+def _connect():
+    # Caller holds _lock
+    global _connection
+    if _connection is None:
+        path = config.SESSION_JOURNAL_PATH
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        # Autocommit: every statement is its own transaction
+        connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute('PRAGMA synchronous=NORMAL')
+        connection.execute(f'PRAGMA busy_timeout={BUSY_TIMEOUT_MS}')
+        connection.execute(_SCHEMA)
+        _connection = connection
+    return _connection
+
+
+def _close():
+    # Caller holds _lock
+    global _connection
+    if _connection is not None:
+        try:
+            _connection.close()
+        except sqlite3.Error:
+            pass
+        _connection = None
+
+
+def record_session(session_id, filepath, history, current_index):
+    """Stores the session's current history. Failures are logged, never raised: editing goes on without the journal."""
+    if not is_enabled():
+        return
+    try:
+        with _lock:
+            _connect().execute(
+                'INSERT OR REPLACE INTO sessions (session_id, filepath, history, current_index, updated) VALUES (?, ?, ?, ?, ?)',
+                (session_id, filepath, json.dumps(history), current_index, time.time()))
+            _stats["writes"] += 1
+    except (sqlite3.Error, OSError) as e:
+        _stats["write_errors"] += 1
+        logger.warning(f"Session journal: could not record {session_id}: {e}")
+
+
+def forget_session(session_id):
+    if not is_enabled():
+        return
+    try:
+        with _lock:
+            _connect().execute('DELETE FROM sessions WHERE session_id = ?', (session_id,))
+            _stats["writes"] += 1
+    except (sqlite3.Error, OSError) as e:
+        _stats["write_errors"] += 1
+        logger.warning(f"Session journal: could not forget {session_id}: {e}")
+
+
+def load_sessions():
+    """
+    Returns [(session_id, filepath, history, current_index, updated)] for every journaled session.
+    An unreadable journal is moved aside and an empty one started.
+    """
+    if not is_enabled():
+        return []
+    with _lock:
+        try:
+            rows = _connect().execute(
+                'SELECT session_id, filepath, history, current_index, updated FROM sessions').fetchall()
+        except sqlite3.DatabaseError as e:
+            logger.error(f"Session journal {config.SESSION_JOURNAL_PATH} is unreadable ({e}); starting a new one.")
+            _close()
+            for suffix in ('', '-wal', '-shm'):
+                if os.path.exists(config.SESSION_JOURNAL_PATH + suffix):
+                    os.replace(config.SESSION_JOURNAL_PATH + suffix, f"{config.SESSION_JOURNAL_PATH}.corrupt{suffix}")
+            return []
+
+    sessions = []
+    for session_id, filepath, history, current_index, updated in rows:
+        try:
+            sessions.append((session_id, filepath, json.loads(history), int(current_index), updated))
+        except (ValueError, TypeError):
+            forget_session(session_id)
+    return sessions
+
+
+def load_session(session_id):
+    """Returns (filepath, history, current_index, updated) for one journaled session, or None."""
+    if not is_enabled():
+        return None
+    try:
+        with _lock:
+            row = _connect().execute(
+                'SELECT filepath, history, current_index, updated FROM sessions WHERE session_id = ?', (session_id,)).fetchone()
+        if not row:
+            return None
+        return row[0], json.loads(row[1]), int(row[2]), row[3]
+    except (sqlite3.Error, ValueError, TypeError) as e:
+        logger.warning(f"Session journal: could not load {session_id}: {e}")
+        return None
+
+
+def referenced_blobs():
+    """
+    Every version blob referenced by a journaled session. Other processes sharing VERSION_FOLDER
+    (see cluster.py) hold references this process can't see; the journal has them all.
+    Returns None if the journal can't be read, in which case nothing should be collected.
+    """
+    if not is_enabled():
+        return set()
+    try:
+        with _lock:
+            rows = _connect().execute('SELECT history FROM sessions').fetchall()
+        return {blob_path for (history,) in rows for blob_path in json.loads(history)}
+    except (sqlite3.Error, ValueError, TypeError) as e:
+        logger.warning(f"Session journal: could not list referenced versions: {e}")
+        return None
+
+
+def count_restore(restored, dropped):
+    with _lock:
+        _stats["restored"] += restored
+        _stats["dropped"] += dropped
+
+
+def get_stats():
+    with _lock:
+        return {"enabled": is_enabled(), **_stats}
@@ -0,0 +1,234 @@
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict, Counter
+from PIL import Image
+import config # Imports from backend/config.py
+from services import encoder
+from utils import file_helpers, memory_budget, cost_model, cancellation
+
+# --- Speculative Conversions ---
+# A download with ?format= re-encodes the working file, which for PNG or WebP can take longer than
+# the edit that produced it. Every new current version (upload, edit, undo, redo) is queued here,
+# and one low-priority background thread encodes it ahead of time in the formats the session is
+# likely to download next: the ones it downloaded before, its original format, then the Save As
+# default. convert_format serves a download of that version in that format from the result.
+# The thread waits while requests are running in this process, averages SPECULATION_CPU_PERCENT
+# of a core, and keeps at most SPECULATION_DISK_MB of files (least recently used go first).
+# Only plain conversions are precomputed; explicit quality and target sizes are always encoded.
+# (The edited image the frontend displays is the working file itself, written by the edit.)
+
+logger = logging.getLogger(__name__)
+
+BACKGROUND_NICENESS = 19
+IDLE_POLL_SECONDS = 0.05
+
+_condition = threading.Condition()
+_worker = None
+_pending = OrderedDict() # { session_id: (filepath, version_blob) }, newest version only
+_choices = {} # { session_id: Counter({(format, preset): downloads}) }
+# { (session_id, version_blob, format, preset): (path, size_bytes) }, least recently used first
+_files = OrderedDict()
+_disk_bytes = 0
+_stats = {
+    "scheduled": 0, "superseded": 0, "encoded": 0, "skipped_cost": 0, "failed": 0,
+    "evicted": 0, "hits": 0, "misses": 0, "cpu_seconds": 0.0
+}
+
+
+def _enabled():
+    return config.SPECULATION_CPU_PERCENT > 0 and config.SPECULATION_DISK_MB > 0
+
+
+def _file_format(path):
+    try:
+        return encoder.normalize_format(os.path.splitext(path)[1].lstrip('.'))
+    except ValueError:
+        return None
+
+
+def schedule(session_id, filepath, version_blob):
+    """Queues the session's new current version (version_blob, now at filepath) for precomputing."""
+    global _worker
+    if not version_blob or not _enabled():
+        return
+    with _condition:
+        if session_id in _pending:
+            _stats["superseded"] += 1
+            del _pending[session_id]
+        _pending[session_id] = (filepath, version_blob)
+        _stats["scheduled"] += 1
+        if _worker is None:
+            _worker = threading.Thread(target=_work, name='speculation', daemon=True)
+            _worker.start()
+        _condition.notify()
+
+
+def record_download(session_id, target_format, preset=None):
+    """Remembers a ?format= download, so the session's next versions are precomputed in that format."""
+    try:
+        extension = encoder.normalize_format(target_format)
+    except ValueError:
+        return
+    with _condition:
+        _choices.setdefault(session_id, Counter())[(extension, preset)] += 1
+
+
+def lookup(session_id, version_blob, target_format, preset=None):
+    """Path of the precomputed conversion of version_blob, or None."""
+    if not version_blob:
+        return None
+    try:
+        key = (session_id, version_blob, encoder.normalize_format(target_format), preset)
+    except ValueError:
+        return None
+    with _condition:
+        entry = _files.get(key)
+        if entry and os.path.exists(entry[0]):
+            _files.move_to_end(key)
+            _stats["hits"] += 1
+            return entry[0]
+        if entry:
+            _drop_file(key) # Deleted by the cleanup job
+        _stats["misses"] += 1
+        return None
+
+
+def forget(session_id):
+    """Drops a session's queued work, download choices and precomputed files."""
+    with _condition:
+        _pending.pop(session_id, None)
+        _choices.pop(session_id, None)
+        for key in [key for key in _files if key[0] == session_id]:
+            _remove_file(key)
+
+
+def _candidates(session_id, filepath):
+    # Most downloaded first, then the upload's own format, then the Save As default
+    with _condition:
+        choices = [choice for choice, _ in _choices.get(session_id, Counter()).most_common()]
+    choices += [(_file_format(filepath), None), (config.SPECULATION_DEFAULT_FORMAT, None)]
+    candidates = []
+    for extension, preset in choices:
+        if extension and (extension, preset) not in candidates:
+            candidates.append((extension, preset))
+    return candidates[:config.SPECULATION_FORMATS]
+
+
+def _lower_priority():
+    # On Linux a thread id is accepted as a process id and renices just this thread
+    try:
+        os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), BACKGROUND_NICENESS)
+    except (AttributeError, OSError):
+        pass
+
+
+def _wait_for_idle():
+    # Requests mark themselves running (app.py); background work only starts in the gaps between them
+    while cancellation.idle_seconds() < config.SPECULATION_IDLE_SECONDS:
+        time.sleep(IDLE_POLL_SECONDS)
+
+
+def _work():
+    _lower_priority()
+    while True:
+        with _condition:
+            while not _pending:
+                _condition.wait()
+            session_id, (filepath, version_blob) = _pending.popitem(last=False)
+
+        for extension, preset in _candidates(session_id, filepath):
+            _wait_for_idle()
+            with _condition:
+                if session_id in _pending:
+                    break # Edited again meanwhile: this version is unlikely to be downloaded
+            cpu_started = time.thread_time()
+            try:
+                _speculate(session_id, filepath, version_blob, extension, preset)
+            except Exception as e:
+                with _condition:
+                    _stats["failed"] += 1
+                logger.warning(f"Speculation: {extension} for {session_id} failed: {e}")
+            cpu_seconds = time.thread_time() - cpu_started
+            with _condition:
+                _stats["cpu_seconds"] += cpu_seconds
+            # Resting in proportion to the work done keeps the average within the CPU budget
+            time.sleep(cpu_seconds * (100 - config.SPECULATION_CPU_PERCENT) / config.SPECULATION_CPU_PERCENT)
+
+
+def _speculate(session_id, filepath, version_blob, extension, preset):
+    key = (session_id, version_blob, extension, preset)
+    with _condition:
+        if key in _files:
+            return
+    geometry = memory_budget.image_geometry(version_blob)
+    if geometry is None:
+        return # Released since it was queued
+    width, height, mode, frames = geometry
+    megapixels = width * height * frames / 1e6
+    seconds = cost_model.work_seconds(
+        [(f'decode-{_file_format(version_blob)}', megapixels), (f'encode-{extension}', megapixels)], mode)
+    if seconds > config.SPECULATION_MAX_SECONDS:
+        with _condition:
+            _stats["skipped_cost"] += 1
+        return
+
+    try:
+        data = _encode(version_blob, extension, preset)
+    except memory_budget.MemoryLimitExceeded:
+        return # Foreground operations need the room more
+    digest = os.path.splitext(os.path.basename(version_blob))[0]
+    path = os.path.join(os.path.dirname(filepath), f"{session_id}_speculative_{digest[:16]}_{preset or 'default'}.{extension}")
+    file_helpers.atomic_write_bytes(path, data)
+    _add_file(key, path, len(data))
+
+
+@memory_budget.tracked('convert')
+def _encode(filepath, target_format, preset=None):
+    # Version blobs never change, unlike the working file, so what's encoded is what the key says
+    with Image.open(filepath) as img:
+        data, _ = encoder.encode_image(img, target_format, preset=preset)
+    return data
+
+
+def _add_file(key, path, size_bytes):
+    global _disk_bytes
+    limit = config.SPECULATION_DISK_MB * 1024 * 1024
+    with _condition:
+        _files[key] = (path, size_bytes)
+        _disk_bytes += size_bytes
+        _stats["encoded"] += 1
+        while _disk_bytes > limit and _files:
+            _remove_file(next(iter(_files)))
+            _stats["evicted"] += 1
+
+
+def _drop_file(key):
+    global _disk_bytes
+    # Caller holds _condition
+    path, size_bytes = _files.pop(key)
+    _disk_bytes -= size_bytes
+    return path
+
+
+def _remove_file(key):
+    # Caller holds _condition
+    path = _drop_file(key)
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def get_stats():
+    with _condition:
+        return {
+            "enabled": _enabled(),
+            "pending": len(_pending),
+            "files": len(_files),
+            "disk_bytes": _disk_bytes,
+            "disk_limit_bytes": config.SPECULATION_DISK_MB * 1024 * 1024,
+            **_stats,
+            "cpu_seconds": round(_stats["cpu_seconds"], 3)
+        }
@@ -0,0 +1,235 @@
+import io
+import os
+import time
+import hashlib
+import threading
+from PIL import Image, UnidentifiedImageError
+from werkzeug.utils import secure_filename
+import config # Imports from backend/config.py
+from services import image_service
+from utils import file_helpers, affinity
+
+# --- Resumable Uploads ---
+# tus-style uploads: create an upload for a declared length, append chunks at the current offset,
+# then finalize. After a dropped connection the client asks for the offset and continues from there.
+# Chunks are streamed from the request straight onto "<session file>.part" in the session's shard
+# directory and SHA-256 hashed as they arrive; finalize renames the file into place and hands the
+# digest to the version store, so a finished upload is neither copied nor read again for hashing.
+# The content is checked as soon as its first bytes arrive (magic number), and its header
+# (format, dimensions, decompression bomb limit) as soon as enough bytes are there to parse it.
+# { upload_id: { "filename", "extension", "length", "offset", "sha256", "hasher", "head",
+#                "format", "dimensions", "part_path", "filepath", "created", "updated", "lock" } }
+# The upload id becomes the image session id once finalized.
+_uploads = {}
+_lock = threading.Lock()
+
+# Leading bytes of the formats accepted for ALLOWED_EXTENSIONS
+MAGIC_NUMBERS = {
+    'PNG': b'\x89PNG\r\n\x1a\n',
+    'JPEG': b'\xff\xd8\xff',
+    'GIF': b'GIF8',
+    'WEBP': b'RIFF', # Followed by the size and 'WEBP'; Pillow checks the rest
+}
+MAGIC_MAX_LENGTH = max(len(magic) for magic in MAGIC_NUMBERS.values())
+
+
+class UploadOffsetMismatch(Exception):
+    """Raised when a chunk doesn't start at the upload's current offset."""
+    def __init__(self, message, offset):
+        super().__init__(message)
+        self.offset = offset
+
+
+def create_upload(filename, length, sha256=None):
+    """
+    Starts a resumable upload of length bytes and returns its status.
+    sha256: optional hex digest of the whole file, checked on finalize.
+    Raises ValueError for disallowed names or sizes.
+    """
+    if not filename or not image_service.allowed_file(filename):
+        raise ValueError(f"File type not allowed. Allowed: {', '.join(config.ALLOWED_EXTENSIONS)}")
+    try:
+        length = int(length)
+    except (TypeError, ValueError):
+        raise ValueError("Upload length must be an integer number of bytes.")
+    if length <= 0:
+        raise ValueError("Upload length must be positive.")
+    if length > config.MAX_CONTENT_LENGTH:
+        raise ValueError(f"File exceeds {config.MAX_FILE_SIZE_MB}MB limit")
+    if sha256 is not None:
+        sha256 = str(sha256).lower()
+        if len(sha256) != 64 or any(c not in '0123456789abcdef' for c in sha256):
+            raise ValueError("'sha256' must be a hex SHA-256 digest.")
+
+    original_filename = secure_filename(filename)
+    extension = original_filename.rsplit('.', 1)[1].lower()
+    upload_id = affinity.new_id() # Becomes the session id, so this process must own it
+    # Not get_temp_filepath: there's no session (residency, journal) to look up until finalize
+    filepath = os.path.join(file_helpers.get_shard_dir(config.WORKING_FOLDER, upload_id),
+                            image_service.get_session_filename(upload_id, extension))
+    part_path = f"{filepath}.part"
+    os.makedirs(os.path.dirname(part_path), exist_ok=True)
+    open(part_path, 'wb').close()
+
+    now = time.time()
+    upload = {
+        "filename": original_filename,
+        "extension": extension,
+        "length": length,
+        "offset": 0,
+        "sha256": sha256,
+        "hasher": hashlib.sha256(),
+        "head": b'', # First bytes, kept for header checks
+        "format": None,
+        "dimensions": None,
+        "part_path": part_path,
+        "filepath": filepath,
+        "created": now,
+        "updated": now,
+        "lock": threading.Lock()
+    }
+    with _lock:
+        _uploads[upload_id] = upload
+    return _public_status(upload_id, upload)
+
+
+def _public_status(upload_id, upload):
+    return {
+        "upload_id": upload_id,
+        "filename": upload["filename"],
+        "length": upload["length"],
+        "offset": upload["offset"],
+        "complete": upload["offset"] == upload["length"],
+        "format": upload["format"],
+        "dimensions": upload["dimensions"]
+    }
+
+
+def get_upload_status(upload_id):
+    """Returns the upload's status, or None if it doesn't exist (or expired)."""
+    upload = _uploads.get(upload_id)
+    if not upload:
+        return None
+    return _public_status(upload_id, upload)
+
+
+def _discard(upload_id):
+    with _lock:
+        upload = _uploads.pop(upload_id, None)
+    if upload and os.path.exists(upload["part_path"]):
+        try:
+            os.remove(upload["part_path"])
+        except OSError:
+            pass
+
+
+def _check_header(upload_id, upload):
+    """Validates the leading bytes; raises ValueError (and discards the upload) for content that can't be an image."""
+    head = upload["head"]
+    complete = upload["offset"] == upload["length"]
+
+    if upload["format"] is None and (len(head) >= MAGIC_MAX_LENGTH or complete):
+        if not any(head.startswith(magic) for magic in MAGIC_NUMBERS.values()):
+            _discard(upload_id)
+            raise ValueError(f"Uploaded file '{upload['filename']}' is not a valid image or format is unsupported.")
+
+    if upload["dimensions"] is not None:
+        return
+    try:
+        with Image.open(io.BytesIO(head)) as img:
+            upload["format"] = img.format
+            upload["dimensions"] = {"width": img.width, "height": img.height}
+    except Image.DecompressionBombError as e:
+        _discard(upload_id)
+        raise ValueError(f"Uploaded image is too large: {e}")
+    except (UnidentifiedImageError, OSError, SyntaxError):
+        # Most likely just not enough bytes yet for the header
+        if len(head) >= config.UPLOAD_HEADER_PROBE_BYTES or complete:
+            _discard(upload_id)
+            raise ValueError(f"Uploaded file '{upload['filename']}' is not a valid image or format is unsupported.")
+
+
+def append_chunk(upload_id, offset, stream):
+    """
+    Appends the bytes read from stream at offset and returns the upload's status, or None if the
+    upload doesn't exist. Bytes that arrived before a dropped connection are kept, so the client
+    can resume from the reported offset.
+    Raises UploadOffsetMismatch if offset isn't the current offset, ValueError for invalid content.
+    """
+    upload = _uploads.get(upload_id)
+    if not upload:
+        return None
+
+    with upload["lock"]:
+        if upload_id not in _uploads:
+            return None # Discarded while we waited
+        if offset != upload["offset"]:
+            raise UploadOffsetMismatch(f"Chunk offset {offset} doesn't match the upload offset {upload['offset']}.", upload["offset"])
+
+        try:
+            with open(upload["part_path"], 'ab') as f:
+                while True:
+                    data = stream.read(config.UPLOAD_READ_BYTES)
+                    if not data:
+                        break
+                    if upload["offset"] + len(data) > upload["length"]:
+                        raise ValueError(f"Chunk goes past the declared upload length of {upload['length']} bytes.")
+                    f.write(data)
+                    upload["hasher"].update(data)
+                    upload["offset"] += len(data)
+                    if upload["dimensions"] is None:
+                        if len(upload["head"]) < config.UPLOAD_HEADER_PROBE_BYTES:
+                            upload["head"] += data[:config.UPLOAD_HEADER_PROBE_BYTES - len(upload["head"])]
+                        _check_header(upload_id, upload)
+        finally:
+            upload["updated"] = time.time()
+        if upload["dimensions"] is not None:
+            upload["head"] = b''
+        return _public_status(upload_id, upload)
+
+
+def finalize_upload(upload_id):
+    """
+    Moves a complete upload into place as a new session and returns the same data as
+    image_service.save_uploaded_file, or None if the upload doesn't exist.
+    Raises ValueError if bytes are missing or the checksum doesn't match, UnidentifiedImageError for bad images.
+    """
+    upload = _uploads.get(upload_id)
+    if not upload:
+        return None
+
+    with upload["lock"]:
+        if upload_id not in _uploads:
+            return None
+        if upload["offset"] != upload["length"]:
+            raise ValueError(f"Upload is incomplete: {upload['offset']} of {upload['length']} bytes received.")
+        digest = upload["hasher"].hexdigest()
+        if upload["sha256"] and digest != upload["sha256"]:
+            _discard(upload_id)
+            raise ValueError("Uploaded data doesn't match the declared SHA-256 checksum.")
+
+        with _lock:
+            _uploads.pop(upload_id, None)
+        file_helpers.replace_file(upload["part_path"], upload["filepath"])
+    return image_service.register_uploaded_file(
+        upload_id, upload["filepath"], upload["filename"], upload["extension"], digest=digest)
+
+
+def abort_upload(upload_id):
+    """Discards an unfinished upload. Returns False if it doesn't exist."""
+    upload = _uploads.get(upload_id)
+    if not upload:
+        return False
+    with upload["lock"]:
+        _discard(upload_id)
+    return True
+
+
+def prune_uploads(max_age_seconds):
+    """Discards uploads that received no data for max_age_seconds, with their partial files."""
+    cutoff = time.time() - max_age_seconds
+    with _lock:
+        expired = [upload_id for upload_id, upload in _uploads.items() if upload["updated"] < cutoff]
+    for upload_id in expired:
+        _discard(upload_id)
+    return len(expired)
@@ -0,0 +1,196 @@
+import os
+import time
+import hashlib
+import threading
+import weakref
+from collections import OrderedDict
+import config # Imports from backend/config.py
+from utils import file_helpers
+from services import session_journal
+
+# --- Content-Addressed Version Storage ---
+# History versions are stored once per distinct content, named by their SHA-256 digest.
+# Flip-twice, undo-then-reapply and identical re-uploads all end up pointing at the same blob.
+# { blob_path: refcount }
+_blob_refs = {}
+# { blob_path: time the last reference was released } - collected by the cleanup job
+_unreferenced = {}
+_lock = threading.Lock()
+
+# --- Ingest Index ---
+# Uploaded originals by digest, with the metadata from their verification and a weak reference
+# to their decoded pixels while some session still holds them. A repeat upload of the same bytes
+# (new tab, expired session) reuses all three instead of copying, verifying and decoding again.
+# Indexed originals outlive their sessions by INGEST_RETENTION_SECONDS.
+# { digest: {"blob_path", "metadata", "image": weakref to a decoded Image or None, "ingested": time} }
+_ingested = OrderedDict()
+_ingest_stats = {"hits": 0, "misses": 0}
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def hash_file(filepath):
+    """Returns the hex SHA-256 digest of the file's contents."""
+    digest = hashlib.sha256()
+    with open(filepath, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def get_blob_path(digest, ext):
+    shard_dir = file_helpers.get_shard_dir(config.VERSION_FOLDER, digest)
+    return os.path.join(shard_dir, f"{digest}{ext.lower()}")
+
+
+def store_version(filepath, digest=None):
+    """
+    Stores the current contents of filepath as a version blob and takes a reference to it.
+    Only writes to disk if no blob with the same content exists yet.
+    digest: the file's SHA-256 if the caller already computed it (e.g. while receiving it).
+    Returns the blob path to keep in the session history.
+    """
+    _, ext = os.path.splitext(filepath)
+    blob_path = get_blob_path(digest or hash_file(filepath), ext)
+
+    with _lock:
+        if os.path.exists(blob_path):
+            # Keep the blob fresh so on-disk orphan collection doesn't pick it up
+            try:
+                os.utime(blob_path, None)
+            except OSError:
+                pass
+        else:
+            # Working files are only ever replaced, never rewritten, so the blob can share their bytes
+            file_helpers.atomic_link(filepath, blob_path)
+
+        _blob_refs[blob_path] = _blob_refs.get(blob_path, 0) + 1
+        _unreferenced.pop(blob_path, None)
+
+    return blob_path
+
+
+def adopt_version(blob_path):
+    """Takes a reference to an existing blob, e.g. for a session history restored after a restart."""
+    with _lock:
+        _blob_refs[blob_path] = _blob_refs.get(blob_path, 0) + 1
+        _unreferenced.pop(blob_path, None)
+
+
+def release_version(blob_path):
+    """
+    Drops one reference to a version blob.
+    The blob itself is only deleted by collect_garbage() once nothing references it.
+    """
+    with _lock:
+        count = _blob_refs.get(blob_path, 0) - 1
+        if count > 0:
+            _blob_refs[blob_path] = count
+        else:
+            _blob_refs.pop(blob_path, None)
+            _unreferenced[blob_path] = time.time()
+
+
+def restore_version(blob_path, filepath):
+    """Puts a version blob back as the session's working file."""
+    # The link gets a fresh mtime, so the cleanup job treats the session as active
+    file_helpers.atomic_link(blob_path, filepath)
+
+
+def remember_ingest(digest, blob_path, metadata, img=None):
+    """Records a verified upload: its blob, its metadata and optionally its decoded image."""
+    with _lock:
+        _ingested.pop(digest, None)
+        _ingested[digest] = {
+            "blob_path": blob_path,
+            "metadata": dict(metadata),
+            "image": weakref.ref(img) if img is not None else None,
+            "ingested": time.time()
+        }
+        while len(_ingested) > config.INGEST_INDEX_MAX_ENTRIES:
+            _ingested.popitem(last=False)
+
+
+def lookup_ingest(digest):
+    """
+    Returns {"blob_path", "metadata", "image"} for a previously verified upload with this digest,
+    or None. "image" is the decoded original if it is still in memory, else None.
+    """
+    with _lock:
+        entry = _ingested.get(digest)
+        if entry and not os.path.exists(entry["blob_path"]):
+            del _ingested[digest]
+            entry = None
+        if not entry:
+            _ingest_stats["misses"] += 1
+            return None
+        _ingest_stats["hits"] += 1
+        entry["ingested"] = time.time()
+        _ingested.move_to_end(digest)
+        return {
+            "blob_path": entry["blob_path"],
+            "metadata": dict(entry["metadata"]),
+            "image": entry["image"]() if entry["image"] else None
+        }
+
+
+def get_stats():
+    with _lock:
+        return {
+            "blobs_referenced": len(_blob_refs),
+            "references": sum(_blob_refs.values()),
+            "blobs_unreferenced": len(_unreferenced),
+            "ingest_index_entries": len(_ingested),
+            "ingest_hits": _ingest_stats["hits"],
+            "ingest_misses": _ingest_stats["misses"]
+        }
+
+
+def collect_garbage(max_age_seconds):
+    """
+    Deletes blobs that no session/version references any more.
+    Blobs found on disk that were never registered in this process (e.g. left over from a
+    restart) are only deleted once they are older than max_age_seconds. Blobs in the session
+    journal are kept, since another backend process may hold them.
+    Returns (deleted_count, error_count).
+    """
+    deleted = 0
+    errors = 0
+
+    journaled = session_journal.referenced_blobs()
+    if journaled is None:
+        return deleted, errors
+
+    with _lock:
+        # Recently uploaded originals stay available for repeat uploads
+        retention_cutoff = time.time() - config.INGEST_RETENTION_SECONDS
+        retained = {entry["blob_path"] for entry in _ingested.values() if entry["ingested"] > retention_cutoff}
+        candidates = [path for path in _unreferenced if path not in retained]
+        for blob_path in candidates:
+            del _unreferenced[blob_path]
+        referenced = set(_blob_refs.keys()) | retained | journaled
+
+    now = time.time()
+    pending = set(candidates)
+    for entry in file_helpers.iter_files(config.VERSION_FOLDER):
+        if entry.path in referenced or entry.path in pending:
+            continue
+        try:
+            if now - entry.stat().st_mtime > max_age_seconds:
+                candidates.append(entry.path)
+        except OSError:
+            pass
+
+    for blob_path in candidates:
+        with _lock:
+            # A new reference may have been taken since we looked
+            if blob_path in _blob_refs or blob_path in journaled:
+                continue
+            try:
+                if os.path.exists(blob_path):
+                    os.remove(blob_path)
+                    deleted += 1
+            except OSError:
+                errors += 1
+
+    return deleted, errors
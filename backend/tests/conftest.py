@@ -0,0 +1,56 @@
+import io
+import os
+import sys
+import pytest
+from PIL import Image, ImageFilter
+
+# The backend's modules import each other from the backend folder (config, services, utils)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import config # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def storage(tmp_path, monkeypatch):
+    """Empty storage folders per test, and no session journal unless a test sets one."""
+    monkeypatch.setattr(config, 'TEMP_FOLDER', str(tmp_path))
+    monkeypatch.setattr(config, 'WORKING_FOLDER', str(tmp_path / 'sessions'))
+    monkeypatch.setattr(config, 'VERSION_FOLDER', str(tmp_path / 'versions'))
+    monkeypatch.setattr(config, 'COLD_FOLDER', str(tmp_path / 'cold'))
+    monkeypatch.setattr(config, 'SESSION_JOURNAL_PATH', '')
+    monkeypatch.setattr(config, 'SPECULATION_CPU_PERCENT', 0) # No background encodes racing the tests
+    return tmp_path
+
+
+def make_photo(width=480, height=360, seed=40):
+    """Photo-like RGB image (gradient + texture), so lossy encoders' output depends on quality."""
+    base = Image.linear_gradient('L').resize((width, height)).convert('RGB')
+    texture = Image.effect_noise((width, height), seed).convert('RGB')
+    return Image.blend(base, texture, 0.35).filter(ImageFilter.SMOOTH)
+
+
+def encoded_bytes(img, pillow_format, **options):
+    """img saved by this thread alone, on a fresh copy: the reference for what an encode should return."""
+    buffer = io.BytesIO()
+    img.copy().save(buffer, format=pillow_format, **options)
+    return buffer.getvalue()
+
+
+@pytest.fixture
+def slow_saves(monkeypatch):
+    """
+    Widens the window between Image.save attaching its options and the format's writer reading
+    them, so races between threads saving one image object show up on any machine.
+    Returns a function installing the delay for a Pillow format name.
+    """
+    import time
+    Image.init()
+
+    def install(pillow_format, seconds=0.005):
+        original = Image.SAVE[pillow_format]
+
+        def slow(im, fp, filename):
+            time.sleep(seconds)
+            return original(im, fp, filename)
+        monkeypatch.setitem(Image.SAVE, pillow_format, slow)
+    return install
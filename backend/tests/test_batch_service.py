@@ -0,0 +1,59 @@
+import io
+import os
+import pytest
+import config
+from werkzeug.datastructures import FileStorage
+from services import batch_service, image_service
+from utils import file_helpers
+from conftest import make_photo, encoded_bytes
+
+
+def _upload(filename, data):
+    return FileStorage(stream=io.BytesIO(data), filename=filename)
+
+
+def _working_files():
+    return sorted(entry.name for entry in file_helpers.iter_files(config.WORKING_FOLDER))
+
+
+def test_invalid_file_removes_the_ones_staged_before_it():
+    photo = encoded_bytes(make_photo(64, 48), 'PNG')
+    files = [_upload('a.png', photo), _upload('b.png', photo), _upload('notes.txt', b'text')]
+    with pytest.raises(ValueError):
+        batch_service.create_batch(files, [], [{"op": "grayscale", "params": {"intensity": 100}}])
+    assert _working_files() == []
+
+
+def test_invalid_session_entry_removes_staged_uploads():
+    files = [_upload('a.png', encoded_bytes(make_photo(64, 48), 'PNG'))]
+    with pytest.raises(ValueError):
+        batch_service.create_batch(files, [{"image_session_id": "no-extension"}],
+                                   [{"op": "grayscale", "params": {"intensity": 100}}])
+    assert _working_files() == []
+
+
+def test_every_conversion_gets_its_own_file():
+    session_id = 'conversions-test'
+    filepath = image_service.get_temp_filepath(session_id, 'png')
+    os.makedirs(os.path.dirname(filepath), exist_ok=True)
+    make_photo(120, 90).save(filepath)
+
+    small = image_service.convert_format(filepath, 'jpeg', quality=10)
+    large = image_service.convert_format(filepath, 'jpeg', quality=95)
+    assert small != large
+    assert os.path.getsize(small) < os.path.getsize(large)
+
+
+def test_download_conversion_is_removed_once_sent():
+    from app import create_app
+    session_id = 'download-test'
+    filepath = image_service.get_temp_filepath(session_id, 'png')
+    os.makedirs(os.path.dirname(filepath), exist_ok=True)
+    make_photo(120, 90).save(filepath)
+
+    client = create_app(worker_setup=False).test_client()
+    response = client.get(f"/api/download/{session_id}/png?format=jpeg")
+    assert response.status_code == 200
+    assert response.get_data()[:2] == b'\xff\xd8'
+    response.close()
+    assert _working_files() == [os.path.basename(filepath)]
@@ -0,0 +1,119 @@
+import io
+import time
+import pytest
+import config
+from PIL import Image
+from werkzeug.datastructures import FileStorage
+from services import image_service, animation, residency
+from utils import cancellation, memory_budget
+from conftest import make_photo, encoded_bytes
+
+MB = 1024 * 1024
+
+
+def _remaining(img):
+    # Stands in for an edit; reports the deadline it runs under
+    return cancellation.remaining_seconds()
+
+
+def test_handed_off_work_keeps_the_callers_deadline():
+    with cancellation.continued('frame', 30):
+        assert 29 < cancellation.remaining_seconds() <= 30
+    with cancellation.continued('frame', None):
+        assert cancellation.is_active() and cancellation.remaining_seconds() is None
+    # Out of time already: not the same as no deadline
+    with pytest.raises(cancellation.DeadlineExceeded):
+        with cancellation.continued('frame', 0.0):
+            pass
+
+
+def test_frames_of_an_expired_request_are_not_edited():
+    frame = make_photo(40, 30)
+    with pytest.raises(cancellation.DeadlineExceeded):
+        animation._edit_frame(_remaining, frame, (), {}, 0.0, True, False)
+    assert animation._edit_frame(_remaining, frame, (), {}, None, True, False) is None
+
+
+@pytest.fixture
+def held_memory(monkeypatch):
+    """All of the worker limit reserved by an operation in flight."""
+    monkeypatch.setattr(config, 'MEMORY_WORKER_LIMIT_MB', 1)
+    with memory_budget.reserve('resize', MB):
+        yield
+
+
+@pytest.mark.parametrize('probe, deadline_seconds, error', [
+    (lambda: True, 30, cancellation.ClientDisconnected),
+    (None, 0.3, cancellation.DeadlineExceeded),
+])
+def test_waiting_for_memory_stops_when_the_request_is_abandoned(held_memory, probe, deadline_seconds, error):
+    started = time.monotonic()
+    with cancellation.scope('resize', probe, deadline_seconds):
+        with pytest.raises(error):
+            with memory_budget.reserve('resize', MB):
+                pass
+    assert time.monotonic() - started < config.MEMORY_WAIT_SECONDS / 2
+    assert memory_budget.get_stats()["reserved_bytes"] == MB # Only the one still running
+
+
+# --- Routes ---
+
+@pytest.fixture
+def session():
+    from app import create_app
+    upload = image_service.save_uploaded_file(
+        FileStorage(stream=io.BytesIO(encoded_bytes(make_photo(120, 90), 'PNG')), filename='photo.png'))
+    session_id = upload["image_session_id"]
+    filepath = image_service.get_temp_filepath(session_id, 'png')
+    yield create_app(worker_setup=False).test_client(), session_id, filepath
+    image_service.expire_session(session_id)
+    residency.forget(session_id)
+
+
+def _unchanged(session_id, filepath, before):
+    with open(filepath, 'rb') as f:
+        assert f.read() == before
+    assert image_service.get_history_status(session_id) == {"can_undo": False, "can_redo": False}
+
+
+def test_edit_past_its_deadline_answers_504_and_changes_nothing(session, monkeypatch):
+    client, session_id, filepath = session
+    with open(filepath, 'rb') as f:
+        before = f.read()
+    monkeypatch.setitem(config.OPERATION_DEADLINES_SECONDS, 'rotate', 0.2)
+
+    def slow_rotate(img, angle):
+        time.sleep(0.3)
+        return img.transpose(Image.Transpose.ROTATE_270)
+    monkeypatch.setattr(image_service, 'apply_rotate', slow_rotate)
+
+    response = client.post(f'/api/process/{session_id}/png/rotate', json={"angle": 90})
+    assert response.status_code == 504
+    assert response.get_json()["reason"] == 'deadline'
+    _unchanged(session_id, filepath, before)
+
+
+def test_edit_for_a_client_that_left_answers_499(session):
+    client, session_id, filepath = session
+    with open(filepath, 'rb') as f:
+        before = f.read()
+
+    response = client.post(f'/api/process/{session_id}/png/rotate', json={"angle": 90},
+                           environ_base={'haguma.disconnect_probe': lambda: True})
+    assert response.status_code == 499
+    assert response.get_json() == {"error": "Client disconnected; 'rotate' was cancelled.",
+                                   "cancelled": True, "reason": 'disconnected'}
+    _unchanged(session_id, filepath, before)
+
+
+def test_cancellation_passes_through_the_services_error_handling(session):
+    _, session_id, filepath = session
+    # process_* wrap unexpected errors in RuntimeError; an abandoned request must not become one
+    with cancellation.scope('rotate', lambda: True):
+        with pytest.raises(cancellation.ClientDisconnected):
+            image_service.process_rotate(filepath, 90)
+    with cancellation.scope('brightness', deadline_seconds=0.01):
+        time.sleep(0.02)
+        with pytest.raises(cancellation.DeadlineExceeded):
+            image_service.process_brightness(filepath, 20)
+    assert image_service.get_history_status(session_id) == {"can_undo": False, "can_redo": False}
@@ -0,0 +1,45 @@
+import os
+import time
+import pytest
+from services import image_service
+from utils import affinity, cleanup
+
+
+@pytest.fixture
+def two_node_ring(monkeypatch):
+    monkeypatch.setenv('HAGUMA_NODE_ID', 'node-a')
+    affinity.set_ring(['node-a', 'node-b'])
+    yield
+    affinity._ring = None
+
+
+def _old_working_file(session_id):
+    filepath = image_service.get_temp_filepath(session_id, 'png')
+    os.makedirs(os.path.dirname(filepath), exist_ok=True)
+    with open(filepath, 'wb') as f:
+        f.write(b'stale')
+    expired_at = time.time() - 2 * 3600
+    os.utime(filepath, (expired_at, expired_at))
+    return filepath
+
+
+def test_cleanup_only_expires_sessions_this_process_owns(two_node_ring, monkeypatch):
+    owned = affinity.new_id()
+    foreign = next(candidate for candidate in (f"session-{i}" for i in range(100))
+                   if affinity._ring.owner(candidate) == 'node-b')
+    owned_path, foreign_path = _old_working_file(owned), _old_working_file(foreign)
+    expired = []
+    monkeypatch.setattr(image_service, 'expire_session', expired.append)
+
+    cleanup.run_cleanup()
+
+    assert not os.path.exists(owned_path)
+    assert os.path.exists(foreign_path) # Left to node-b, which holds its history
+    assert expired == [owned]
+
+
+def test_owner_key_of_derived_files():
+    session_id = '3f2a6c1e-0b1d-4c8e-9a57-2f1d3c4b5a69'
+    for filename in (f"{session_id}.png", f"{session_id}_converted.webp",
+                     f"{session_id}_speculative_ab12_default.jpeg", f"{session_id}_3.upload"):
+        assert cleanup._owner_key(filename) == session_id
@@ -0,0 +1,157 @@
+import json
+import time
+import threading
+import argparse
+import urllib.error
+import urllib.request
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+import config
+import cluster
+from utils import affinity
+from utils.affinity import HashRing
+
+
+def test_ring_moves_about_one_nth_of_the_keys():
+    keys = [f"key-{i}" for i in range(4000)]
+    three = HashRing(['node-0', 'node-1', 'node-2'])
+    four = HashRing(['node-0', 'node-1', 'node-2', 'node-3'])
+
+    owners = Counter(three.owner(key) for key in keys)
+    assert all(900 < count < 1800 for count in owners.values())
+    moved = [key for key in keys if three.owner(key) != four.owner(key)]
+    assert all(four.owner(key) == 'node-3' for key in moved) # Only onto the new member
+    assert 600 < len(moved) < 1400
+
+
+@pytest.fixture
+def member_of_ring(monkeypatch):
+    monkeypatch.setenv('HAGUMA_NODE_ID', 'node-1')
+    affinity.set_ring(['node-0', 'node-1', 'node-2'])
+    yield
+    affinity._ring = None
+
+
+def test_new_ids_are_owned_by_this_process(member_of_ring):
+    ring = HashRing(['node-0', 'node-1', 'node-2'])
+    assert all(ring.owner(affinity.new_id()) == 'node-1' for _ in range(50))
+
+
+def test_ring_without_this_process_is_refused(monkeypatch):
+    monkeypatch.setenv('HAGUMA_NODE_ID', 'node-9')
+    with pytest.raises(ValueError):
+        affinity.set_ring(['node-0', 'node-1'])
+    assert affinity.owns('anything') # Still no ring: everything is local
+
+
+# --- Router ---
+
+class _Backend(BaseHTTPRequestHandler):
+    """Answers with its node id and what it received."""
+    node_id = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _answer(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = json.dumps({
+            "node": self.node_id, "path": self.path, "body": self.rfile.read(length).decode(),
+            "headers": {name.lower(): value for name, value in self.headers.items()}
+        }).encode()
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_GET = do_POST = _answer
+
+
+def _serve(handler):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+@pytest.fixture
+def router(monkeypatch):
+    monkeypatch.setattr(config, 'CLUSTER_TOKEN', 'admin-secret')
+    members = ['node-0', 'node-1']
+    args = argparse.Namespace(drain_timeout=1, startup_timeout=1, verbose=False)
+    the_cluster = cluster.Cluster(args)
+    servers = []
+    for node_id in members:
+        backend = _serve(type('Backend', (_Backend,), {"node_id": node_id}))
+        servers.append(backend)
+        node = cluster.Node(node_id, backend.server_address[1])
+        node.ready = True
+        the_cluster.nodes[node_id] = node
+    the_cluster.ring = HashRing(members)
+    monkeypatch.setattr(cluster.RouterHandler, 'cluster', the_cluster)
+    router_server = _serve(cluster.RouterHandler)
+    servers.append(router_server)
+    yield the_cluster, f"http://127.0.0.1:{router_server.server_address[1]}"
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def _call(url, data=None, headers=None):
+    request = urllib.request.Request(url, data=data, headers=headers or {}, method='POST' if data else 'GET')
+    try:
+        with urllib.request.urlopen(request, timeout=10) as response:
+            return response.status, json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        return e.code, json.loads(e.read())
+
+
+def test_session_requests_go_to_the_owner(router):
+    the_cluster, url = router
+    for i in range(8):
+        session_id = f"00000000-0000-4000-8000-{i:012d}"
+        status, seen = _call(f"{url}/api/process/{session_id}/png/rotate", data=b'{"angle": 90}',
+                             headers={'Content-Type': 'application/json', 'X-Haguma-Cluster-Token': 'admin-secret'})
+        assert status == 200
+        assert seen["node"] == the_cluster.ring.owner(session_id)
+        assert seen["path"] == f"/api/process/{session_id}/png/rotate"
+        assert seen["body"] == '{"angle": 90}'
+        assert seen["headers"]["x-forwarded-for"] == '127.0.0.1'
+        assert 'x-haguma-cluster-token' not in seen["headers"] # Never passed on to the backends
+    # Released once the router's handler returns, just after the client has the response
+    deadline = time.monotonic() + 5
+    while the_cluster.status()["in_flight"] and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert the_cluster.status()["in_flight"] == 0
+
+
+def test_requests_without_an_id_are_spread(router):
+    _, url = router
+    nodes = {_call(f"{url}/api/stats")[1]["node"] for _ in range(4)}
+    assert nodes == {'node-0', 'node-1'}
+
+
+def test_admin_calls_need_the_token(router, monkeypatch):
+    the_cluster, url = router
+    scaled = []
+    monkeypatch.setattr(the_cluster, 'scale', lambda processes: scaled.append(processes) or {"members": []})
+
+    # Local address alone isn't enough: behind nginx every client looks local
+    assert _call(f"{url}/api/cluster/scale", data=b'{"processes": 6}')[0] == 404
+    assert _call(f"{url}/api/cluster/scale", data=b'{"processes": 6}',
+                 headers={'X-Haguma-Cluster-Token': 'wrong'})[0] == 404
+    assert _call(f"{url}/api/cluster/status")[0] == 404
+    assert scaled == []
+
+    status, _ = _call(f"{url}/api/cluster/scale", data=b'{"processes": 6}',
+                      headers={'X-Haguma-Cluster-Token': 'admin-secret'})
+    assert status == 200 and scaled == [6]
+    status, state = _call(f"{url}/api/cluster/status", headers={'X-Haguma-Cluster-Token': 'admin-secret'})
+    assert status == 200 and state["members"] == ['node-0', 'node-1']
+
+
+def test_admin_calls_are_off_without_a_configured_token(router, monkeypatch):
+    _, url = router
+    monkeypatch.setattr(config, 'CLUSTER_TOKEN', '')
+    assert _call(f"{url}/api/cluster/status", headers={'X-Haguma-Cluster-Token': ''})[0] == 404
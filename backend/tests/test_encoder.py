@@ -0,0 +1,54 @@
+import pytest
+import config
+from services import encoder
+from conftest import make_photo, encoded_bytes
+
+
+@pytest.fixture
+def many_encoder_threads(monkeypatch):
+    monkeypatch.setattr(config, 'ENCODER_WORKERS', 8)
+    monkeypatch.setattr(encoder, '_executor', None)
+    yield
+    if encoder._executor is not None:
+        encoder._executor.shutdown()
+
+
+@pytest.mark.parametrize('target_bytes', [8000, 15000, 30000, 60000])
+def test_target_search_returns_bytes_of_reported_quality(many_encoder_threads, slow_saves, target_bytes):
+    slow_saves('JPEG')
+    img = make_photo()
+    data, info = encoder.encode_image(img, 'jpeg', target_bytes=target_bytes)
+    assert data == encoded_bytes(img, 'JPEG', quality=info['quality'])
+    assert info['size_bytes'] == len(data)
+
+
+def test_target_search_picks_highest_fitting_quality(many_encoder_threads):
+    img = make_photo()
+    target_bytes = 20000
+    data, info = encoder.encode_image(img, 'jpeg', target_bytes=target_bytes)
+    assert info['target_met'] and len(data) <= target_bytes
+    next_quality = info['quality'] + encoder.QUALITY_PROBE_STEP
+    if next_quality <= encoder.QUALITY_MAX:
+        assert len(encoded_bytes(img, 'JPEG', quality=next_quality)) > target_bytes
+
+
+def test_target_search_falls_back_to_smallest_output(many_encoder_threads):
+    data, info = encoder.encode_image(make_photo(), 'jpeg', target_bytes=100)
+    assert not info['target_met']
+    assert info['quality'] == encoder.QUALITY_MIN
+
+
+def test_concurrent_search_leaves_image_settings_alone(many_encoder_threads, slow_saves):
+    # Image.save can leave another thread's options on a shared image, where later saves pick them up
+    slow_saves('JPEG')
+    img = make_photo()
+    encoder.encode_image(img, 'jpeg', target_bytes=15000)
+    data, _ = encoder.encode_image(img, 'jpeg', quality=10)
+    assert data == encoded_bytes(img, 'JPEG', quality=10)
+
+
+def test_target_bytes_only_for_lossy_formats():
+    with pytest.raises(ValueError):
+        encoder.encode_image(make_photo(), 'png', target_bytes=10000)
+    with pytest.raises(ValueError):
+        encoder.encode_image(make_photo(), 'jpeg', target_bytes=0)
@@ -0,0 +1,58 @@
+import io
+import zipfile
+import pytest
+import config
+from PIL import Image
+from services import export_service
+from utils import file_helpers
+from conftest import make_photo, encoded_bytes
+
+
+@pytest.fixture
+def session_image(monkeypatch):
+    monkeypatch.setattr(config, 'EXPORT_WORKERS', 8)
+    monkeypatch.setattr(export_service, '_executor', None)
+    filepath = f"{file_helpers.get_shard_dir(config.WORKING_FOLDER, 'export-test')}/export-test.png"
+    img = make_photo()
+    file_helpers.atomic_save_image(img, filepath)
+    yield filepath, img
+    if export_service._executor is not None:
+        export_service._executor.shutdown()
+
+
+def _export(filepath, specs):
+    archive = zipfile.ZipFile(io.BytesIO(b''.join(export_service.stream_export(filepath, specs))))
+    return {name: archive.read(name) for name in archive.namelist()}
+
+
+def test_variants_keep_their_own_settings(session_image, slow_saves):
+    slow_saves('JPEG')
+    slow_saves('WEBP')
+    filepath, img = session_image
+    files = _export(filepath, export_service.parse_export_specs([
+        {"format": "jpeg", "quality": 95, "name": "high"},
+        {"format": "jpeg", "quality": 10, "name": "low"},
+        {"format": "webp", "quality": 50, "name": "lossy"},
+        {"format": "webp", "preset": "lossless", "name": "lossless"},
+    ]))
+    assert files["high.jpeg"] == encoded_bytes(img, 'JPEG', quality=95)
+    assert files["low.jpeg"] == encoded_bytes(img, 'JPEG', quality=10)
+    assert files["lossy.webp"] == encoded_bytes(img, 'WEBP', quality=50)
+    assert files["lossless.webp"] == encoded_bytes(img, 'WEBP', lossless=True, method=6)
+
+
+def test_variant_sizes_and_duplicate_names(session_image):
+    filepath, _ = session_image
+    files = _export(filepath, export_service.parse_export_specs([
+        {"format": "png", "max_dimension": 100},
+        {"format": "png", "max_dimension": 100},
+    ]))
+    assert sorted(files) == ["image_100px.png", "image_100px_2.png"]
+    assert max(Image.open(io.BytesIO(files["image_100px.png"])).size) == 100
+
+
+def test_invalid_specs_are_rejected():
+    with pytest.raises(ValueError):
+        export_service.parse_export_specs([{"format": "tiff"}])
+    with pytest.raises(ValueError):
+        export_service.parse_export_specs([{"format": "png", "target_bytes": 1000}])
@@ -0,0 +1,120 @@
+import os
+import pytest
+from PIL import Image
+from services import image_service, operations, residency
+from conftest import make_photo
+
+# One call per registered operation, as calibrate_costs.py times them
+OPERATION_PARAMS = [
+    ('resize', {'percentage': 50}),
+    ('rotate', {'angle': 90}),
+    ('flip', {'axis': 'horizontal'}),
+    ('crop', {'preset': 'square', 'anchor': 'smart'}),
+    ('crop-custom', {'x': 10, 'y': 10, 'width': 100, 'height': 80}),
+    ('grayscale', {'intensity': 100}),
+    ('brightness', {'level': 30}),
+    ('contrast', {'level': 30}),
+    ('filter', {'type': 'blur', 'intensity': 40}),
+    ('filter', {'type': 'sharpen', 'intensity': 50}),
+    ('auto', {'mode': 'levels'}),
+    ('auto', {'mode': 'white-balance'}),
+]
+
+
+def _still(mode, photo=None):
+    photo = photo or make_photo(240, 180)
+    if mode == 'P':
+        return photo.convert('P', palette=Image.Palette.ADAPTIVE)
+    if mode == 'P-transparent':
+        img = photo.convert('P', palette=Image.Palette.ADAPTIVE)
+        img.info['transparency'] = 0
+        return img
+    if mode == 'I;16':
+        return photo.convert('L').point(lambda value: value * 256, 'I').convert('I;16')
+    return photo.convert(mode)
+
+
+def _session_file(session_id, img, extension):
+    filepath = image_service.get_temp_filepath(session_id, extension)
+    os.makedirs(os.path.dirname(filepath), exist_ok=True)
+    img.save(filepath)
+    return filepath
+
+
+@pytest.fixture
+def cleanup_sessions():
+    session_ids = []
+    yield session_ids
+    for session_id in session_ids:
+        image_service.expire_session(session_id)
+        residency.forget(session_id)
+
+
+@pytest.mark.parametrize('op, params', OPERATION_PARAMS)
+@pytest.mark.parametrize('mode, extension', [('P', 'gif'), ('P-transparent', 'gif'), ('1', 'png'),
+                                             ('LA', 'png'), ('I;16', 'png'), ('L', 'jpg')])
+def test_operations_on_still_images_of_any_mode(op, params, mode, extension, cleanup_sessions):
+    session_id = f"modes-{op}-{mode.replace(';', '')}-{len(cleanup_sessions)}"
+    cleanup_sessions.append(session_id)
+    filepath = _session_file(session_id, _still(mode), extension)
+    result = operations.run(op, filepath, operations.OPERATIONS[op].parse(params))
+    assert result["new_dimensions"]["width"] > 0
+    with Image.open(filepath) as edited:
+        edited.load()
+
+
+def test_sixteen_bit_gray_is_scaled_not_clipped():
+    photo = make_photo(240, 180)
+    gray = image_service._editable(_still('I;16', photo))
+    assert gray.mode == 'L'
+    assert gray.getextrema() == _still('L', photo).getextrema()
+
+
+def test_transparency_survives_normalization():
+    assert image_service._editable(_still('P-transparent')).mode == 'RGBA'
+    assert image_service._editable(_still('LA')).mode == 'LA'
+    assert image_service._editable(_still('1')).mode == 'L'
+    assert image_service._editable(_still('P')).mode == 'RGB'
+
+
+# --- Smart crop ---
+
+def test_summed_area_table_gives_every_window_sum():
+    width, height = 4, 3
+    values = [3, 1, 4, 1, 5, 9, 2, 6, 5, 3, 5, 8]
+    table = image_service._summed_area_table(values, width, height)
+    for top in range(height):
+        for bottom in range(top + 1, height + 1):
+            for left in range(width):
+                for right in range(left + 1, width + 1):
+                    expected = sum(values[y * width + x] for y in range(top, bottom) for x in range(left, right))
+                    assert image_service._window_sum(table, width, left, top, right, bottom) == expected
+
+
+def _dark_with_bright_square(size, square):
+    img = Image.new('RGB', size, (20, 20, 20))
+    img.paste((255, 255, 255), square)
+    return img
+
+
+def test_smart_crop_keeps_the_detailed_region():
+    img = _dark_with_bright_square((200, 100), (160, 40, 180, 60))
+    # Every window holding the whole square scores the same; the most central of them wins
+    assert image_service._smart_crop_origin(img, 100, 100) == (80, 0)
+    assert image_service._crop_box(img, 'square', 'smart') == (80, 0, 180, 100)
+    assert image_service._crop_box(img, 'square') == (50, 0, 150, 100)
+
+    tall = _dark_with_bright_square((100, 300), (40, 20, 60, 40))
+    assert image_service._crop_box(tall, 'square', 'smart') == (0, 20, 100, 120)
+
+
+def test_smart_crop_of_a_flat_image_is_centered():
+    img = Image.new('RGB', (200, 100), (90, 90, 90))
+    assert image_service._smart_crop_origin(img, 100, 100) == (50, 0)
+
+
+def test_smart_crop_is_searched_on_a_proxy_for_large_images():
+    img = _dark_with_bright_square((2000, 1000), (1600, 400, 1800, 600))
+    left, top = image_service._smart_crop_origin(img, 1000, 1000)
+    assert top == 0
+    assert 800 <= left <= 1000 # Holds the whole square
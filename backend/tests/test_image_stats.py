@@ -0,0 +1,97 @@
+import io
+import pytest
+from PIL import Image
+from werkzeug.datastructures import FileStorage
+from services import image_service, image_stats, residency
+from conftest import encoded_bytes
+
+
+def _two_tone(width=100, height=100, dark=50, light=200):
+    """Gray image: the top half dark, the bottom half light."""
+    img = Image.new('L', (width, height), dark)
+    img.paste(light, (0, height // 2, width, height))
+    return img
+
+
+def _narrow_range():
+    """RGB gradients using only part of the range: R 64-191, G 32-95, B 128-255."""
+    ramp = Image.linear_gradient('L') # 256 x 256, one value per row
+    return Image.merge('RGB', [ramp.point(lambda value: 64 + value // 2),
+                               ramp.point(lambda value: 32 + value // 4),
+                               ramp.point(lambda value: 128 + value // 2)])
+
+
+def test_histogram_counts_every_pixel_at_its_value():
+    stats = image_stats.compute_stats(_two_tone())
+    luminance = stats["luminance"]
+    assert stats["pixels"] == 10000
+    assert luminance["histogram"][50] == luminance["histogram"][200] == 5000
+    assert sum(luminance["histogram"]) == 10000
+    assert (luminance["min"], luminance["max"], luminance["median"]) == (50, 200, 50)
+    assert luminance["mean"] == 125.0
+    assert luminance["stddev"] == 75.0
+
+
+def test_histogram_has_a_channel_per_color_band():
+    stats = image_stats.compute_stats(_narrow_range())
+    assert list(stats["channels"]) == ['R', 'G', 'B']
+    red = stats["channels"]["R"]
+    assert (red["min"], red["max"]) == (64, 191)
+    assert red["histogram"][64] == 2 * 256 # Two gradient rows map to each value
+    assert (stats["channels"]["G"]["min"], stats["channels"]["G"]["max"]) == (32, 95)
+
+
+def test_transparent_pixels_are_not_counted():
+    img = _two_tone().convert('RGBA')
+    alpha = Image.new('L', img.size, 255)
+    alpha.paste(0, (0, 0, 100, 50)) # The dark half is invisible
+    img.putalpha(alpha)
+
+    stats = image_stats.compute_stats(img)
+    assert stats["pixels"] == 5000
+    assert stats["luminance"]["histogram"][200] == 5000
+    assert stats["luminance"]["histogram"][50] == 0
+
+
+def test_auto_levels_stretches_each_channel_to_the_full_range():
+    adjusted = image_service.apply_auto(_narrow_range(), 'levels', 0)
+    for band in adjusted.split():
+        assert band.getextrema() == (0, 255)
+
+
+def test_auto_contrast_stretches_every_channel_alike():
+    img = _two_tone().convert('RGB')
+    adjusted = image_service.apply_auto(img, 'contrast', 0)
+    assert adjusted.getpixel((0, 0)) == (0, 0, 0)
+    assert adjusted.getpixel((0, 99)) == (255, 255, 255)
+
+
+def test_clip_ignores_the_outliers():
+    img = _two_tone(light=150)
+    img.putpixel((0, 0), 255) # One stray bright pixel
+    assert image_service.apply_auto(img, 'levels', 0).getpixel((0, 99)) < 255
+    assert image_service.apply_auto(img, 'levels', 1).getpixel((0, 99)) == 255
+
+
+@pytest.fixture
+def session():
+    upload = image_service.save_uploaded_file(
+        FileStorage(stream=io.BytesIO(encoded_bytes(_narrow_range(), 'PNG')), filename='ramp.png'))
+    session_id = upload["image_session_id"]
+    yield session_id, image_service.get_temp_filepath(session_id, 'png')
+    image_service.expire_session(session_id)
+    residency.forget(session_id)
+
+
+def test_session_histogram_follows_auto_levels_and_undo(session):
+    session_id, filepath = session
+    before = image_service.get_histogram(filepath)
+    assert (before["channels"]["B"]["min"], before["channels"]["B"]["max"]) == (128, 255)
+
+    image_service.process_auto(filepath, 'levels', 0)
+    after = image_service.get_histogram(filepath)
+    assert all((channel["min"], channel["max"]) == (0, 255) for channel in after["channels"].values())
+    assert after["pixels"] == before["pixels"] == 256 * 256
+
+    image_service.undo_image(session_id, 'png')
+    assert image_service.get_histogram(filepath) == before
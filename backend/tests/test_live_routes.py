@@ -0,0 +1,59 @@
+import io
+import pytest
+from PIL import Image
+from werkzeug.datastructures import FileStorage
+from routes import live_routes
+from services import image_service, operations, residency
+from conftest import make_photo, encoded_bytes
+
+
+@pytest.mark.parametrize('raw', ['[]', '"adjust"', '1', 'null',
+                                 '{"type": "adjust", "op": "brightness", "params": [30]}',
+                                 '{"type": "adjust", "op": "filter", "params": "blur"}'])
+def test_messages_that_are_not_objects_are_rejected(raw):
+    with pytest.raises(ValueError):
+        live_routes.next_message(raw, lambda: None)
+
+
+def test_earlier_filter_keyword_is_accepted():
+    message = live_routes.next_message('{"type": "adjust", "op": "filter", "params": {"filter_type": "blur", "intensity": 40}}',
+                                       lambda: None)
+    assert message['params']['filter_type'] == 'blur'
+
+
+@pytest.fixture
+def live():
+    upload = image_service.save_uploaded_file(
+        FileStorage(stream=io.BytesIO(encoded_bytes(make_photo(160, 90), 'PNG')), filename='photo.png'))
+    session_id = upload["image_session_id"]
+    live = live_routes.open_live_session(session_id, 'png')
+    yield live
+    live_routes.close_live_session(live)
+    image_service.expire_session(session_id)
+    residency.forget(session_id)
+
+
+def _preview_size(live):
+    message = live_routes.next_message('{"type": "adjust", "op": "brightness", "params": {"level": 10}}', lambda: None)
+    payloads, keep_open = live_routes.handle_message(live, message)
+    assert keep_open
+    return Image.open(io.BytesIO(payloads[0])).size
+
+
+def test_previews_follow_edits_made_over_http(live):
+    assert _preview_size(live) == (160, 90)
+    # An HTTP /process request while the channel is open
+    operations.run('rotate', live["filepath"], operations.OPERATIONS['rotate'].parse({'angle': 90}))
+    assert _preview_size(live) == (90, 160)
+
+    image_service.undo_image(live["image_session_id"], 'png')
+    assert _preview_size(live) == (160, 90)
+
+
+def test_commit_applies_to_the_current_image(live):
+    operations.run('rotate', live["filepath"], operations.OPERATIONS['rotate'].parse({'angle': 90}))
+    message = live_routes.next_message('{"type": "commit", "op": "grayscale", "params": {"intensity": 100}}', lambda: None)
+    payloads, _ = live_routes.handle_message(live, message)
+    assert payloads[0]["type"] == 'committed'
+    assert payloads[0]["new_dimensions"] == {"width": 90, "height": 160}
+    assert image_service.get_history_status(live["image_session_id"])["can_undo"]
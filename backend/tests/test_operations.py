@@ -0,0 +1,175 @@
+import io
+import os
+import pytest
+from werkzeug.datastructures import FileStorage
+from services import image_service, operations, residency
+from utils import cost_model, cancellation, memory_budget
+from conftest import make_photo, encoded_bytes
+
+
+@pytest.fixture
+def coefficients(monkeypatch):
+    """The built-in coefficients, whatever calibration file or corrections this process has."""
+    monkeypatch.setattr(cost_model, '_coefficients', dict(cost_model.DEFAULT_COEFFICIENTS))
+    monkeypatch.setattr(cost_model, '_corrections', {})
+    return cost_model.DEFAULT_COEFFICIENTS
+
+
+# --- Recipes ---
+
+def test_recipe_steps_get_their_defaults():
+    assert operations.parse_recipe([
+        {"op": "rotate", "params": {"angle": 90}},
+        {"op": "crop", "params": {"preset": "1:1"}},
+        {"op": "grayscale"}
+    ]) == [('rotate', {"angle": 90}), ('crop', {"preset": "1:1", "anchor": "center"}), ('grayscale', {"intensity": 100})]
+
+
+def test_recipe_takes_json_names_for_parameters():
+    assert operations.parse_recipe([{"op": "filter", "params": {"type": "blur"}}]) == \
+        [('filter', {"filter_type": "blur", "intensity": 0})]
+
+
+@pytest.mark.parametrize('steps, message', [
+    ([], "non-empty list"),
+    ({"op": "rotate"}, "non-empty list"),
+    ([{"op": "rotate", "params": {"angle": 90}}] * (operations.MAX_RECIPE_STEPS + 1), "more than"),
+    (["rotate"], "Step 1: unknown operation"),
+    ([{"op": "grayscale"}, {"op": "sepia"}], "Step 2: unknown operation"),
+    ([{"op": "crop-custom", "params": {"x": 0, "y": 0}}], "Step 1 (crop-custom): missing 'width' parameter."),
+])
+def test_invalid_recipes_are_refused(steps, message):
+    with pytest.raises(ValueError, match=message.replace('(', r'\(').replace(')', r'\)')):
+        operations.parse_recipe(steps)
+
+
+# --- Cost model ---
+
+def test_work_is_fixed_plus_per_megapixel_cost(coefficients):
+    fixed, per_megapixel = coefficients['smart-crop']
+    assert cost_model.work_seconds([('smart-crop', 2.0)]) == pytest.approx(fixed + 2.0 * per_megapixel)
+    # One byte per pixel does a quarter of the RGB work; unknown kinds are free
+    assert cost_model.work_seconds([('blur', 2.0)], 'L') == pytest.approx(coefficients['blur'][1] * 2.0 / 4)
+    assert cost_model.work_seconds([('teleport', 100.0)]) == 0.0
+
+
+def test_parallel_work_is_spread_over_the_threads(coefficients):
+    cost = cost_model.estimate('rotate', [('decode-png', 1.0)], [('rotate', 8.0)], 4)
+    decode, rotate = coefficients['decode-png'][1], 8.0 * coefficients['rotate'][1]
+    assert cost.cpu_seconds == pytest.approx(decode + rotate)
+    assert cost.wall_seconds == pytest.approx(decode + rotate / 4)
+
+
+def test_measurements_correct_later_estimates_within_limits(coefficients):
+    work = [('blur', 10.0)]
+    first = cost_model.estimate('blur-test', work)
+    cost_model.record('blur-test', first, first.wall_seconds * 2) # Ran twice as slow as estimated
+    second = cost_model.estimate('blur-test', work)
+    assert second.wall_seconds == pytest.approx(first.wall_seconds * (1 + cost_model.CORRECTION_WEIGHT))
+
+    for _ in range(100):
+        cost_model.record('blur-test', second, second.wall_seconds * 10)
+    assert cost_model.get_correction('blur-test') == cost_model.CORRECTION_LIMITS[1]
+
+    # Too short to say anything
+    cost_model.record('tiny-test', cost_model.Cost(0.001, 0.001, 0), 0.01)
+    assert cost_model.get_correction('tiny-test') == 1.0
+
+
+def test_edits_far_past_the_deadline_are_refused_upfront():
+    cost = cost_model.Cost(cpu_seconds=10.0, wall_seconds=10.0, peak_bytes=0)
+    cost_model.admit('rotate', cost) # Outside a request nothing is refused
+    with cancellation.scope('rotate', deadline_seconds=1):
+        with pytest.raises(cost_model.CostLimitExceeded):
+            cost_model.admit('rotate', cost)
+    with cancellation.scope('rotate', deadline_seconds=60):
+        cost_model.admit('rotate', cost)
+
+
+# --- Estimates ---
+
+def test_estimate_adds_decode_edit_and_encode(coefficients):
+    cost = operations.estimate('rotate', 1000, 1000, 'RGB', {"angle": 90}, extension='png')
+    expected = coefficients['decode-png'][1] + coefficients['rotate'][1] + coefficients['encode-png'][1]
+    assert cost.wall_seconds == pytest.approx(expected)
+    assert cost.peak_bytes == memory_budget.estimate_peak_bytes('rotate', 1000, 1000, 'RGB', {"angle": 90})
+
+    # Already in memory: no decode
+    decoded = operations.estimate('rotate', 1000, 1000, 'RGB', {"angle": 90}, extension='png', decoded=True)
+    assert decoded.wall_seconds == pytest.approx(expected - coefficients['decode-png'][1])
+
+
+def test_estimate_encodes_the_output_size(coefficients):
+    cost = operations.estimate('resize', 2000, 1000, 'RGB', {"percentage": 50}, extension='.jpg')
+    # Horizontal pass 2000x1000 -> 1000x1000, vertical pass 1000x1000 -> 1000x500
+    expected = (coefficients['decode-jpeg'][1] * 2.0 + coefficients['resize'][1] * (2.0 + 1.0)
+                + coefficients['encode-jpeg'][1] * 0.5)
+    assert cost.wall_seconds == pytest.approx(expected)
+
+
+def test_recipe_estimate_follows_the_size_through_the_steps(coefficients):
+    recipe = operations.parse_recipe([{"op": "crop-custom", "params": {"x": 0, "y": 0, "width": 500, "height": 500}},
+                                      {"op": "brightness", "params": {"level": 20}}])
+    cost = operations.estimate('recipe', 1000, 1000, 'RGB', {"recipe": recipe})
+    expected = coefficients['crop'][1] * 0.25 + coefficients['brightness'][1] * 0.25
+    assert cost.wall_seconds == pytest.approx(expected)
+
+
+def test_animation_frames_are_edited_in_parallel(coefficients, monkeypatch):
+    monkeypatch.setattr(operations.config, 'ANIMATION_FRAME_THREADS', 4)
+    cost = operations.estimate('brightness', 1000, 1000, 'P', {"level": 20}, frames=8, extension='gif')
+    edit = 8 * coefficients['brightness'][1] # Frames are edited as RGBA
+    io_work = cost_model.work_seconds([('decode-gif', 8.0), ('encode-gif', 8.0)], 'RGBA')
+    assert cost.cpu_seconds == pytest.approx(io_work + edit)
+    assert cost.wall_seconds == pytest.approx(io_work + edit / 4)
+
+
+def test_estimate_file_reads_the_header(coefficients, tmp_path):
+    path = str(tmp_path / 'photo.png')
+    make_photo(400, 250).save(path)
+    assert operations.estimate_file('flip', path, {"axis": "horizontal"}) == \
+        operations.estimate('flip', 400, 250, 'RGB', {"axis": "horizontal"}, extension='.png')
+    assert operations.estimate_file('flip', str(tmp_path / 'missing.png'), {"axis": "horizontal"}) is None
+
+
+# --- /process payloads ---
+
+@pytest.fixture
+def session():
+    from app import create_app
+    upload = image_service.save_uploaded_file(
+        FileStorage(stream=io.BytesIO(encoded_bytes(make_photo(120, 90), 'PNG')), filename='photo.png'))
+    session_id = upload["image_session_id"]
+    yield create_app(worker_setup=False).test_client(), f'/api/process/{session_id}/png'
+    image_service.expire_session(session_id)
+    residency.forget(session_id)
+
+
+@pytest.mark.parametrize('op, body, message', [
+    ('resize', None, "Missing JSON payload."),
+    ('rotate', None, "Missing JSON payload or 'angle' parameter."),
+    ('filter', {"intensity": 20}, "Missing JSON payload or 'type' parameter."),
+    ('crop-custom', None, "Missing JSON payload."),
+    ('crop-custom', {"x": 0, "y": 0}, "Missing required parameters. Need: x, y, width, height"),
+])
+def test_missing_parameters_get_the_same_answers_as_before(session, op, body, message):
+    client, url = session
+    response = client.post(f'{url}/{op}', json=body) if body else client.post(f'{url}/{op}')
+    assert response.status_code == 400
+    assert response.get_json() == {"error": message}
+
+
+@pytest.mark.parametrize('op, body, error, message', [
+    ('rotate', {"angle": 90}, RuntimeError("Disk full while saving."), "Disk full while saving."),
+    ('resize', {"percentage": 50}, OSError("boom"), "An unexpected server error occurred during resize."),
+    ('flip', {"axis": "horizontal"}, RuntimeError("boom"), "Server error during flip."),
+])
+def test_server_errors_get_the_same_answers_as_before(session, monkeypatch, op, body, error, message):
+    client, url = session
+
+    def fail(filepath, **kwargs):
+        raise error
+    monkeypatch.setattr(operations.OPERATIONS[op], 'process', fail)
+    response = client.post(f'{url}/{op}', json=body)
+    assert response.status_code == 500
+    assert response.get_json() == {"error": message}
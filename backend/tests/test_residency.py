@@ -0,0 +1,132 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+import config
+from services import residency, encoder
+from utils import file_helpers, raw_image
+from conftest import make_photo, encoded_bytes
+
+
+@pytest.fixture
+def working_file():
+    session_id = 'residency-test'
+    filepath = os.path.join(file_helpers.get_shard_dir(config.WORKING_FOLDER, session_id), f"{session_id}.png")
+    img = make_photo()
+    residency.save_image(img, filepath)
+    yield session_id, filepath, img
+    residency.forget(session_id)
+
+
+def test_cached_image_is_shared_read_only(working_file):
+    _, filepath, img = working_file
+    assert residency.is_decoded(filepath)
+    pixel = img.getpixel((10, 10))
+    with residency.open_image(filepath) as checked_out:
+        checked_out.paste((0, 0, 0), (0, 0, 50, 50))
+        assert checked_out.getpixel((10, 10)) == (0, 0, 0)
+    with residency.open_image(filepath) as again:
+        assert again.getpixel((10, 10)) == pixel
+
+
+def test_concurrent_checkouts_encode_with_their_own_settings(working_file, slow_saves):
+    slow_saves('JPEG')
+    _, filepath, img = working_file
+    qualities = [10, 95] * 8
+
+    def download(quality):
+        with residency.open_image(filepath) as checked_out:
+            return quality, encoder.encode_image(checked_out, 'jpeg', quality=quality)[0]
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = list(executor.map(download, qualities))
+    expected = {q: encoded_bytes(img, 'JPEG', quality=q) for q in set(qualities)}
+    assert all(data == expected[quality] for quality, data in results)
+
+
+def _make_idle(session_id, monkeypatch):
+    monkeypatch.setattr(config, 'RESIDENCY_IDLE_SECONDS', 60)
+    residency._last_access[session_id] = time.time() - 120
+
+
+def test_idle_session_is_demoted_and_promoted_back(working_file, monkeypatch):
+    session_id, filepath, _ = working_file
+    with open(filepath, 'rb') as f:
+        contents = f.read()
+    _make_idle(session_id, monkeypatch)
+
+    assert residency.demote_idle_sessions() == 1
+    cold_filepath = residency.get_cold_filepath(session_id, filepath)
+    assert not os.path.exists(filepath) and os.path.exists(cold_filepath)
+    assert not residency.is_decoded(filepath)
+    assert residency.get_cold_sessions_by_age()[0][1] == session_id
+
+    residency.ensure_hot(session_id, filepath)
+    assert not os.path.exists(cold_filepath)
+    with open(filepath, 'rb') as f:
+        assert f.read() == contents
+    assert residency.get_cold_sessions_by_age() == []
+
+
+def test_pinned_session_is_not_demoted(working_file, monkeypatch):
+    session_id, filepath, _ = working_file
+    _make_idle(session_id, monkeypatch)
+    with residency.pinned(session_id):
+        assert residency.demote_idle_sessions() == 0
+        assert os.path.exists(filepath)
+    assert residency.demote_idle_sessions() == 1
+
+
+def test_session_accessed_after_it_was_found_idle_stays(working_file, monkeypatch):
+    session_id, filepath, _ = working_file
+    _make_idle(session_id, monkeypatch)
+    cutoff = time.time() - config.RESIDENCY_IDLE_SECONDS
+    residency.ensure_hot(session_id, filepath) # A request arrives before the demotion takes the lock
+    assert not residency._demote_to_cold(session_id, cutoff)
+    assert os.path.exists(filepath)
+
+
+def test_requests_pin_their_session():
+    from app import create_app
+    app = create_app(worker_setup=False)
+    with app.test_request_context('/api/download/pinned-session/png'):
+        app.preprocess_request()
+        assert residency._pins.get('pinned-session') == 1
+    assert 'pinned-session' not in residency._pins
+
+
+def test_requests_for_unknown_sessions_leave_no_state():
+    from app import create_app
+    client = create_app(worker_setup=False).test_client()
+    for _ in range(3):
+        assert client.get('/api/download/no-such-session/png').status_code == 404
+        assert client.get('/api/histogram/no-such-session/png').status_code == 404
+    assert 'no-such-session' not in residency.get_session_ids()
+
+
+def test_sessions_whose_file_is_gone_are_pruned(working_file, monkeypatch):
+    session_id, filepath, _ = working_file
+    _make_idle(session_id, monkeypatch)
+    os.remove(filepath) # e.g. deleted by hand, or by a cleanup job of another deployment
+    assert residency.demote_idle_sessions() == 0
+    assert session_id not in residency.get_session_ids()
+
+
+def test_raw_copy_is_kept_for_its_contents_only(working_file):
+    _, filepath, img = working_file
+    token = residency._file_token(filepath)
+    raw_image.write(img, filepath, token)
+
+    # The version store and the cold tier refresh the mtime; the pixels are the same
+    os.utime(filepath, (0, 0))
+    mapped = raw_image.open_mapped(filepath, token)
+    assert mapped is not None and mapped.getpixel((10, 10))[:3] == img.getpixel((10, 10))
+
+    # Other bytes on the same inode with the same size, as when a freed inode is reused
+    with open(filepath, 'r+b') as f:
+        f.seek(os.path.getsize(filepath) // 2)
+        byte = f.read(1)
+        f.seek(-1, os.SEEK_CUR)
+        f.write(bytes([byte[0] ^ 0xFF]))
+    assert residency._file_token(filepath) == token
+    assert raw_image.open_mapped(filepath, token) is None
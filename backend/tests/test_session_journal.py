@@ -0,0 +1,90 @@
+import io
+import os
+import pytest
+import config
+from werkzeug.datastructures import FileStorage
+from services import image_service, operations, residency, session_journal, version_store
+from conftest import make_photo, encoded_bytes
+
+
+@pytest.fixture
+def journal(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, 'SESSION_JOURNAL_PATH', str(tmp_path / 'session_journal.sqlite3'))
+    session_ids = []
+    yield session_ids
+    for session_id in session_ids:
+        image_service.expire_session(session_id)
+        residency.forget(session_id)
+    with session_journal._lock:
+        session_journal._close()
+
+
+def _edited_session(journal):
+    """A session with two versions (upload, rotate), as left by a process that stopped."""
+    upload = image_service.save_uploaded_file(
+        FileStorage(stream=io.BytesIO(encoded_bytes(make_photo(120, 90), 'PNG')), filename='photo.png'))
+    session_id = upload["image_session_id"]
+    journal.append(session_id)
+    filepath = image_service.get_temp_filepath(session_id, 'png')
+    operations.run('rotate', filepath, operations.OPERATIONS['rotate'].parse({'angle': 90}))
+    history = list(image_service.session_history[session_id]["history"])
+    # What a restart loses: everything in memory
+    image_service.release_session(session_id)
+    return session_id, filepath, history
+
+
+def test_history_is_restored_after_a_restart(journal):
+    session_id, filepath, history = _edited_session(journal)
+
+    assert image_service.restore_sessions() == (1, 0)
+    assert image_service.session_history[session_id] == {"history": history, "current_index": 1}
+    assert image_service.get_history_status(session_id) == {"can_undo": True, "can_redo": False}
+    assert all(version_store._blob_refs.get(blob_path) for blob_path in history)
+
+    image_service.undo_image(session_id, 'png')
+    with open(filepath, 'rb') as current, open(history[0], 'rb') as original:
+        assert current.read() == original.read()
+
+
+def test_session_without_its_working_file_is_dropped(journal):
+    session_id, filepath, _ = _edited_session(journal)
+    os.remove(filepath)
+
+    assert image_service.restore_sessions() == (0, 1)
+    assert session_id not in image_service.session_history
+    assert session_journal.load_session(session_id) is None
+
+
+def test_versions_deleted_while_down_are_skipped(journal):
+    session_id, filepath, history = _edited_session(journal)
+    os.remove(history[0])
+
+    assert image_service.restore_sessions() == (1, 0)
+    assert image_service.session_history[session_id] == {"history": history[1:], "current_index": 0}
+    assert session_journal.load_session(session_id)[1] == history[1:]
+
+
+def test_journaled_versions_survive_garbage_collection(journal):
+    # Another process sharing VERSION_FOLDER holds the session; this one has no references to it
+    _, _, history = _edited_session(journal)
+    for blob_path in history:
+        os.utime(blob_path, (0, 0))
+
+    version_store.collect_garbage(0)
+    assert all(os.path.exists(blob_path) for blob_path in history)
+
+
+def test_unloaded_sessions_without_a_working_file_are_forgotten(journal):
+    # Behind the router sessions load on first use; these two are never asked for again
+    gone, gone_path, gone_history = _edited_session(journal)
+    kept, _, _ = _edited_session(journal)
+    os.remove(gone_path)
+
+    assert image_service.prune_journal() == 1
+    assert session_journal.load_session(gone) is None
+    assert session_journal.load_session(kept) is not None
+
+    edited = gone_history[1] # The uploaded original stays in the ingest index for re-uploads
+    os.utime(edited, (0, 0))
+    version_store.collect_garbage(0)
+    assert not os.path.exists(edited)
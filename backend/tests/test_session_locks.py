@@ -0,0 +1,106 @@
+import threading
+import time
+import pytest
+from utils import session_locks
+
+
+def _wait_for_queue(session_id, length, timeout=5):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        with session_locks._registry_lock:
+            state = session_locks._sessions.get(session_id)
+            if state and len(state["queue"]) >= length:
+                return
+        time.sleep(0.001)
+    raise AssertionError(f"Queue of {session_id} never reached {length}")
+
+
+def _start(session_id, kind, func, results, name):
+    def run():
+        try:
+            results[name] = session_locks.run_exclusive(session_id, kind, func)
+        except session_locks.RequestSuperseded:
+            results[name] = 'superseded'
+    thread = threading.Thread(target=run)
+    thread.start()
+    return thread
+
+
+def test_requests_run_one_at_a_time_in_arrival_order():
+    running = threading.Event()
+    release = threading.Event()
+    order, results = [], {}
+
+    def first():
+        running.set()
+        release.wait(5)
+        order.append('first')
+
+    threads = [_start('locks-order', 'rotate', first, results, 'first')]
+    running.wait(5)
+    for queued, name in enumerate(['second', 'third'], start=2):
+        threads.append(_start('locks-order', 'rotate', lambda name=name: order.append(name), results, name))
+        _wait_for_queue('locks-order', queued)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert order == ['first', 'second', 'third']
+    assert not session_locks.is_busy('locks-order')
+
+
+def test_waiting_slider_request_is_superseded_by_a_newer_one():
+    running = threading.Event()
+    release = threading.Event()
+    results = {}
+
+    def dragging():
+        running.set()
+        release.wait(5)
+        return 'ran'
+
+    threads = [_start('locks-slider', 'brightness', dragging, results, 'running')]
+    running.wait(5)
+    threads.append(_start('locks-slider', 'brightness', lambda: 'ran', results, 'older'))
+    _wait_for_queue('locks-slider', 2)
+    threads.append(_start('locks-slider', 'brightness', lambda: 'ran', results, 'newer'))
+    threads[1].join(5) # Answered right away, without waiting for the running one
+    assert results == {'older': 'superseded'}
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+    # The one already running finishes; of the waiting ones only the newest is applied
+    assert results == {'running': 'ran', 'older': 'superseded', 'newer': 'ran'}
+    assert not session_locks.is_busy('locks-slider')
+
+
+def test_other_kinds_and_sessions_are_not_superseded():
+    running = threading.Event()
+    release = threading.Event()
+    results = {}
+
+    def dragging():
+        running.set()
+        release.wait(5)
+        return 'ran'
+
+    threads = [_start('locks-kinds', 'brightness', dragging, results, 'running')]
+    running.wait(5)
+    threads.append(_start('locks-kinds', 'contrast', lambda: 'ran', results, 'contrast'))
+    _wait_for_queue('locks-kinds', 2)
+    threads.append(_start('locks-kinds', 'brightness', lambda: 'ran', results, 'brightness'))
+    _wait_for_queue('locks-kinds', 3)
+    assert session_locks.run_exclusive('locks-elsewhere', 'brightness', lambda: 'ran') == 'ran'
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert results == {'running': 'ran', 'contrast': 'ran', 'brightness': 'ran'}
+
+
+def test_failed_request_releases_the_session():
+    with pytest.raises(ZeroDivisionError):
+        session_locks.run_exclusive('locks-error', 'rotate', lambda: 1 / 0)
+    assert not session_locks.is_busy('locks-error')
+    assert session_locks.run_exclusive('locks-error', 'rotate', lambda: 'ran') == 'ran'
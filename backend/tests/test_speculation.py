@@ -0,0 +1,72 @@
+import io
+import os
+import time
+import pytest
+import config
+from werkzeug.datastructures import FileStorage
+from services import image_service, residency, speculation
+from utils import cancellation
+from conftest import make_photo, encoded_bytes
+
+
+def _wait_until(condition, timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+@pytest.fixture
+def session():
+    upload = image_service.save_uploaded_file(
+        FileStorage(stream=io.BytesIO(encoded_bytes(make_photo(120, 90), 'PNG')), filename='photo.png'))
+    session_id = upload["image_session_id"]
+    yield session_id, image_service.get_temp_filepath(session_id, 'png')
+    speculation.forget(session_id)
+    image_service.expire_session(session_id)
+    residency.forget(session_id)
+
+
+def test_speculation_waits_for_a_request_in_flight(session, monkeypatch):
+    from app import create_app
+    session_id, filepath = session
+    version_blob = image_service.session_history[session_id]["history"][0]
+    monkeypatch.setattr(config, 'SPECULATION_CPU_PERCENT', 100)
+    monkeypatch.setattr(config, 'SPECULATION_FORMATS', 1)
+    app = create_app(worker_setup=False)
+
+    # Not cancellable, like an upload or an undo: only the request hook marks it
+    with app.test_request_context(f'/api/undo/{session_id}/png', method='POST'):
+        app.preprocess_request()
+        assert cancellation.idle_seconds() == 0.0
+        speculation.schedule(session_id, filepath, version_blob)
+        time.sleep(3 * config.SPECULATION_IDLE_SECONDS)
+        assert speculation.lookup(session_id, version_blob, 'png') is None
+
+    assert _wait_until(lambda: speculation.lookup(session_id, version_blob, 'png'))
+    assert _wait_until(lambda: speculation.get_stats()["pending"] == 0)
+    time.sleep(0.1) # Past its CPU-budget rest, before SPECULATION_CPU_PERCENT goes back to 0
+
+
+def test_disk_cap_evicts_the_least_recently_used(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, 'SPECULATION_DISK_MB', 1)
+    size = 400 * 1024
+    paths = {}
+    for name in ['first', 'second', 'third']:
+        paths[name] = str(tmp_path / f"{name}.png")
+        with open(paths[name], 'wb') as f:
+            f.write(b'\x00' * size)
+
+    speculation._add_file(('spec-lru', 'first', 'png', None), paths['first'], size)
+    speculation._add_file(('spec-lru', 'second', 'png', None), paths['second'], size)
+    assert speculation.lookup('spec-lru', 'first', 'png') == paths['first'] # Now the most recent
+    speculation._add_file(('spec-lru', 'third', 'png', None), paths['third'], size)
+
+    assert not os.path.exists(paths['second'])
+    assert speculation.lookup('spec-lru', 'second', 'png') is None
+    assert speculation.lookup('spec-lru', 'first', 'png') == paths['first']
+    assert speculation.lookup('spec-lru', 'third', 'png') == paths['third']
+    speculation.forget('spec-lru')
+    assert speculation.get_stats()["disk_bytes"] == 0
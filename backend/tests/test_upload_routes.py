@@ -0,0 +1,109 @@
+import os
+import pytest
+from services import image_service, residency, upload_service
+from conftest import make_photo, encoded_bytes
+
+CHUNK_TYPE = 'application/offset+octet-stream'
+
+
+@pytest.fixture
+def client():
+    from app import create_app
+    return create_app(worker_setup=False).test_client()
+
+
+@pytest.fixture
+def photo():
+    return encoded_bytes(make_photo(200, 150), 'PNG')
+
+
+def _create(client, length, filename='photo.png'):
+    response = client.post('/api/uploads', json={"filename": filename, "length": length})
+    assert response.status_code == 201
+    return response.get_json()["upload_id"]
+
+
+def _patch(client, upload_id, offset, data, content_type=CHUNK_TYPE):
+    return client.patch(f'/api/uploads/{upload_id}', data=data, content_type=content_type,
+                        headers={'Upload-Offset': str(offset)})
+
+
+def test_upload_in_chunks_resumes_from_the_reported_offset(client, photo):
+    upload_id = _create(client, len(photo))
+    assert _patch(client, upload_id, 0, photo[:1000]).headers['Upload-Offset'] == '1000'
+
+    # A client that lost the response asks where to continue
+    head = client.head(f'/api/uploads/{upload_id}')
+    assert head.status_code == 200
+    assert head.headers['Upload-Offset'] == '1000'
+    assert head.headers['Upload-Length'] == str(len(photo))
+
+    assert _patch(client, upload_id, 1000, photo[1000:]).status_code == 204
+    response = client.post(f'/api/uploads/{upload_id}/finalize')
+    assert response.status_code == 200
+    session = response.get_json()
+    assert session["image_session_id"] == upload_id
+    assert session["initial_dimensions"] == {"width": 200, "height": 150}
+    with open(image_service.get_temp_filepath(upload_id, 'png'), 'rb') as f:
+        assert f.read() == photo
+    image_service.expire_session(upload_id)
+    residency.forget(upload_id)
+
+
+def test_chunk_at_the_wrong_offset_is_refused(client, photo):
+    upload_id = _create(client, len(photo))
+    _patch(client, upload_id, 0, photo[:1000])
+
+    response = _patch(client, upload_id, 500, photo[500:1500])
+    assert response.status_code == 409
+    assert response.headers['Upload-Offset'] == '1000'
+    assert response.get_json()["offset"] == 1000
+    assert upload_service.get_upload_status(upload_id)["offset"] == 1000 # Nothing appended
+    client.delete(f'/api/uploads/{upload_id}')
+
+
+def test_chunk_needs_the_offset_content_type(client, photo):
+    upload_id = _create(client, len(photo))
+    assert _patch(client, upload_id, 0, photo[:1000], content_type='application/octet-stream').status_code == 415
+    assert upload_service.get_upload_status(upload_id)["offset"] == 0
+    client.delete(f'/api/uploads/{upload_id}')
+
+
+def test_content_that_is_not_an_image_is_dropped_at_once(client):
+    data = b'MZ\x90\x00' + b'\x00' * 2000 # Not any accepted format's magic number
+    upload_id = _create(client, len(data))
+    part_path = upload_service._uploads[upload_id]["part_path"]
+
+    assert _patch(client, upload_id, 0, data[:100]).status_code == 400
+    assert not os.path.exists(part_path)
+    assert client.post(f'/api/uploads/{upload_id}/finalize').status_code == 404
+
+
+def test_finalize_rejects_a_corrupt_image(client, photo):
+    data = photo[:200] + b'\x00' * (len(photo) - 200) # Valid header, garbage pixels
+    upload_id = _create(client, len(data))
+    assert _patch(client, upload_id, 0, data).status_code == 204
+
+    assert client.post(f'/api/uploads/{upload_id}/finalize').status_code in (400, 415)
+    assert not os.path.exists(image_service.get_temp_filepath(upload_id, 'png'))
+    assert upload_id not in image_service.session_history
+
+
+def test_deleted_upload_is_gone_with_its_part_file(client, photo):
+    upload_id = _create(client, len(photo))
+    _patch(client, upload_id, 0, photo[:1000])
+    part_path = upload_service._uploads[upload_id]["part_path"]
+
+    assert client.delete(f'/api/uploads/{upload_id}').status_code == 204
+    assert not os.path.exists(part_path)
+    assert client.head(f'/api/uploads/{upload_id}').status_code == 404
+    assert client.delete(f'/api/uploads/{upload_id}').status_code == 404
+
+
+def test_unfinished_uploads_leave_no_session_state(client, photo):
+    upload_id = _create(client, len(photo))
+    _patch(client, upload_id, 0, photo[:1000])
+    assert upload_id not in residency.get_session_ids()
+    upload_service.prune_uploads(-1)
+    assert upload_service.get_upload_status(upload_id) is None
+    assert upload_id not in residency.get_session_ids()
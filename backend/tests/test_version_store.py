@@ -0,0 +1,152 @@
+import io
+import os
+import time
+import pytest
+import config
+from werkzeug.datastructures import FileStorage
+from services import image_service, residency, version_store
+from utils import file_helpers
+from conftest import make_photo, encoded_bytes
+
+
+@pytest.fixture(autouse=True)
+def empty_store(monkeypatch):
+    monkeypatch.setattr(version_store, '_blob_refs', {})
+    monkeypatch.setattr(version_store, '_unreferenced', {})
+    monkeypatch.setattr(version_store, '_ingested', version_store.OrderedDict())
+    monkeypatch.setattr(version_store, '_ingest_stats', {"hits": 0, "misses": 0})
+
+
+def _working_file(tmp_path, name, data):
+    # Working files are replaced, never rewritten in place: blobs share their bytes (hard links)
+    filepath = str(tmp_path / name)
+    file_helpers.atomic_write_bytes(filepath, data)
+    return filepath
+
+
+def _blobs():
+    return sorted(entry.path for entry in file_helpers.iter_files(config.VERSION_FOLDER))
+
+
+def test_identical_content_is_stored_once(tmp_path):
+    first = version_store.store_version(_working_file(tmp_path, 'a.png', b'same pixels'))
+    second = version_store.store_version(_working_file(tmp_path, 'b.png', b'same pixels'))
+    other = version_store.store_version(_working_file(tmp_path, 'c.png', b'other pixels'))
+
+    assert first == second != other
+    assert _blobs() == sorted([first, other])
+    assert version_store._blob_refs == {first: 2, other: 1}
+
+
+def test_blob_is_collected_after_its_last_reference(tmp_path):
+    filepath = _working_file(tmp_path, 'a.png', b'pixels')
+    blob_path = version_store.store_version(filepath)
+    version_store.store_version(filepath)
+
+    version_store.release_version(blob_path)
+    assert version_store.collect_garbage(3600) == (0, 0)
+    assert os.path.exists(blob_path)
+
+    version_store.release_version(blob_path)
+    assert version_store.collect_garbage(3600) == (1, 0)
+    assert not os.path.exists(blob_path)
+    assert version_store._blob_refs == {}
+
+
+def test_reference_taken_again_before_collection_keeps_the_blob(tmp_path):
+    blob_path = version_store.store_version(_working_file(tmp_path, 'a.png', b'pixels'))
+    version_store.release_version(blob_path)
+    version_store.adopt_version(blob_path) # e.g. undo back to it, or a restored session
+
+    assert version_store.collect_garbage(3600) == (0, 0)
+    assert os.path.exists(blob_path)
+
+
+def test_unknown_blobs_on_disk_are_only_collected_once_old(tmp_path):
+    old = version_store.store_version(_working_file(tmp_path, 'a.png', b'left over'))
+    recent = version_store.store_version(_working_file(tmp_path, 'b.png', b'another process'))
+    # As after a restart: on disk, never registered in this process
+    version_store._blob_refs.clear()
+    two_hours_ago = time.time() - 2 * 3600
+    os.utime(old, (two_hours_ago, two_hours_ago))
+
+    assert version_store.collect_garbage(3600) == (1, 0)
+    assert _blobs() == [recent]
+
+
+def test_restored_version_is_a_fresh_working_file(tmp_path):
+    filepath = _working_file(tmp_path, 'a.png', b'version one')
+    blob_path = version_store.store_version(filepath)
+    _working_file(tmp_path, 'a.png', b'version two')
+
+    version_store.restore_version(blob_path, filepath)
+    with open(filepath, 'rb') as f:
+        assert f.read() == b'version one'
+    assert time.time() - os.path.getmtime(filepath) < 60 # Not picked up by the cleanup job
+
+
+# --- Repeat uploads ---
+
+@pytest.fixture
+def upload():
+    session_ids = []
+
+    def upload_bytes(data):
+        session = image_service.save_uploaded_file(FileStorage(stream=io.BytesIO(data), filename='photo.png'))
+        session_ids.append(session["image_session_id"])
+        return session["image_session_id"], image_service.get_temp_filepath(session["image_session_id"], 'png')
+    yield upload_bytes
+    for session_id in session_ids:
+        image_service.release_session(session_id)
+
+
+def _original(session_id):
+    return image_service.session_history[session_id]["history"][0]
+
+
+def test_repeat_upload_links_the_existing_blob(upload):
+    data = encoded_bytes(make_photo(120, 90), 'PNG')
+    first, first_path = upload(data)
+    second, second_path = upload(data)
+
+    blob_path = _original(first)
+    assert _original(second) == blob_path
+    assert os.stat(second_path).st_ino == os.stat(blob_path).st_ino == os.stat(first_path).st_ino
+    assert _blobs() == [blob_path]
+    assert version_store._blob_refs == {blob_path: 2}
+    assert version_store.get_stats()["ingest_hits"] == 1
+
+
+def test_released_sessions_give_back_their_references(upload):
+    data = encoded_bytes(make_photo(120, 90), 'PNG')
+    first, _ = upload(data)
+    second, _ = upload(data)
+    blob_path = _original(first)
+
+    image_service.release_session(first)
+    assert version_store._blob_refs == {blob_path: 1}
+    image_service.release_session(second)
+    assert version_store._blob_refs == {}
+
+    # Still in the ingest index: the next upload of the same bytes takes a fresh reference
+    third, third_path = upload(data)
+    assert _original(third) == blob_path
+    assert version_store._blob_refs == {blob_path: 1}
+    assert os.stat(third_path).st_ino == os.stat(blob_path).st_ino
+
+
+def test_collected_blob_is_not_reused(upload, monkeypatch):
+    monkeypatch.setattr(config, 'INGEST_RETENTION_SECONDS', 0)
+    data = encoded_bytes(make_photo(120, 90), 'PNG')
+    first, _ = upload(data)
+    blob_path = _original(first)
+    image_service.release_session(first)
+    assert version_store.collect_garbage(3600) == (1, 0)
+
+    second, second_path = upload(data)
+    assert version_store.get_stats()["ingest_hits"] == 0 # Checked and verified again, not linked to nothing
+    with open(second_path, 'rb') as f:
+        assert f.read() == data
+    assert _original(second) == blob_path # Stored again under the same digest
+    assert os.path.exists(blob_path)
+    assert version_store._blob_refs == {blob_path: 1}
@@ -0,0 +1,70 @@
+import os
+import uuid
+import bisect
+import hashlib
+import threading
+import config # From backend/config.py
+
+# --- Session Affinity ---
+# When several backend processes run behind cluster.py's router, every session belongs to one of
+# them: its owner on a consistent-hash ring of the process ids, keyed by the id in the URL.
+# The router pushes the ring to each process (POST /api/cluster/ring); ids minted here (sessions,
+# resumable uploads, batches) are drawn until this process owns them, so new work never needs
+# to move. Without a ring (a single process) every id is owned locally.
+
+class HashRing:
+    """Consistent-hash ring with virtual nodes: adding or removing one of N members moves about 1/N of the keys."""
+
+    def __init__(self, members, virtual_nodes=None):
+        self.members = sorted(set(members))
+        virtual_nodes = virtual_nodes or config.AFFINITY_VIRTUAL_NODES
+        points = sorted((_hash(f"{member}#{i}"), member) for member in self.members for i in range(virtual_nodes))
+        self._points = [point for point, _ in points]
+        self._owners = [member for _, member in points]
+
+    def owner(self, key):
+        if not self._points:
+            return None
+        index = bisect.bisect(self._points, _hash(key)) % len(self._points)
+        return self._owners[index]
+
+
+def _hash(value):
+    return int.from_bytes(hashlib.md5(value.encode('utf-8')).digest()[:8], 'big')
+
+
+_ring = None
+_lock = threading.Lock()
+
+
+def get_node_id():
+    return os.environ.get('HAGUMA_NODE_ID') or None
+
+
+def set_ring(members):
+    """Installs the ring pushed by the router. Raises ValueError if this process isn't a member."""
+    node_id = get_node_id()
+    if not node_id or node_id not in members:
+        raise ValueError(f"This process ({node_id}) is not a member of the ring {members}.")
+    global _ring
+    with _lock:
+        _ring = HashRing(members)
+    return _ring
+
+
+def owns(key):
+    ring = _ring
+    return ring is None or ring.owner(key) == get_node_id()
+
+
+def new_id():
+    """A new uuid4 string owned by this process (about N draws with N processes)."""
+    while True:
+        candidate = str(uuid.uuid4())
+        if owns(candidate):
+            return candidate
+
+
+def get_state():
+    ring = _ring
+    return {"node_id": get_node_id(), "members": ring.members if ring else None}
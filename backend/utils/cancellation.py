@@ -0,0 +1,151 @@
+import time
+import socket
+import threading
+from contextlib import contextmanager
+import config # From backend/config.py
+
+# --- Cooperative Cancellation ---
+# A request runs its operation inside scope(), which sets a deadline (OPERATION_DEADLINES_SECONDS)
+# and an optional probe that reports whether the client has gone away. Long operations call
+# checkpoint() between processing bands and before anything is written, so abandoned work stops
+# early and the session's working file and history stay as they were.
+# Outside a scope (batch workers, CLI, live previews) checkpoint() does nothing.
+
+_local = threading.local()
+_stats = {"deadline_exceeded": 0, "client_disconnected": 0}
+_stats_lock = threading.Lock()
+# Outermost scopes and requests currently running in this process, and when the last one ended
+_running = {"scopes": 0, "requests": 0, "last_ended": 0.0}
+
+
+class OperationCancelled(BaseException):
+    """
+    Raised at a checkpoint once the request is abandoned.
+    BaseException so the services' broad `except Exception` wrappers pass it through untouched.
+    """
+    reason = 'cancelled'
+
+
+class DeadlineExceeded(OperationCancelled):
+    reason = 'deadline'
+
+
+class ClientDisconnected(OperationCancelled):
+    reason = 'disconnected'
+
+
+def get_deadline_seconds(kind):
+    return config.OPERATION_DEADLINES_SECONDS.get(kind, config.OPERATION_DEADLINES_SECONDS['default'])
+
+
+@contextmanager
+def scope(kind, disconnect_probe=None, deadline_seconds=None):
+    """Runs the block with a cancellation deadline for operation kind and an optional disconnect probe."""
+    if deadline_seconds is None:
+        deadline_seconds = get_deadline_seconds(kind)
+    previous = getattr(_local, 'scope', None)
+    _local.scope = {
+        "kind": kind,
+        "deadline": time.monotonic() + deadline_seconds if deadline_seconds else None,
+        "probe": disconnect_probe,
+        "next_probe": 0.0
+    }
+    if previous is None:
+        with _stats_lock:
+            _running["scopes"] += 1
+    try:
+        yield
+    finally:
+        _local.scope = previous
+        if previous is None:
+            with _stats_lock:
+                _running["scopes"] -= 1
+                _running["last_ended"] = time.monotonic()
+
+
+@contextmanager
+def continued(kind, deadline_seconds):
+    """
+    scope() on another thread or process for work handed off by a request that had deadline_seconds
+    left (its remaining_seconds(): None for no deadline). Raises DeadlineExceeded if that was none.
+    """
+    if deadline_seconds is not None and deadline_seconds <= 0:
+        _count("deadline_exceeded")
+        raise DeadlineExceeded(f"'{kind}' ran out of time before it started and was cancelled.")
+    # scope() reads a deadline of 0 as none at all
+    with scope(kind, deadline_seconds=deadline_seconds if deadline_seconds is not None else 0):
+        yield
+
+
+def is_active():
+    return getattr(_local, 'scope', None) is not None
+
+
+def request_started():
+    """Counts an HTTP request as running, cancellable or not (uploads, undo, downloads...)."""
+    with _stats_lock:
+        _running["requests"] += 1
+
+
+def request_finished():
+    with _stats_lock:
+        _running["requests"] -= 1
+        _running["last_ended"] = time.monotonic()
+
+
+def idle_seconds():
+    """How long no scope or request has been running in this process; 0.0 while one is."""
+    with _stats_lock:
+        if _running["scopes"] or _running["requests"]:
+            return 0.0
+        return time.monotonic() - _running["last_ended"]
+
+
+def remaining_seconds():
+    """Seconds left before the current scope's deadline, or None without one."""
+    current = getattr(_local, 'scope', None)
+    if current is None or current["deadline"] is None:
+        return None
+    return max(0.0, current["deadline"] - time.monotonic())
+
+
+def checkpoint():
+    """Raises DeadlineExceeded or ClientDisconnected if the current request was abandoned."""
+    current = getattr(_local, 'scope', None)
+    if current is None:
+        return
+    now = time.monotonic()
+    if current["deadline"] is not None and now > current["deadline"]:
+        _count("deadline_exceeded")
+        raise DeadlineExceeded(f"'{current['kind']}' took longer than {get_deadline_seconds(current['kind'])}s and was cancelled.")
+    # Probing costs a syscall, so it's rate limited
+    if current["probe"] is not None and now >= current["next_probe"]:
+        current["next_probe"] = now + config.DISCONNECT_PROBE_INTERVAL_SECONDS
+        if current["probe"]():
+            _count("client_disconnected")
+            raise ClientDisconnected(f"Client disconnected; '{current['kind']}' was cancelled.")
+
+
+def _count(key):
+    with _stats_lock:
+        _stats[key] += 1
+
+
+def socket_disconnect_probe(sock):
+    """
+    Returns a probe for the client connection: True once the peer has closed it.
+    The request body has already been read, so a readable socket with no data means EOF.
+    """
+    def probe():
+        try:
+            return sock.recv(1, socket.MSG_PEEK | socket.MSG_DONTWAIT) == b''
+        except (BlockingIOError, InterruptedError):
+            return False # Nothing to read: still connected
+        except OSError:
+            return True
+    return probe
+
+
+def get_stats():
+    with _stats_lock:
+        return dict(_stats)
@@ -2,13 +2,29 @@ import os
 from datetime import datetime, timedelta
 import config # From backend/config.py
 from flask import current_app # For logging if needed
+from services import image_service, residency, version_store, batch_service, upload_service
+from utils import file_helpers, affinity
+
+def _owner_key(filename):
+    # Working files are named after the id that owns them: <session>.<ext>, <session>_converted.<ext>,
+    # <batch>_<n>.upload, <batch>_batch.zip, <upload>.<ext> (uuids have no underscores or dots)
+    return filename.split('.')[0].split('_')[0]
 
 def cleanup_temp_files_job():
     """Scheduled job to clean up old temporary files."""
-    if not os.path.exists(config.TEMP_FOLDER):
+    run_cleanup()
+
+def run_cleanup():
+    """
+    Cleans up old temporary files, expired sessions and unreferenced versions.
+    Processes sharing TEMP_FOLDER (see cluster.py) each run it and only touch the files of the
+    sessions, batches and uploads they own: session history, residency entries and blob
+    references live in the owner's memory, and only the owner can release them.
+    """
+    if not os.path.exists(config.WORKING_FOLDER):
         # This case should ideally be handled by app startup creating the folder
-        if current_app: current_app.logger.warning(f"Temp folder {config.TEMP_FOLDER} does not exist. Cleanup skipped.")
-        else: print(f"Warning: Temp folder {config.TEMP_FOLDER} does not exist. Cleanup skipped.")
+        if current_app: current_app.logger.warning(f"Working folder {config.WORKING_FOLDER} does not exist. Cleanup skipped.")
+        else: print(f"Warning: Working folder {config.WORKING_FOLDER} does not exist. Cleanup skipped.")
         return
 
     now = datetime.now()
@@ -18,22 +34,75 @@ def cleanup_temp_files_job():
     # Using current_app.logger if available (i.e., when run within Flask context)
     logger = current_app.logger if current_app else None
 
-    for filename in os.listdir(config.TEMP_FOLDER):
-        file_path = os.path.join(config.TEMP_FOLDER, filename)
-        try:
-            # Check if it's a file and not a directory
-            if os.path.isfile(file_path):
-                file_mod_time = datetime.fromtimestamp(os.path.getmtime(file_path))
+    usage_bytes = 0
+    # Working files (hot and cold tier) are sharded into subdirectories; scandir keeps this cheap at 100k+ files
+    for folder in (config.WORKING_FOLDER, config.COLD_FOLDER):
+        for entry in file_helpers.iter_files(folder):
+            filename = entry.name
+            if not affinity.owns(_owner_key(filename)):
+                continue # Counted towards the disk quota by its owner
+            try:
+                stat = entry.stat()
+                file_mod_time = datetime.fromtimestamp(stat.st_mtime)
                 if now - file_mod_time > timedelta(hours=config.SESSION_TIMEOUT_HOURS):
-                    os.remove(file_path)
+                    os.remove(entry.path)
                     cleaned_count += 1
+                    # The session's working file is gone, so its history versions can be released
+                    name_parts = filename.split('.')
+                    if len(name_parts) == 2:
+                        image_service.expire_session(name_parts[0])
+                        residency.forget(name_parts[0])
                     if logger: logger.info(f"Cleanup: Deleted old temp file: {filename}")
                     else: print(f"Cleanup: Deleted old temp file: {filename}")
+                else:
+                    usage_bytes += stat.st_size
+            except Exception as e:
+                error_count +=1
+                if logger: logger.error(f"Cleanup: Error processing file {filename}: {e}")
+                else: print(f"Cleanup: Error processing file {filename}: {e}")
+
+    # Over the disk quota: evict the least recently used cold sessions before they time out
+    for entry in file_helpers.iter_files(config.VERSION_FOLDER):
+        try:
+            usage_bytes += entry.stat().st_size
+        except OSError:
+            pass
+    disk_quota_bytes = config.RESIDENCY_DISK_QUOTA_MB * 1024 * 1024
+    evicted_count = 0
+    for _, session_id, cold_filepath, size_bytes in residency.get_cold_sessions_by_age():
+        if usage_bytes <= disk_quota_bytes:
+            break
+        try:
+            if os.path.exists(cold_filepath):
+                os.remove(cold_filepath)
+            image_service.expire_session(session_id)
+            residency.forget(session_id, evicted=True)
+            usage_bytes -= size_bytes
+            evicted_count += 1
         except Exception as e:
-            error_count +=1
-            if logger: logger.error(f"Cleanup: Error processing file {filename}: {e}")
-            else: print(f"Cleanup: Error processing file {filename}: {e}")
+            error_count += 1
+            if logger: logger.error(f"Cleanup: Error evicting session {session_id}: {e}")
+            else: print(f"Cleanup: Error evicting session {session_id}: {e}")
+    if evicted_count:
+        if logger: logger.warning(f"Cleanup: Disk quota exceeded, evicted {evicted_count} cold sessions.")
+        else: print(f"Cleanup: Disk quota exceeded, evicted {evicted_count} cold sessions.")
     
-    msg = f"Cleanup job finished. Deleted: {cleaned_count} files. Errors: {error_count}."
+    # Finished batches are forgotten on the same schedule; their archives were deleted above
+    batch_service.prune_batches(config.SESSION_TIMEOUT_HOURS * 3600)
+    # Abandoned resumable uploads; the partial files of long-idle ones were deleted above already
+    upload_service.prune_uploads(config.UPLOAD_EXPIRY_SECONDS)
+
+    # Journaled sessions left without a working file would keep their versions referenced
+    journal_dropped = image_service.prune_journal()
+    if journal_dropped:
+        if logger: logger.info(f"Cleanup: Forgot {journal_dropped} journaled sessions without a working file.")
+        else: print(f"Cleanup: Forgot {journal_dropped} journaled sessions without a working file.")
+
+    # Version blobs are shared between sessions; only the ones nobody references any more go
+    blobs_deleted, blob_errors = version_store.collect_garbage(config.SESSION_TIMEOUT_HOURS * 3600)
+    cleaned_count += blobs_deleted
+    error_count += blob_errors
+
+    msg = f"Cleanup job finished. Deleted: {cleaned_count} files ({blobs_deleted} version blobs). Errors: {error_count}."
     if logger: logger.info(msg)
     else: print(msg)
\ No newline at end of file
@@ -0,0 +1,180 @@
+import os
+import json
+import time
+import logging
+import threading
+from collections import namedtuple
+from contextlib import contextmanager
+import config # From backend/config.py
+from utils import file_helpers, cancellation
+from utils.memory_budget import BYTES_PER_PIXEL
+
+# --- CPU Cost Model ---
+# How long an edit will take, before it runs. Each kind of work (a LANCZOS resize, a blur pass,
+# decoding a PNG, ...) costs a fixed overhead plus a rate per megapixel of RGB/RGBA pixels, fitted
+# by calibrate_costs.py from timed runs; the operation registry (services/operations.py) says
+# which kinds of work an edit does on how many megapixels. As edits finish, their measured
+# durations are compared with the estimates and each operation's estimates are scaled by its
+# recent measured-to-estimate ratio, so a model calibrated elsewhere settles on this machine's speed.
+
+logger = logging.getLogger(__name__)
+
+# cpu_seconds: all threads together; wall_seconds: as seen by the request
+Cost = namedtuple('Cost', ['cpu_seconds', 'wall_seconds', 'peak_bytes'])
+
+# { kind: (fixed seconds, seconds per megapixel) }, from calibrate_costs.py on one core of an
+# x86-64 server with Pillow 12; a calibration file at COST_MODEL_PATH takes precedence
+DEFAULT_COEFFICIENTS = {
+    'resize': (0.0, 0.0111),
+    'rotate': (0.0, 0.0019),
+    'flip': (0.0, 0.0016),
+    'crop': (0.0, 0.0006),
+    'smart-crop': (0.0068, 0.0025),
+    'grayscale': (0.0007, 0.0024),
+    'brightness': (0.0, 0.0035),
+    'contrast': (0.0, 0.0067),
+    'blur': (0.0, 0.0307),
+    'sharpen': (0.0, 0.0198),
+    'auto': (0.0, 0.0061),
+    # Working files, written with the formats' default settings
+    'decode-jpeg': (0.0, 0.0043),
+    'decode-png': (0.0, 0.0173),
+    'decode-webp': (0.0009, 0.0239),
+    'decode-gif': (0.003, 0.0083),
+    'encode-jpeg': (0.0, 0.0037),
+    'encode-png': (0.0, 0.2775),
+    'encode-webp': (0.0, 0.1424),
+    'encode-gif': (0.0, 0.1128),
+}
+
+CORRECTION_WEIGHT = 0.2 # Weight of each new measurement in an operation's correction
+CORRECTION_LIMITS = (0.25, 4.0)
+CORRECTION_MIN_SECONDS = 0.05 # Shorter edits are mostly noise and don't move the correction
+
+
+class CostLimitExceeded(cancellation.DeadlineExceeded):
+    """Raised before an edit starts when it is expected to run well past its deadline."""
+
+
+_lock = threading.Lock()
+_coefficients = None
+_corrections = {} # { op: measured / estimated wall time, smoothed }
+_stats = {"rejected": 0}
+_operation_stats = {} # { op: {"count", "estimate_seconds", "measured_seconds", "max_measured_seconds"} }
+
+
+def _load_coefficients():
+    coefficients = dict(DEFAULT_COEFFICIENTS)
+    if config.COST_MODEL_PATH and os.path.exists(config.COST_MODEL_PATH):
+        try:
+            with open(config.COST_MODEL_PATH, 'r') as f:
+                coefficients.update({kind: tuple(value) for kind, value in json.load(f)["coefficients"].items()})
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            logger.warning(f"Cost model: ignoring {config.COST_MODEL_PATH}: {e}")
+    return coefficients
+
+
+def get_coefficients():
+    global _coefficients
+    with _lock:
+        if _coefficients is None:
+            _coefficients = _load_coefficients()
+        return _coefficients
+
+
+def save_coefficients(coefficients, path, details=None):
+    """Writes fitted coefficients where _load_coefficients finds them (the next process start)."""
+    payload = {"coefficients": coefficients, "created": time.time(), **(details or {})}
+    file_helpers.atomic_write_bytes(path, json.dumps(payload, indent=2, sort_keys=True).encode('utf-8'))
+
+
+def work_seconds(work, mode='RGB'):
+    """Seconds for [(kind, megapixels), ...] of work on pixels in mode; unknown kinds cost nothing."""
+    coefficients = get_coefficients()
+    scale = BYTES_PER_PIXEL.get(mode, 4) / 4 # Per-pixel work follows the bytes touched (RGB is padded to 4)
+    seconds = 0.0
+    for kind, megapixels in work:
+        fixed, per_megapixel = coefficients.get(kind, (0.0, 0.0))
+        seconds += fixed + per_megapixel * megapixels * scale
+    return seconds
+
+
+def get_correction(op):
+    with _lock:
+        return _corrections.get(op, 1.0)
+
+
+def estimate(op, serial_work, parallel_work=(), parallelism=1, mode='RGB', peak_bytes=0):
+    """
+    Cost of op: serial_work runs on the request's thread, parallel_work is spread over parallelism
+    threads (animation frames). Both are [(kind, megapixels), ...].
+    """
+    correction = get_correction(op)
+    serial = work_seconds(serial_work, mode)
+    parallel = work_seconds(parallel_work, mode)
+    return Cost(
+        cpu_seconds=(serial + parallel) * correction,
+        wall_seconds=(serial + parallel / max(1, parallelism)) * correction,
+        peak_bytes=peak_bytes
+    )
+
+
+def admit(op, cost):
+    """
+    Raises CostLimitExceeded if op is expected to take more than COST_ADMISSION_FACTOR times what is
+    left of the current cancellation scope's deadline. Outside a scope (batch, CLI) everything runs.
+    """
+    remaining = cancellation.remaining_seconds()
+    if not config.COST_ADMISSION_FACTOR or remaining is None:
+        return
+    if cost.wall_seconds > remaining * config.COST_ADMISSION_FACTOR:
+        with _lock:
+            _stats["rejected"] += 1
+        raise CostLimitExceeded(
+            f"'{op}' on this image would take about {cost.wall_seconds:.0f}s, past its "
+            f"{cancellation.get_deadline_seconds(op)}s limit. Try a smaller image.")
+
+
+@contextmanager
+def metered(op, cost):
+    """Admits op (see admit), then times the block and records it against the estimate if it completes."""
+    admit(op, cost)
+    started = time.perf_counter()
+    yield
+    record(op, cost, time.perf_counter() - started)
+
+
+def record(op, cost, measured_seconds):
+    with _lock:
+        stats = _operation_stats.setdefault(op, {
+            "count": 0, "estimate_seconds": 0.0, "measured_seconds": 0.0, "max_measured_seconds": 0.0
+        })
+        stats["count"] += 1
+        stats["estimate_seconds"] += cost.wall_seconds
+        stats["measured_seconds"] += measured_seconds
+        stats["max_measured_seconds"] = max(stats["max_measured_seconds"], measured_seconds)
+
+        if cost.wall_seconds > 0 and max(cost.wall_seconds, measured_seconds) >= CORRECTION_MIN_SECONDS:
+            # The estimate already includes the current correction, so the ratio refines it
+            correction = _corrections.get(op, 1.0)
+            ratio = measured_seconds / cost.wall_seconds
+            correction *= 1.0 - CORRECTION_WEIGHT + CORRECTION_WEIGHT * ratio
+            low, high = CORRECTION_LIMITS
+            _corrections[op] = min(high, max(low, correction))
+
+
+def get_stats():
+    with _lock:
+        operations = {}
+        for op, stats in _operation_stats.items():
+            operations[op] = dict(stats)
+            operations[op]["correction"] = round(_corrections.get(op, 1.0), 3)
+            # Above 1.0 means edits ran slower than estimated
+            operations[op]["measured_to_estimate"] = (
+                round(stats["measured_seconds"] / stats["estimate_seconds"], 3) if stats["estimate_seconds"] else None)
+        return {
+            "calibration": config.COST_MODEL_PATH if config.COST_MODEL_PATH and os.path.exists(config.COST_MODEL_PATH) else None,
+            "admission_factor": config.COST_ADMISSION_FACTOR,
+            **_stats,
+            "operations": operations
+        }
@@ -0,0 +1,180 @@
+import os
+import errno
+import time
+import uuid
+import shutil
+import hashlib
+from PIL import Image
+import config # From backend/config.py
+
+# --- Temp Storage Layout ---
+# Files are sharded into hashed subdirectories (e.g. sessions/3f/a2/<session_id>.png) so no
+# single directory grows to 100k+ entries. All writes go to a temp file in the destination
+# directory and are swapped in with os.replace, so readers see either the old or the new file.
+
+REPLACE_RETRIES = 5
+REPLACE_RETRY_DELAY_SECONDS = 0.2
+
+
+def get_shard_dir(root, key):
+    """Returns the shard directory under root for key, e.g. root/3f/a2."""
+    digest = hashlib.sha1(key.encode('utf-8')).hexdigest()
+    parts = [digest[i * 2:(i + 1) * 2] for i in range(config.STORAGE_SHARD_DEPTH)]
+    return os.path.join(root, *parts)
+
+
+def ensure_storage_dirs():
+    """Creates the temp, working, cold and version roots. Returns the list of directories."""
+    directories = [config.TEMP_FOLDER, config.WORKING_FOLDER, config.COLD_FOLDER, config.VERSION_FOLDER]
+    for directory in directories:
+        os.makedirs(directory, exist_ok=True)
+    return directories
+
+
+def _temp_path_for(filepath):
+    # Same directory as the target so os.replace never crosses filesystems
+    return f"{filepath}.{uuid.uuid4()}.tmp"
+
+
+def replace_file(temp_filepath, filepath):
+    """
+    Atomically moves temp_filepath over filepath.
+    Retries on PermissionError to cope with Windows file locking; removes the temp file on failure.
+    """
+    for i in range(REPLACE_RETRIES):
+        try:
+            os.replace(temp_filepath, filepath)
+            return
+        except PermissionError:
+            if i == REPLACE_RETRIES - 1:
+                _remove_quietly(temp_filepath)
+                raise RuntimeError(f"Could not update image file {filepath} due to file lock. Please try again.")
+            time.sleep(REPLACE_RETRY_DELAY_SECONDS)
+        except Exception:
+            _remove_quietly(temp_filepath)
+            raise
+
+
+def _remove_quietly(filepath):
+    try:
+        if os.path.exists(filepath):
+            os.remove(filepath)
+    except OSError:
+        pass
+
+
+def atomic_write_bytes(filepath, data):
+    os.makedirs(os.path.dirname(filepath), exist_ok=True)
+    temp_filepath = _temp_path_for(filepath)
+    try:
+        with open(temp_filepath, 'wb') as f:
+            f.write(data)
+    except Exception:
+        _remove_quietly(temp_filepath)
+        raise
+    replace_file(temp_filepath, filepath)
+
+
+def atomic_write_with(filepath, write):
+    """Calls write(temp_filepath) to produce the file and swaps it in atomically."""
+    os.makedirs(os.path.dirname(filepath), exist_ok=True)
+    temp_filepath = _temp_path_for(filepath)
+    try:
+        write(temp_filepath)
+    except Exception:
+        _remove_quietly(temp_filepath)
+        raise
+    replace_file(temp_filepath, filepath)
+
+
+def atomic_copy(src_filepath, filepath):
+    """Copies src over filepath without exposing a partially written file. The copy gets a fresh mtime."""
+    os.makedirs(os.path.dirname(filepath), exist_ok=True)
+    temp_filepath = _temp_path_for(filepath)
+    try:
+        shutil.copyfile(src_filepath, temp_filepath)
+    except Exception:
+        _remove_quietly(temp_filepath)
+        raise
+    replace_file(temp_filepath, filepath)
+
+
+def atomic_move(src_filepath, filepath):
+    """
+    Moves src to filepath: a rename within a filesystem, else a copy (never seen half written)
+    followed by removing src. The result gets a fresh mtime, like atomic_copy.
+    """
+    os.makedirs(os.path.dirname(filepath), exist_ok=True)
+    try:
+        os.replace(src_filepath, filepath)
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+        atomic_copy(src_filepath, filepath)
+        os.remove(src_filepath)
+        return
+    try:
+        os.utime(filepath, None)
+    except OSError:
+        pass
+
+
+def atomic_link(src_filepath, filepath):
+    """
+    Makes filepath another name for src's contents without copying them (hard link), falling back
+    to a copy across filesystems. Only for files that are never written in place: every writer
+    here swaps in a new file, so the two names part ways at the first change.
+    The result gets a fresh mtime (shared with src), like atomic_copy.
+    """
+    os.makedirs(os.path.dirname(filepath), exist_ok=True)
+    temp_filepath = _temp_path_for(filepath)
+    try:
+        os.link(src_filepath, temp_filepath)
+    except OSError:
+        _remove_quietly(temp_filepath)
+        atomic_copy(src_filepath, filepath)
+        return
+    try:
+        os.utime(temp_filepath, None)
+    except OSError:
+        pass
+    replace_file(temp_filepath, filepath)
+
+
+def atomic_save_image(img, filepath, format=None, **save_kwargs):
+    """
+    Saves a Pillow image to filepath atomically.
+    The format is taken from filepath's extension unless given, since the temp name has none.
+    """
+    if not format:
+        ext = os.path.splitext(filepath)[1].lower()
+        format = Image.registered_extensions().get(ext)
+        if not format:
+            raise ValueError(f"Cannot determine image format for {filepath}")
+
+    os.makedirs(os.path.dirname(filepath), exist_ok=True)
+    temp_filepath = _temp_path_for(filepath)
+    try:
+        img.save(temp_filepath, format=format, **save_kwargs)
+    except Exception:
+        _remove_quietly(temp_filepath)
+        raise
+    replace_file(temp_filepath, filepath)
+
+
+def iter_files(root):
+    """Yields os.DirEntry objects for every file below root, walking shard directories."""
+    if not os.path.isdir(root):
+        return
+    stack = [root]
+    while stack:
+        directory = stack.pop()
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    elif entry.is_file(follow_symlinks=False):
+                        yield entry
+        except FileNotFoundError:
+            continue
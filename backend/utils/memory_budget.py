@@ -0,0 +1,309 @@
+import os
+import time
+import inspect
+import logging
+import functools
+import itertools
+import threading
+from contextlib import contextmanager
+from PIL import Image, UnidentifiedImageError
+import config # From backend/config.py
+from utils import cancellation
+
+# --- Memory Accounting ---
+# Before an operation runs, its peak allocation is estimated from the image size, mode and op
+# (decoded input + transformed copy + intermediates such as enhancer blends or RGB conversions).
+# The estimate is checked against a per-request ceiling and reserved against a per-worker
+# ceiling shared by all in-flight operations of this process; operations that don't fit wait
+# up to MEMORY_WAIT_SECONDS. Afterwards the process's RSS growth during the operation is
+# reported next to the estimate (with concurrent requests this is an upper bound).
+# The residency RAM tier has its own quota and is not part of these reservations.
+
+logger = logging.getLogger(__name__)
+MB = 1024 * 1024
+
+# Bytes per pixel of Pillow's in-memory storage (RGB is stored padded to 4 bytes)
+BYTES_PER_PIXEL = {'1': 1, 'L': 1, 'P': 1, 'I;16': 2, 'LA': 4, 'La': 4, 'RGB': 4, 'RGBA': 4, 'RGBa': 4,
+                   'CMYK': 4, 'YCbCr': 4, 'LAB': 4, 'HSV': 4, 'I': 4, 'F': 4}
+
+# Extra memory on top of the decoded input, as a multiple of the input's size
+OPERATION_OVERHEAD = {
+    'rotate': 1.0,      # Transposed copy
+    'flip': 1.0,
+    'crop': 1.0,        # Cropped copy (at most the input's size)
+    'grayscale': 2.25,  # L conversion, converted back, blended result
+    'brightness': 2.0,  # Black degenerate image + blended result
+    'contrast': 2.25,   # L conversion for the mean, degenerate image, blended result
+    'filter': 2.0,      # Blur/smooth pass + result
+    'auto': 1.5,        # L conversion for the luminance histogram + mapped result
+    'convert': 1.5,     # RGB conversion + encoded buffer
+}
+TARGET_SIZE_OVERHEAD = 1.5 # Concurrent candidate encodes in target-bytes mode
+
+
+class MemoryLimitExceeded(Exception):
+    """Raised when an operation doesn't fit the configured memory ceilings."""
+    status_code = 413
+    retry_after = None
+
+
+class WorkerMemoryBusy(MemoryLimitExceeded):
+    """Raised when in-flight operations leave no room for this one within MEMORY_WAIT_SECONDS."""
+    status_code = 503
+    retry_after = 5
+
+
+_condition = threading.Condition()
+_active = {} # { token: {"op", "estimate", "rss_start", "rss_peak"} }
+_tokens = itertools.count(1)
+_reserved_bytes = 0
+_sampler = None
+_stats = {"rejected_request_limit": 0, "rejected_worker_limit": 0, "waited": 0, "peak_reserved_bytes": 0}
+_operation_stats = {} # { op: {"count", "estimate_bytes", "measured_bytes", "max_estimate_bytes", "max_measured_bytes", "underestimates"} }
+
+
+def _bytes_per_pixel(mode):
+    return BYTES_PER_PIXEL.get(mode, 4)
+
+
+def _resize_dimensions(width, height, params):
+    # Mirrors image_service.apply_resize closely enough for an estimate
+    try:
+        if params.get('percentage'):
+            scale = float(params['percentage']) / 100.0
+            return max(1, int(width * scale)), max(1, int(height * scale))
+        target_w = int(params['width_px']) if params.get('width_px') else None
+        target_h = int(params['height_px']) if params.get('height_px') else None
+    except (TypeError, ValueError):
+        return width, height
+    if target_w and target_h:
+        return target_w, target_h # Upper bound of the aspect-preserving fit
+    if target_w:
+        return target_w, max(1, int(target_w * height / width))
+    if target_h:
+        return max(1, int(target_h * width / height)), target_h
+    return width, height
+
+
+def _estimate_step(op, width, height, bpp, params):
+    """Returns (extra bytes beyond the input, (output width, output height)) for one operation."""
+    size = width * height * bpp
+    if op == 'resize':
+        new_w, new_h = _resize_dimensions(width, height, params)
+        # Pillow resamples horizontally into an intermediate, then vertically
+        return new_w * height * bpp + new_w * new_h * bpp, (new_w, new_h)
+    if op == 'crop-custom':
+        try:
+            crop_w = min(width, max(1, int(params.get('width') or width)))
+            crop_h = min(height, max(1, int(params.get('height') or height)))
+        except (TypeError, ValueError):
+            crop_w, crop_h = width, height
+        return crop_w * crop_h * bpp, (crop_w, crop_h)
+    if op == 'rotate':
+        try:
+            turned = int(params.get('angle') or 0) in (90, -90)
+        except (TypeError, ValueError):
+            turned = False
+        return size, ((height, width) if turned else (width, height))
+    if op == 'convert':
+        overhead = OPERATION_OVERHEAD['convert'] + (TARGET_SIZE_OVERHEAD if params.get('target_bytes') else 0)
+        return int(size * overhead), (width, height)
+    return int(size * OPERATION_OVERHEAD.get(op, 1.0)), (width, height)
+
+
+def estimate_peak_bytes(op, width, height, mode, params=None):
+    """Estimated peak bytes held while op runs on a decoded width x height image in mode."""
+    params = params or {}
+    bpp = _bytes_per_pixel(mode)
+    input_bytes = width * height * bpp
+
+    if op != 'recipe':
+        extra, _ = _estimate_step(op, width, height, bpp, params)
+        return input_bytes + extra
+
+    # Recipes keep the decoded input alive while each step holds its own input and output
+    peak = 0
+    step_width, step_height = width, height
+    for index, (step_op, kwargs) in enumerate(params.get('recipe') or []):
+        extra, (step_width_out, step_height_out) = _estimate_step(step_op, step_width, step_height, bpp, kwargs)
+        step_input = step_width * step_height * bpp if index > 0 else 0
+        peak = max(peak, step_input + extra)
+        step_width, step_height = step_width_out, step_height_out
+    return input_bytes + peak
+
+
+def output_size(op, width, height, params=None):
+    """(width, height) of op's result on a width x height image, as far as the estimates know."""
+    params = params or {}
+    steps = (params.get('recipe') or []) if op == 'recipe' else [(op, params)]
+    for step_op, kwargs in steps:
+        _, (width, height) = _estimate_step(step_op, width, height, 4, kwargs)
+    return width, height
+
+
+def estimate_animation_bytes(op, width, height, frames, params=None):
+    """
+    Estimated peak bytes while op runs on every frame of a width x height animation: a window of
+    frames in flight, each costing what a still RGBA image would, plus the edited frames, which
+    are all held until the file is written (see services/animation.py).
+    """
+    params = params or {}
+    in_flight = min(frames, config.ANIMATION_FRAME_WINDOW) * estimate_peak_bytes(op, width, height, 'RGBA', params)
+    output_width, output_height = output_size(op, width, height, params)
+    return in_flight + frames * output_width * output_height * _bytes_per_pixel('RGBA')
+
+
+def image_geometry(filepath):
+    """(width, height, mode, frames) from the file's header, or None if it can't be read."""
+    # Header only; Pillow decodes pixel data lazily (counting GIF frames skips their pixel data too)
+    try:
+        with Image.open(filepath) as img:
+            return img.width, img.height, img.mode, getattr(img, 'n_frames', 1)
+    except (OSError, UnidentifiedImageError):
+        return None
+
+
+def _read_rss_bytes():
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        return None # Not Linux: estimates are still enforced, just not measured
+
+
+def _sample_rss():
+    global _sampler
+    while True:
+        rss = _read_rss_bytes()
+        with _condition:
+            if not _active or rss is None:
+                _sampler = None
+                return
+            for entry in _active.values():
+                entry["rss_peak"] = max(entry["rss_peak"], rss)
+        time.sleep(config.MEMORY_SAMPLE_SECONDS)
+
+
+@contextmanager
+def reserve(op, estimate_bytes, description=''):
+    """
+    Holds a reservation of estimate_bytes while the block runs, then records the measured RSS growth.
+    Raises MemoryLimitExceeded / WorkerMemoryBusy when the ceilings don't allow the operation,
+    and OperationCancelled if the request is abandoned while waiting for room.
+    """
+    global _reserved_bytes, _sampler
+    request_limit = config.MEMORY_REQUEST_LIMIT_MB * MB
+    worker_limit = config.MEMORY_WORKER_LIMIT_MB * MB
+
+    if request_limit and estimate_bytes > request_limit:
+        with _condition:
+            _stats["rejected_request_limit"] += 1
+        raise MemoryLimitExceeded(
+            f"'{op}' on this image needs about {estimate_bytes / MB:.0f} MB, above the "
+            f"{config.MEMORY_REQUEST_LIMIT_MB} MB per-request limit. Try a smaller image.")
+
+    token = next(_tokens)
+    deadline = time.monotonic() + config.MEMORY_WAIT_SECONDS
+    with _condition:
+        waited = False
+        # An operation alone always runs, even if its estimate exceeds the worker limit
+        while worker_limit and _reserved_bytes and _reserved_bytes + estimate_bytes > worker_limit:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                _stats["rejected_worker_limit"] += 1
+                raise WorkerMemoryBusy("The server is busy with other large images. Please try again shortly.")
+            # A request abandoned while it waits gives up its place (and never takes the memory)
+            cancellation.checkpoint()
+            waited = True
+            _condition.wait(min(remaining, config.DISCONNECT_PROBE_INTERVAL_SECONDS))
+        if waited:
+            _stats["waited"] += 1
+        _reserved_bytes += estimate_bytes
+        _stats["peak_reserved_bytes"] = max(_stats["peak_reserved_bytes"], _reserved_bytes)
+
+        rss_start = _read_rss_bytes()
+        entry = {"op": op, "estimate": estimate_bytes, "rss_start": rss_start, "rss_peak": rss_start or 0}
+        _active[token] = entry
+        if rss_start is not None and _sampler is None:
+            _sampler = threading.Thread(target=_sample_rss, name='memory-sampler', daemon=True)
+            _sampler.start()
+
+    try:
+        yield
+    finally:
+        rss_end = _read_rss_bytes()
+        with _condition:
+            _active.pop(token, None)
+            _reserved_bytes -= estimate_bytes
+            _condition.notify_all()
+            measured = None
+            if rss_start is not None and rss_end is not None:
+                measured = max(entry["rss_peak"], rss_end) - rss_start
+            _record(op, estimate_bytes, measured)
+        logger.info(
+            f"Memory: {op}{' ' + description if description else ''} estimated {estimate_bytes / MB:.1f} MB, "
+            f"measured {'n/a' if measured is None else f'{measured / MB:.1f} MB'} RSS growth")
+
+
+def _record(op, estimate_bytes, measured_bytes):
+    # Caller holds _condition
+    stats = _operation_stats.setdefault(op, {
+        "count": 0, "estimate_bytes": 0, "measured_bytes": 0,
+        "max_estimate_bytes": 0, "max_measured_bytes": 0, "underestimates": 0
+    })
+    stats["count"] += 1
+    stats["estimate_bytes"] += estimate_bytes
+    stats["max_estimate_bytes"] = max(stats["max_estimate_bytes"], estimate_bytes)
+    if measured_bytes is not None:
+        stats["measured_bytes"] += measured_bytes
+        stats["max_measured_bytes"] = max(stats["max_measured_bytes"], measured_bytes)
+        if measured_bytes > estimate_bytes:
+            stats["underestimates"] += 1
+
+
+def tracked(op):
+    """
+    Decorator for image_service functions taking filepath first: estimates, reserves and measures op.
+    The remaining arguments are passed to the estimator as params.
+    """
+    def decorator(func):
+        signature = inspect.signature(func)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            params = dict(bound.arguments)
+            geometry = image_geometry(params.pop('filepath'))
+            if geometry is None:
+                return func(*args, **kwargs) # Let the operation report the missing/corrupt file
+            width, height, mode, frames = geometry
+            if frames > 1:
+                estimate = estimate_animation_bytes(op, width, height, frames, params)
+                description = f"{width}x{height} {mode} x {frames} frames"
+            else:
+                estimate = estimate_peak_bytes(op, width, height, mode, params)
+                description = f"{width}x{height} {mode}"
+            with reserve(op, estimate, description):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def get_stats():
+    with _condition:
+        operations = {}
+        for op, stats in _operation_stats.items():
+            operations[op] = dict(stats)
+            # Above 1.0 means the estimates for this op are too low
+            operations[op]["measured_to_estimate"] = (
+                round(stats["measured_bytes"] / stats["estimate_bytes"], 3) if stats["estimate_bytes"] else None)
+        return {
+            "request_limit_bytes": config.MEMORY_REQUEST_LIMIT_MB * MB,
+            "worker_limit_bytes": config.MEMORY_WORKER_LIMIT_MB * MB,
+            "reserved_bytes": _reserved_bytes,
+            "in_flight": len(_active),
+            "rss_bytes": _read_rss_bytes(),
+            **_stats,
+            "operations": operations
+        }
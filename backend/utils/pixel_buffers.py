@@ -0,0 +1,178 @@
+import os
+import mmap
+import weakref
+import threading
+from collections import namedtuple
+from contextlib import contextmanager
+from multiprocessing import shared_memory
+from PIL import Image
+import config # From backend/config.py
+
+# --- Shared Pixel Buffers ---
+# Decoded images live in POSIX shared memory so compute worker processes (services/compute_pool.py)
+# can use them without pickling pixels: only a BufferHandle (segment name, mode, size) crosses the
+# process boundary. Both sides wrap the segment in place as a Pillow image, laid out the way Pillow
+# stores pixels itself (1 byte per pixel for L, 4 for RGB/RGBA/LA/CMYK/I/F), so no conversion is needed.
+# A segment is owned by the image wrapping it in this process: it is unlinked once that image is
+# garbage collected, i.e. when the RAM tier (services/residency.py) has dropped it and no request
+# still uses it. The kernel frees the memory when the last process has unmapped it.
+
+BufferHandle = namedtuple('BufferHandle', ['name', 'mode', 'size'])
+
+SHAREABLE_MODES = {'L', 'RGB', 'RGBA', 'LA', 'CMYK', 'I', 'F'}
+
+_lock = threading.Lock()
+_live_bytes = 0
+_stats = {"created": 0, "adopted": 0, "released": 0, "refused": 0}
+
+
+class BufferUnavailable(Exception):
+    """Raised when a segment can't be allocated (limit reached or /dev/shm full)."""
+
+
+def layout_bytes(mode, size):
+    """Bytes of an image's pixels in Pillow's layout (see SHAREABLE_MODES)."""
+    width, height = size
+    return width * height * (1 if mode == 'L' else 4)
+
+
+def is_shareable(img):
+    return img.mode in SHAREABLE_MODES and img.width > 0 and img.height > 0 and not getattr(img, 'is_animated', False)
+
+
+def handle_for(img):
+    """Returns the handle of the segment img wraps, or None if it isn't a shared buffer."""
+    return getattr(img, '_pixel_buffer', None)
+
+
+def map_pixels(buffer, mode, size, offset=0):
+    """
+    Returns an image whose pixels are buffer's memory from offset on (no copy); the image keeps
+    buffer alive. Writable unless the caller sets readonly.
+    """
+    # Image.frombuffer only maps a few modes in place and none with Pillow's 4-byte RGB layout,
+    # so map the buffer the way it does, with the target mode
+    core = Image.core.map_buffer(buffer, size, 'raw', offset, (mode, 0, 1))
+    return Image.new(mode, (0, 0))._new(core)
+
+
+def _wrap(shm, mode, size):
+    # The image gets a mapping of its own, unmapped once the last image using it is collected;
+    # shm is closed and only needed to unlink
+    mapping = mmap.mmap(shm._fd, layout_bytes(mode, size))
+    shm.close()
+    return map_pixels(mapping, mode, size)
+
+
+def _create(mode, size):
+    nbytes = layout_bytes(mode, size)
+    shm = shared_memory.SharedMemory(create=True, size=nbytes)
+    try:
+        # Reserve the pages now: a full /dev/shm then fails here instead of with SIGBUS on first write
+        if hasattr(os, 'posix_fallocate'):
+            os.posix_fallocate(shm._fd, 0, nbytes)
+    except OSError as e:
+        shm.close()
+        shm.unlink()
+        raise BufferUnavailable(f"Could not allocate {nbytes} bytes of shared memory: {e}")
+    return shm
+
+
+def _own(shm, view, mode, size, counter):
+    global _live_bytes
+    nbytes = layout_bytes(mode, size)
+    view.readonly = 1 # Shared pixels are never modified in place; Pillow copies on write
+    view._pixel_buffer = BufferHandle(shm.name, mode, size)
+    with _lock:
+        _live_bytes += nbytes
+        _stats[counter] += 1
+    weakref.finalize(view, _release, shm, nbytes)
+    return view
+
+
+def _release(shm, nbytes):
+    global _live_bytes
+    try:
+        shm.unlink()
+    except FileNotFoundError:
+        pass
+    with _lock:
+        _live_bytes -= nbytes
+        _stats["released"] += 1
+
+
+def share(img):
+    """
+    Returns img as an image backed by a shared buffer (img itself if it already is one), or None
+    if its mode can't be shared or PIXEL_BUFFER_LIMIT_MB is reached. Copies the pixels once.
+    """
+    if handle_for(img) is not None:
+        return img
+    if not is_shareable(img):
+        return None
+    nbytes = layout_bytes(img.mode, img.size)
+    with _lock:
+        if _live_bytes + nbytes > config.PIXEL_BUFFER_LIMIT_MB * 1024 * 1024:
+            _stats["refused"] += 1
+            return None
+    try:
+        shm = _create(img.mode, img.size)
+    except BufferUnavailable:
+        with _lock:
+            _stats["refused"] += 1
+        return None
+    view = _wrap(shm, img.mode, img.size)
+    view.paste(img)
+    if img.info:
+        view.info = dict(img.info)
+    return _own(shm, view, img.mode, img.size, "created")
+
+
+def adopt(handle):
+    """Wraps a segment another process created (see export) and takes over its cleanup."""
+    shm = shared_memory.SharedMemory(name=handle.name)
+    return _own(shm, _wrap(shm, handle.mode, handle.size), handle.mode, handle.size, "adopted")
+
+
+# Worker side: a worker maps the caller's segment read-only for the duration of a task and hands
+# its result back in a new segment, which the caller adopts. Neither owns the other's segment.
+
+@contextmanager
+def attached(handle):
+    """Yields the image for a handle, read-only; it is unusable after the block."""
+    view = _wrap(shared_memory.SharedMemory(name=handle.name), handle.mode, handle.size)
+    view.readonly = 1
+    try:
+        yield view
+    finally:
+        view.close() # Unmaps the segment unless a result still shares the pixels
+
+
+def export(img):
+    """Copies img into a new segment for another process to adopt() and returns its handle."""
+    if not is_shareable(img):
+        raise BufferUnavailable(f"Images in mode {img.mode} can't be shared.")
+    shm = _create(img.mode, img.size)
+    view = _wrap(shm, img.mode, img.size)
+    view.paste(img)
+    view.close()
+    return BufferHandle(shm.name, img.mode, img.size)
+
+
+def discard(handle):
+    """Unlinks an exported segment nobody is going to adopt."""
+    try:
+        segment = shared_memory.SharedMemory(name=handle.name)
+    except FileNotFoundError:
+        return
+    segment.close()
+    segment.unlink()
+
+
+def get_stats():
+    with _lock:
+        return {
+            **_stats,
+            "live_bytes": _live_bytes,
+            "limit_bytes": config.PIXEL_BUFFER_LIMIT_MB * 1024 * 1024
+        }
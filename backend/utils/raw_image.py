@@ -0,0 +1,86 @@
+import os
+import mmap
+import struct
+import hashlib
+from utils import file_helpers, pixel_buffers
+
+# --- Raw Working Images ---
+# With RAW_WORKING_IMAGES, a session's current pixels are also kept uncompressed next to its
+# working file as "<session>.<ext>.raw": a fixed header followed by the rows, top to bottom, in
+# Pillow's own layout. The file is memory-mapped instead of decoded, so a crop or region read
+# only pages in the rows it touches. It is written from pixels already in hand (at ingest and
+# after each edit). Encoded formats are only read at ingest and when a working file was replaced
+# by other means (undo/redo, /update); the header records the working file (device, inode, size)
+# it was written for, so such a raw copy is recognised as stale. An inode freed with its file can
+# be given to a new one, so the header also holds the SHA-256 of the working file's bytes, checked
+# before the copy is used. (Not the mtime: the version store and the cold tier refresh it without
+# changing the pixels.) Hashing the encoded file still costs far less than decoding it.
+
+MAGIC = b'HGRAW2'
+HEADER_SIZE = 4096 # Rows start page aligned
+HASH_CHUNK_SIZE = 1024 * 1024
+_HEADER = struct.Struct('<6s10sIIQQQ32s') # magic, mode, width, height, working file token, its digest
+
+
+def raw_path_for(filepath):
+    return f"{filepath}.raw"
+
+
+def is_supported(img):
+    return pixel_buffers.is_shareable(img)
+
+
+def _digest(filepath):
+    digest = hashlib.sha256()
+    with open(filepath, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.digest()
+
+
+def write(img, filepath, source_token):
+    """Writes img's pixels as the raw copy of the working file at filepath, identified by source_token."""
+    nbytes = pixel_buffers.layout_bytes(img.mode, img.size)
+    source_digest = _digest(filepath)
+
+    def write_raw(temp_filepath):
+        with open(temp_filepath, 'w+b') as f:
+            f.write(_HEADER.pack(MAGIC, img.mode.encode('ascii'), img.width, img.height, *source_token, source_digest))
+            f.truncate(HEADER_SIZE + nbytes)
+            mapping = mmap.mmap(f.fileno(), HEADER_SIZE + nbytes)
+        rows = pixel_buffers.map_pixels(mapping, img.mode, img.size, offset=HEADER_SIZE)
+        rows.paste(img)
+        rows.close() # Unmaps; the pages reach the file through the page cache
+
+    file_helpers.atomic_write_with(raw_path_for(filepath), write_raw)
+
+
+def open_mapped(filepath, source_token):
+    """
+    Returns the raw copy of the working file at filepath as a read-only memory-mapped image, or
+    None if it is missing, stale (written for different contents) or unreadable.
+    """
+    try:
+        with open(raw_path_for(filepath), 'rb') as f:
+            magic, mode, width, height, *token, source_digest = _HEADER.unpack(f.read(_HEADER.size))
+            mode = mode.rstrip(b'\0').decode('ascii')
+            if magic != MAGIC or tuple(token) != tuple(source_token) or mode not in pixel_buffers.SHAREABLE_MODES:
+                return None
+            expected = HEADER_SIZE + pixel_buffers.layout_bytes(mode, (width, height))
+            if os.fstat(f.fileno()).st_size != expected:
+                return None
+            if _digest(filepath) != source_digest:
+                return None # Same inode and size, other contents
+            mapping = mmap.mmap(f.fileno(), expected, access=mmap.ACCESS_READ)
+    except (OSError, ValueError, struct.error):
+        return None
+    img = pixel_buffers.map_pixels(mapping, mode, (width, height), offset=HEADER_SIZE)
+    img.readonly = 1 # The mapping is read-only; Pillow copies before any in-place change
+    return img
+
+
+def remove(raw_path):
+    try:
+        os.remove(raw_path)
+    except OSError:
+        pass
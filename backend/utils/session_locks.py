@@ -0,0 +1,87 @@
+import itertools
+import threading
+from collections import deque
+import config # From backend/config.py
+
+# --- Per-Session Serialization ---
+# Requests that modify a session run one at a time, in arrival order.
+# For coalesced kinds (slider-style adjustments), a request that is still waiting when a newer
+# request of the same kind arrives is dropped with RequestSuperseded instead of running.
+# { session_id: { "condition": Condition, "queue": deque([ticket, ...]), "latest": { kind: ticket } } }
+_sessions = {}
+_registry_lock = threading.Lock()
+_tickets = itertools.count(1)
+_stats = {"executed": 0, "superseded": 0}
+
+
+class RequestSuperseded(Exception):
+    """Raised when a newer request of the same kind is already queued for the session."""
+    pass
+
+
+def run_exclusive(session_id, kind, func, coalesce=None):
+    """
+    Runs func() while holding the session's lock and returns its result.
+    Raises RequestSuperseded if a newer request of the same kind arrived while this one waited.
+    """
+    if coalesce is None:
+        coalesce = kind in config.COALESCED_OPERATIONS
+    ticket = next(_tickets)
+
+    with _registry_lock:
+        state = _sessions.get(session_id)
+        if state is None:
+            state = {"condition": threading.Condition(_registry_lock), "queue": deque(), "latest": {}}
+            _sessions[session_id] = state
+        state["queue"].append(ticket)
+        if coalesce:
+            state["latest"][kind] = ticket
+            # Wake older waiters of the same kind so they can bail out right away
+            state["condition"].notify_all()
+
+        try:
+            while True:
+                if coalesce and state["latest"].get(kind) != ticket:
+                    _stats["superseded"] += 1
+                    raise RequestSuperseded(f"A newer '{kind}' request for this image replaced this one.")
+                if state["queue"][0] == ticket:
+                    break
+                state["condition"].wait()
+        except BaseException:
+            state["queue"].remove(ticket)
+            _release_state(session_id, state, kind, ticket)
+            raise
+
+    try:
+        return func()
+    finally:
+        with _registry_lock:
+            state["queue"].popleft()
+            _stats["executed"] += 1
+            _release_state(session_id, state, kind, ticket)
+
+
+def _release_state(session_id, state, kind, ticket):
+    # Caller holds _registry_lock
+    if state["latest"].get(kind) == ticket:
+        del state["latest"][kind]
+    if state["queue"]:
+        state["condition"].notify_all()
+    else:
+        _sessions.pop(session_id, None)
+
+
+def is_busy(session_id):
+    """True if a request for the session is running or waiting."""
+    with _registry_lock:
+        return session_id in _sessions
+
+
+def get_stats():
+    with _registry_lock:
+        return {
+            "sessions_busy": len(_sessions),
+            "requests_waiting": sum(max(0, len(state["queue"]) - 1) for state in _sessions.values()),
+            "requests_executed": _stats["executed"],
+            "requests_superseded": _stats["superseded"]
+        }
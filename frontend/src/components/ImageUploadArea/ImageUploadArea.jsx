@@ -1,8 +1,10 @@
 import React, { useState, useCallback } from 'react';
-import { uploadImage as apiUploadImage } from '../../services/apiService'; // Renamed to avoid conflict
+import { uploadImage as apiUploadImage, uploadImageResumable as apiUploadImageResumable } from '../../services/apiService'; // Renamed to avoid conflict
 import styles from './ImageUploadArea.module.css'; // Create ImageUploadArea.module.css
 // import { UploadCloud } from 'lucide-react'; // Example icon library
 
+const RESUMABLE_UPLOAD_THRESHOLD = 2 * 1024 * 1024; // Larger files are sent in resumable chunks
+
 function ImageUploadArea({ onImageUploaded, setIsLoading, setError, clearError }) {
     const [dragOver, setDragOver] = useState(false);
 
@@ -12,8 +14,8 @@ function ImageUploadArea({ onImageUploaded, setIsLoading, setError, clearError }
             const file = selectedFiles[0];
             
             // Basic client-side validation (optional, backend does more thorough)
-            if (!['image/jpeg', 'image/png'].includes(file.type)) {
-                setError('Invalid file type. Please upload JPEG or PNG.');
+            if (!['image/jpeg', 'image/png', 'image/gif', 'image/webp'].includes(file.type)) {
+                setError('Invalid file type. Please upload JPEG, PNG, GIF or WebP.');
                 return;
             }
             if (file.size > 12 * 1024 * 1024) { // 12MB
@@ -23,7 +25,9 @@ function ImageUploadArea({ onImageUploaded, setIsLoading, setError, clearError }
 
             setIsLoading(true);
             try {
-                const sessionData = await apiUploadImage(file);
+                const sessionData = file.size > RESUMABLE_UPLOAD_THRESHOLD
+                    ? await apiUploadImageResumable(file)
+                    : await apiUploadImage(file);
                 onImageUploaded(sessionData, file); // Pass raw file for blob URL creation
             } catch (err) {
                 setError(err.message || 'Upload failed. Please try again.');
@@ -73,14 +77,14 @@ function ImageUploadArea({ onImageUploaded, setIsLoading, setError, clearError }
                 type="file"
                 id="fileInput"
                 className={styles.fileInput}
-                accept=".jpg,.jpeg,.png"
+                accept=".jpg,.jpeg,.png,.gif,.webp"
                 onChange={onFileInputChange}
             />
             {/* <UploadCloud size={48} className={styles.uploadIcon} /> */}
             <p className={styles.uploadText}>
                 Drag & drop an image here, or <span>click to select</span>.
             </p>
-            <p className={styles.uploadHint}>JPEG, PNG supported. Max 12MB.</p>
+            <p className={styles.uploadHint}>JPEG, PNG, GIF and WebP (including animations) supported. Max 12MB.</p>
         </div>
     );
 }
@@ -15,6 +15,59 @@ export const uploadImage = async (file) => {
     return response.json();
 };
 
+export const uploadImageResumable = async (file, { chunkSize = 1024 * 1024, maxRetries = 5, onProgress } = {}) => {
+    // Chunked upload that survives dropped connections: after a failed chunk, asks the server
+    // how far it got and continues from there. Resolves with the same data as uploadImage.
+    const createResponse = await fetch(`${API_BASE_URL}/uploads`, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ filename: file.name, length: file.size }),
+    });
+    if (!createResponse.ok) {
+        const errorData = await createResponse.json().catch(() => ({ error: "Network error" }));
+        throw new Error(errorData.error || `Upload failed with status: ${createResponse.status}`);
+    }
+    const { upload_id: uploadId } = await createResponse.json();
+    const uploadUrl = `${API_BASE_URL}/uploads/${uploadId}`;
+
+    let offset = 0;
+    let retries = 0;
+    while (offset < file.size) {
+        try {
+            const response = await fetch(uploadUrl, {
+                method: 'PATCH',
+                headers: { 'Content-Type': 'application/offset+octet-stream', 'Upload-Offset': String(offset) },
+                body: file.slice(offset, offset + chunkSize),
+            });
+            if (response.status === 400 || response.status === 404 || response.status === 415) {
+                // Rejected content or expired upload: retrying won't help
+                const errorData = await response.json().catch(() => ({ error: "Network error" }));
+                throw Object.assign(new Error(errorData.error || `Upload failed with status: ${response.status}`), { fatal: true });
+            }
+            if (!response.ok && response.status !== 409) {
+                throw new Error(`Upload chunk failed with status: ${response.status}`);
+            }
+            // 204 and 409 (offset mismatch) both report where the server is
+            offset = parseInt(response.headers.get('Upload-Offset'), 10);
+            retries = 0;
+            if (onProgress) onProgress(offset / file.size);
+        } catch (err) {
+            if (err.fatal || retries >= maxRetries) throw err;
+            retries += 1;
+            await new Promise((resolve) => setTimeout(resolve, 500 * 2 ** retries));
+            const head = await fetch(uploadUrl, { method: 'HEAD' }).catch(() => null);
+            if (head && head.ok) offset = parseInt(head.headers.get('Upload-Offset'), 10);
+        }
+    }
+
+    const response = await fetch(`${uploadUrl}/finalize`, { method: 'POST' });
+    if (!response.ok) {
+        const errorData = await response.json().catch(() => ({ error: "Network error or unparseable JSON response" }));
+        throw new Error(errorData.error || `Upload failed with status: ${response.status}`);
+    }
+    return response.json();
+};
+
 export const resizeImage = async (sessionId, originalExtension, params) => {
     const response = await fetch(`${API_BASE_URL}/process/${sessionId}/${originalExtension}/resize`, {
         method: 'POST',
@@ -54,11 +107,12 @@ export const flipImage = async (sessionId, originalExtension, axis) => {
     return response.json();
 };
 
-export const cropImage = async (sessionId, originalExtension, preset) => {
+export const cropImage = async (sessionId, originalExtension, preset, anchor = 'center') => {
+    // anchor: 'center', or 'smart' to keep the most detailed region
     const response = await fetch(`${API_BASE_URL}/process/${sessionId}/${originalExtension}/crop`, {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
-        body: JSON.stringify({ preset }),
+        body: JSON.stringify({ preset, anchor }),
     });
     if (!response.ok) {
         const errorData = await response.json().catch(() => ({ error: "Network error" }));
@@ -132,6 +186,29 @@ export const applyFilter = async (sessionId, originalExtension, type, intensity
     return response.json();
 };
 
+export const autoAdjust = async (sessionId, originalExtension, mode = 'levels', clip = 0.5) => {
+    // mode: 'levels', 'contrast' or 'white-balance'
+    const response = await fetch(`${API_BASE_URL}/process/${sessionId}/${originalExtension}/auto`, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ mode, clip }),
+    });
+    if (!response.ok) {
+        const errorData = await response.json().catch(() => ({ error: "Network error" }));
+        throw new Error(errorData.error || `Auto adjustment failed with status: ${response.status}`);
+    }
+    return response.json();
+};
+
+export const getHistogram = async (sessionId, originalExtension) => {
+    const response = await fetch(`${API_BASE_URL}/histogram/${sessionId}/${originalExtension}`);
+    if (!response.ok) {
+        const errorData = await response.json().catch(() => ({ error: "Network error" }));
+        throw new Error(errorData.error || `Histogram request failed with status: ${response.status}`);
+    }
+    return response.json();
+};
+
 export const undoImage = async (sessionId, originalExtension) => {
     const response = await fetch(`${API_BASE_URL}/process/${sessionId}/${originalExtension}/undo`, {
         method: 'POST',
@@ -169,7 +246,7 @@ export const updateImage = async (sessionId, originalExtension, blob) => {
     return response.json();
 };
 
-export const getDownloadUrl = (sessionId, originalExtension, format = null, filename = null) => {
+export const getDownloadUrl = (sessionId, originalExtension, format = null, filename = null, { preset = null, targetKb = null } = {}) => {
     let url = `${API_BASE_URL}/download/${sessionId}/${originalExtension}`;
     const params = new URLSearchParams();
     if (format) {
@@ -178,8 +255,99 @@ export const getDownloadUrl = (sessionId, originalExtension, format = null, file
     if (filename) {
         params.append('filename', filename);
     }
+    if (preset) {
+        params.append('preset', preset);
+    }
+    if (targetKb) {
+        params.append('target_kb', targetKb);
+    }
     if (params.toString()) {
         url += `?${params.toString()}`;
     }
     return url;
-};
\ No newline at end of file
+};
+export const exportImage = async (sessionId, originalExtension, exports, filename = null) => {
+    // exports: [{ format: 'webp', preset: 'web', max_dimension: 1200, target_bytes: 150000, name: 'web' }, ...]
+    // Resolves with a zip Blob
+    const response = await fetch(`${API_BASE_URL}/export/${sessionId}/${originalExtension}`, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ exports, filename }),
+    });
+    if (!response.ok) {
+        const errorData = await response.json().catch(() => ({ error: "Network error" }));
+        throw new Error(errorData.error || `Export failed with status: ${response.status}`);
+    }
+    return response.blob();
+};
+
+export const createBatch = async (files, recipe, { sessions = [], format = null } = {}) => {
+    const formData = new FormData();
+    files.forEach((file) => formData.append('files', file));
+    formData.append('recipe', JSON.stringify(recipe));
+    formData.append('sessions', JSON.stringify(sessions));
+    if (format) {
+        formData.append('format', format);
+    }
+
+    const response = await fetch(`${API_BASE_URL}/batch`, {
+        method: 'POST',
+        body: formData,
+    });
+    if (!response.ok) {
+        const errorData = await response.json().catch(() => ({ error: "Network error" }));
+        throw new Error(errorData.error || `Batch failed with status: ${response.status}`);
+    }
+    return response.json();
+};
+
+export const followBatch = async (batchId, onEvent) => {
+    // Reads newline-delimited JSON updates until the batch is done; resolves with the final status
+    const response = await fetch(`${API_BASE_URL}/batch/${batchId}/events`);
+    if (!response.ok) {
+        const errorData = await response.json().catch(() => ({ error: "Network error" }));
+        throw new Error(errorData.error || `Batch status failed with status: ${response.status}`);
+    }
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffered = '';
+    let finalStatus = null;
+    for (;;) {
+        const { done, value } = await reader.read();
+        if (done) break;
+        buffered += decoder.decode(value, { stream: true });
+        const lines = buffered.split('\n');
+        buffered = lines.pop();
+        lines.filter((line) => line).forEach((line) => {
+            const event = JSON.parse(line);
+            if (event.type === 'done') finalStatus = event;
+            if (onEvent) onEvent(event);
+        });
+    }
+    return finalStatus;
+};
+
+export const getBatchDownloadUrl = (batchId) => `${API_BASE_URL}/batch/${batchId}/download`;
+
+export const openLiveAdjustChannel = (sessionId, originalExtension, { onFrame, onMessage } = {}) => {
+    const protocol = window.location.protocol === 'https:' ? 'wss' : 'ws';
+    const socket = new WebSocket(`${protocol}://${window.location.host}${API_BASE_URL}/live/${sessionId}/${originalExtension}`);
+    socket.binaryType = 'blob';
+    socket.onmessage = (event) => {
+        if (typeof event.data === 'string') {
+            if (onMessage) onMessage(JSON.parse(event.data));
+        } else if (onFrame) {
+            onFrame(event.data); // JPEG preview frame
+        }
+    };
+    const send = (type, op, params) => {
+        if (socket.readyState === WebSocket.OPEN) {
+            socket.send(JSON.stringify({ type, op, params }));
+        }
+    };
+    return {
+        adjust: (op, params) => send('adjust', op, params),
+        commit: (op, params) => send('commit', op, params),
+        close: () => socket.close(),
+    };
+};